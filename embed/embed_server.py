@@ -1,14 +1,27 @@
 # File: embed/embed_server.py (place next to Dockerfile)
 # FastAPI embedding server using torchvision ResNet50 features (2048D)
-# projected to DIM (default 1024) via a fixed, deterministic random matrix.
+# projected to DIM (default 1024) via a fixed, deterministic random matrix,
+# or via a fitted PCA/whitening projection from fit_projection.py when
+# PROJECTION_PATH is set (DIM then comes from the file).
 # Endpoints:
-#   GET  /health -> { ok, has_model, model, dim }
-#   POST /embed  -> { embedding[], dim, normalized, norm, bytes_sha256, mode }
+#   GET  /health -> { ok, has_model, model, dim, projection }
+#   POST /embed  -> { embedding[], dim, normalized, norm, bytes_sha256, mode, projection, roi }
+#   GET  /metrics -> Prometheus text (see service_metrics.py)
+#
+# PROFILE_SAMPLE_RATE (or X-Profile: 1 with PROFILE_ALLOW_HEADER=1) writes
+# per-request stack profiles (see service_profiling.py).
+#
+# ROI_CROP=1 (or "roi": true per request) crops to the animal before the
+# transform; see roi.py.
+#
+# PRELOAD_MODEL=1 loads the weights at import instead of on the first request;
+# gunicorn_conf.py sets it so workers share one copy.
 
 import base64
 import hashlib
 import io
 import os
+import time
 from typing import Optional
 
 import numpy as np
@@ -21,11 +34,20 @@ from pydantic import BaseModel
 from PIL import Image
 from torchvision.models import resnet50, ResNet50_Weights
 
+import projection
+import service_metrics as metrics
+from service_profiling import install as install_profiling, profiled
+from roi import RoiCache, to_pixels
+
 # --- Config ---
 DIM = int(os.getenv("DIM", "1024"))
 if DIM <= 0 or DIM > 2048:
     DIM = 1024
+PROJECTION_PATH = os.getenv("PROJECTION_PATH")
+_projection = projection.load(PROJECTION_PATH) if PROJECTION_PATH else projection.random_projection(DIM)
+DIM = _projection.dim
 MODEL_NAME = "resnet50"
+ROI_CROP = os.getenv("ROI_CROP", "0") == "1"
 
 # --- App ---
 app = FastAPI()
@@ -38,17 +60,21 @@ app.add_middleware(
 
 # --- Globals ---
 _feature_net: Optional[nn.Module] = None
-_proj: Optional[np.ndarray] = None
 _transform = None
 _HAS_MODEL = False
+_roi = RoiCache(int(os.getenv("ROI_CACHE_SIZE", "4096")))
+metrics.instrument(app, "embed")
+install_profiling(app, "embed")
+metrics.watch_cache("roi", _roi.stats)
 
 class EmbedRequest(BaseModel):
     image_url: Optional[str] = None
     image_base64: Optional[str] = None
+    roi: Optional[bool] = None
 
 
 def _lazy_init():
-    global _feature_net, _proj, _transform, _HAS_MODEL
+    global _feature_net, _transform, _HAS_MODEL
     if _feature_net is not None:
         return
     # Load ResNet50 with ImageNet weights (already cached in Docker image)
@@ -58,19 +84,24 @@ def _lazy_init():
     _feature_net = nn.Sequential(*list(model.children())[:-1])  # -> (B,2048,1,1)
     _feature_net.eval()
 
-    # Deterministic random projection 2048 -> DIM
-    rng = np.random.default_rng(123456789)
-    _proj = rng.normal(0.0, 1.0 / np.sqrt(2048), size=(2048, DIM)).astype(np.float32)
-
     # Image preprocessing pipeline (Resize+CenterCrop+ToTensor+Normalize)
     _transform = weights.transforms()
 
     _HAS_MODEL = True
 
 
+# Under gunicorn_conf.py the master loads the weights once and workers share them.
+if os.getenv("PRELOAD_MODEL", "0") == "1":
+    _lazy_init()
+
+
 @app.get("/health")
 def health():
-    return {"ok": True, "has_model": bool(_HAS_MODEL), "model": MODEL_NAME, "dim": int(DIM)}
+    return {
+        "ok": True, "has_model": bool(_HAS_MODEL), "model": MODEL_NAME, "dim": int(DIM),
+        "projection": {"mode": _projection.mode, "version": _projection.version},
+        "roi": {"enabled": ROI_CROP, "cache": _roi.stats()},
+    }
 
 
 def _load_image_bytes(req: EmbedRequest) -> bytes:
@@ -94,31 +125,47 @@ def _load_image_bytes(req: EmbedRequest) -> bytes:
 
 
 @app.post("/embed")
+@profiled
 def embed(req: EmbedRequest):
     _lazy_init()
 
-    img_bytes = _load_image_bytes(req)
+    with metrics.stage("fetch"):
+        img_bytes = _load_image_bytes(req)
     digest = hashlib.sha256(img_bytes).hexdigest()
 
     # Open image
     try:
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+        with metrics.stage("decode"):
+            img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"cannot open image: {e}")
 
+    # Optional crop to the animal
+    box = None
+    roi_ms = 0
+    if ROI_CROP if req.roi is None else req.roi:
+        t = time.time()
+        with metrics.stage("roi"):
+            box = _roi.box_for(digest, np.asarray(img))
+            if box is not None:
+                img = img.crop(to_pixels(box, img.width, img.height))
+        roi_ms = int((time.time() - t) * 1000)
+
     # Preprocess
-    x = _transform(img).unsqueeze(0)  # (1,3,224,224)
+    with metrics.stage("preprocess"):
+        x = _transform(img).unsqueeze(0)  # (1,3,224,224)
 
     # Extract 2048-d features
-    with torch.no_grad():
+    with metrics.stage("forward"), torch.no_grad():
         feats = _feature_net(x)  # (1,2048,1,1)
     v2048 = feats.view(-1).cpu().numpy()  # (2048,)
 
     # Project to DIM and L2-normalize
-    v = v2048 @ _proj  # (DIM,)
-    norm = float(np.linalg.norm(v))
-    if norm > 0:
-        v = v / norm
+    with metrics.stage("project"):
+        v = _projection.apply(v2048)  # (DIM,)
+        norm = float(np.linalg.norm(v))
+        if norm > 0:
+            v = v / norm
 
     return {
         "embedding": [float(f) for f in v.tolist()],
@@ -126,7 +173,9 @@ def embed(req: EmbedRequest):
         "normalized": True,
         "norm": float(np.linalg.norm(v)),
         "bytes_sha256": digest,
-        "mode": "resnet50_rp",
+        "mode": _projection.mode,
+        "projection": _projection.version,
+        "roi": {"box": box, "ms": roi_ms},
     }
 
 
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Fit, evaluate and version the 2048 -> DIM projection used by embed_server.py.
+
+  1. ResNet50 pooled features (exactly as embed_server.py computes them, before
+     projection) for catalog photos, cached in --features so refits skip the
+     downloads and forward passes.
+  2. Catalogs are split by hash into fit and held-out sets. For each --dims
+     value, a random projection, PCA and PCA-whitening are fitted on the fit
+     set and compared with raw 2048-D features and the current 1024-D random
+     projection.
+  3. Retrieval is scored per held-out photo against the whole index (all
+     photos, minus the query): top-1/top-5/top-10 same-catalog hit rate, next
+     to index size and measured scan time per query.
+  4. The --method projection at each dim is written as a versioned .npz under
+     --out-dir and recorded in its manifest.json; point PROJECTION_PATH at it.
+
+  python embed/fit_projection.py --photos catalog_photos.csv --features resnet_features.npz \\
+      --dims 256,384,512 --out-dir projections --report projection_report.json
+
+Vectors from different projections are not comparable: after switching
+PROJECTION_PATH, re-embed every photo before using the new vectors for matching.
+"""
+import argparse, csv, hashlib, io, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import projection
+
+METHODS = ("random", "pca", "pca_whiten")
+TOP_KS = (1, 5, 10)
+
+
+def load_photos_csv(path):
+    with open(path, newline="") as f:
+        rows = [r for r in csv.DictReader(f) if r.get("url") and r.get("catalog_id")]
+    return [(r["photo_id"], r["url"], r["catalog_id"]) for r in rows]
+
+
+def load_photos_supabase(limit=None):
+    from dotenv import load_dotenv
+    from supabase import create_client
+    load_dotenv()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+    client = create_client(url, key)
+    out, last = [], None
+    while True:
+        query = (client.table("photos").select("id, storage_path, fk_catalog_id")
+                 .not_.is_("fk_catalog_id", "null").order("id").limit(1000))
+        if last is not None:
+            query = query.gt("id", last)
+        rows = query.execute().data or []
+        out += [(str(r["id"]), f"{url}/storage/v1/object/public/manta-images/{r['storage_path']}", str(r["fk_catalog_id"]))
+                for r in rows if r.get("storage_path")]
+        if len(rows) < 1000 or (limit and len(out) >= limit):
+            return out[:limit] if limit else out
+        last = rows[-1]["id"]
+
+
+def extract_features(photos, workers, batch_size, roi):
+    """Raw 2048-D features via embed_server's own network and transform."""
+    import requests
+    import torch
+    from PIL import Image
+    import embed_server as es
+    from roi import saliency_box, to_pixels
+
+    es._lazy_init()
+    session = requests.Session()
+
+    def fetch(item):
+        pid, url, catalog = item
+        try:
+            r = session.get(url, timeout=30)
+            r.raise_for_status()
+            img = Image.open(io.BytesIO(r.content)).convert("RGB")
+            if roi:
+                box = saliency_box(np.asarray(img))
+                if box is not None:
+                    img = img.crop(to_pixels(box, img.width, img.height))
+            return pid, catalog, es._transform(img)
+        except Exception as e:
+            print(f"⚠️ {pid}: {e}", file=sys.stderr)
+            return None
+
+    ids, catalogs, feats = [], [], []
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(photos), batch_size):
+            ok = [x for x in pool.map(fetch, photos[start:start + batch_size]) if x is not None]
+            if not ok:
+                continue
+            with torch.no_grad():
+                out = es._feature_net(torch.stack([t for _, _, t in ok])).flatten(1).cpu().numpy()
+            ids += [pid for pid, _, _ in ok]
+            catalogs += [c for _, c, _ in ok]
+            feats.append(out.astype(np.float32))
+            done = min(start + batch_size, len(photos))
+            print(f"  {done}/{len(photos)} photos, {done / max(1e-9, time.time() - t0):.1f}/s", file=sys.stderr)
+    return np.asarray(ids), np.asarray(catalogs), np.vstack(feats) if feats else np.zeros((0, 2048), np.float32)
+
+
+def split_catalogs(catalogs, eval_frac, seed):
+    """Boolean mask of held-out photos; whole catalogs go one way, chosen by a stable hash."""
+    bucket = lambda c: int(hashlib.sha1(f"{seed}:{c}".encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    held = {c for c in set(catalogs) if bucket(c) < eval_frac}
+    return np.asarray([c in held for c in catalogs])
+
+
+def _normalize(x):
+    n = np.linalg.norm(x, axis=1, keepdims=True)
+    return (x / np.where(n == 0, 1, n)).astype(np.float32)
+
+
+def evaluate(vectors, catalogs, query_rows, repeats=3):
+    """Same-catalog hit rate at TOP_KS for each query row against all other rows, plus scan time."""
+    index = _normalize(vectors)
+    queries = index[query_rows]
+    best = float("inf")
+    for _ in range(repeats):
+        t = time.perf_counter()
+        scores = queries @ index.T
+        best = min(best, time.perf_counter() - t)
+    scores[np.arange(len(query_rows)), query_rows] = -np.inf
+    k = min(max(TOP_KS), index.shape[0] - 1)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+    hits = catalogs[top] == catalogs[query_rows][:, None]
+    return {
+        **{f"top{t}": round(float(hits[:, :t].any(axis=1).mean()), 4) for t in TOP_KS},
+        "dim": int(index.shape[1]),
+        "index_mb": round(index.nbytes / 2**20, 2),
+        "scan_ms_per_query": round(1000 * best / max(1, len(query_rows)), 4),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fit and version a PCA/whitening projection for embed_server.py.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--photos", help="CSV with photo_id,url,catalog_id")
+    src.add_argument("--supabase", action="store_true", help="Catalogued photos from the photos table")
+    ap.add_argument("--limit", type=int, help="At most this many photos (--supabase)")
+    ap.add_argument("--features", default="resnet_features.npz", help="Raw feature cache; reused when present")
+    ap.add_argument("--roi", action="store_true", help="Crop to the animal first (as ROI_CROP=1)")
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--dims", default="256,384,512")
+    ap.add_argument("--method", default="pca_whiten", choices=METHODS, help="Projection written for each dim")
+    ap.add_argument("--eval-frac", type=float, default=0.2, help="Share of catalogs held out of fitting")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out-dir", default="projections")
+    ap.add_argument("--report", default="projection_report.json")
+    args = ap.parse_args()
+    dims = [int(d) for d in args.dims.split(",") if d.strip()]
+
+    if os.path.exists(args.features):
+        with np.load(args.features, allow_pickle=False) as f:
+            ids, catalogs, feats = f["ids"], f["catalogs"], f["features"]
+        print(f"📦 {len(ids)} cached features from {args.features}")
+    else:
+        if args.photos:
+            photos = load_photos_csv(args.photos)
+        elif args.supabase:
+            photos = load_photos_supabase(args.limit)
+        else:
+            ap.error(f"{args.features} does not exist; pass --photos or --supabase to build it")
+        print(f"📥 Extracting ResNet50 features for {len(photos)} photos")
+        ids, catalogs, feats = extract_features(photos, args.workers, args.batch_size, args.roi)
+        np.savez(args.features, ids=ids, catalogs=catalogs, features=feats)
+        print(f"💾 {len(ids)} features cached in {args.features}")
+
+    held = split_catalogs(catalogs, args.eval_frac, args.seed)
+    counts = {c: n for c, n in zip(*np.unique(catalogs, return_counts=True))}
+    query_rows = np.flatnonzero(held & np.asarray([counts[c] > 1 for c in catalogs]))
+    fit = feats[~held]
+    print(f"🧪 fit on {len(fit)} photos ({len(set(catalogs[~held]))} catalogs); "
+          f"{len(query_rows)} held-out queries against an index of {len(feats)}")
+    if not len(query_rows):
+        sys.exit("no held-out catalog has two or more photos; raise --eval-frac or change --seed")
+
+    rows = [{"method": "raw", **evaluate(feats, catalogs, query_rows)},
+            {"method": "random", "baseline": True, **evaluate(projection.random_projection(1024).apply(feats), catalogs, query_rows)}]
+    fitted = {}
+    for dim in dims:
+        for method in METHODS:
+            if method == "random":
+                proj = projection.random_projection(dim)
+            else:
+                proj = projection.fit_pca(fit, dim, whiten=method == "pca_whiten")
+            fitted[(method, dim)] = proj
+            rows.append({"method": method, "version": proj.version, **evaluate(proj.apply(feats), catalogs, query_rows)})
+
+    print(f"\n{'method':<11} {'dim':>5} {'top1':>7} {'top5':>7} {'top10':>7} {'index MB':>9} {'scan ms/q':>10}")
+    for r in rows:
+        print(f"{r['method']:<11} {r['dim']:>5} {r['top1']:>7.3f} {r['top5']:>7.3f} {r['top10']:>7.3f} "
+              f"{r['index_mb']:>9.2f} {r['scan_ms_per_query']:>10.4f}")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    manifest_path = os.path.join(args.out_dir, "manifest.json")
+    manifest = []
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    written = []
+    for dim in dims:
+        proj = fitted[(args.method, dim)]
+        path = os.path.join(args.out_dir, f"resnet50_{args.method}_{dim}_{proj.version}.npz")
+        result = next(r for r in rows if r.get("version") == proj.version)
+        projection.save(proj, path, features=os.path.basename(args.features), roi=args.roi,
+                        eval={k: result[k] for k in ("top1", "top5", "top10")})
+        manifest.append({"path": os.path.basename(path), **projection.load(path).meta})
+        written.append(path)
+        print(f"✅ {path}")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    with open(args.report, "w") as f:
+        json.dump({"n_photos": int(len(feats)), "n_fit": int(len(fit)), "n_queries": int(len(query_rows)),
+                   "eval_frac": args.eval_frac, "seed": args.seed, "rows": rows, "written": written}, f, indent=2)
+    print(f"📝 report: {args.report}\nSet PROJECTION_PATH to one of the files above and re-embed before matching.")
+
+
+if __name__ == "__main__":
+    main()
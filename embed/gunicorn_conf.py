@@ -0,0 +1,80 @@
+# File: embed/gunicorn_conf.py
+# Preload-then-fork serving for the torch services (manta-matcher/main.py,
+# embed/embed_server.py, embed/inference_server.py):
+#
+#   cd manta-matcher && WEB_CONCURRENCY=4 gunicorn -c ../embed/gunicorn_conf.py main:app
+#   cd embed && WEB_CONCURRENCY=4 BIND=0.0.0.0:5050 gunicorn -c gunicorn_conf.py embed_server:app
+#
+# The app is imported once in the gunicorn master with PRELOAD_MODEL=1 and
+# PRELOAD_INDEX=1, so model weights and the read-only embedding matrix are
+# allocated before fork and shared copy-on-write by every worker instead of
+# being loaded N times. gc.freeze() after preload keeps the collector from
+# touching (and so un-sharing) the parent's objects. Each worker gets
+# cores // workers torch threads (TORCH_THREADS overrides) so N workers do not
+# oversubscribe the CPU. Worker and master RSS/PSS are logged at startup; see
+# worker_memory.py to measure a running deployment.
+#
+# PROMETHEUS_MULTIPROC_DIR (default: a fresh temp dir; one you set must be
+# empty at startup) makes service_metrics.py write every worker's samples
+# there, so GET /metrics on any worker reports the whole server; exited
+# workers are marked dead so their in-flight gauges drop out.
+#
+# After fork each worker calls the app module's reset_after_fork(), if it has
+# one, so no worker reuses HTTP connections the master pooled while preloading
+# (main.py recreates its Supabase client there).
+#
+# Each worker holds its own view after fork: POST /index/reload and
+# POST /cache/invalidate only affect the worker that served them, so restart
+# (HUP) the master after a bulk re-embed or metadata change.
+
+import gc
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from worker_memory import memory, summary_line
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+TORCH_THREADS = int(os.getenv("TORCH_THREADS") or max(1, (os.cpu_count() or 1) // workers))
+
+# Read by the apps at import, which happens in the master after this module runs.
+os.environ.setdefault("PRELOAD_MODEL", "1")
+os.environ.setdefault("PRELOAD_INDEX", "1")
+# Set before torch is imported so the OpenMP pool the workers inherit is already the right size.
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+# Must be set before prometheus_client is imported by the app; kept across HUP reloads.
+if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus_")
+
+
+def when_ready(server):
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"preloaded; {workers} workers x {TORCH_THREADS} torch threads")
+    server.log.info(summary_line("master", memory()))
+
+
+def post_fork(server, worker):
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(TORCH_THREADS)
+    app_module = sys.modules.get(getattr(server.app, "app_uri", "").split(":")[0])
+    reset = getattr(app_module, "reset_after_fork", None)
+    if reset is not None:
+        reset()
+
+
+def post_worker_init(worker):
+    worker.log.info(summary_line(f"worker {worker.pid}", memory()))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
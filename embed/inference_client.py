@@ -0,0 +1,75 @@
+# File: embed/inference_client.py
+# Thin client for inference_server.py, so scripts get embeddings and zero-shot
+# labels without importing torch or loading weights themselves.
+#
+#   client = InferenceClient()                 # INFERENCE_URL, INFERENCE_MODEL
+#   vecs = client.embed_images([jpeg_bytes])   # (n, dim) float32, unit rows;
+#                                              # zero rows for undecodable images
+#   text = client.embed_texts(["a photo of a manta ray"])
+#   labels, probs = client.classify(["dorsal", "ventral"], "a photo of the {} side", blobs)
+
+import base64
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+
+INFERENCE_URL = os.getenv("INFERENCE_URL", "").rstrip("/")
+INFERENCE_MODEL = os.getenv("INFERENCE_MODEL", "clip-vitb32")
+
+
+def enabled() -> bool:
+    """True when INFERENCE_URL points at a running inference service."""
+    return bool(INFERENCE_URL)
+
+
+def _image(blob: bytes) -> dict:
+    return {"image_base64": base64.b64encode(blob).decode("ascii")}
+
+
+class InferenceClient:
+    def __init__(self, url: Optional[str] = None, model: Optional[str] = None, timeout: float = 120.0,
+                 session: Optional[requests.Session] = None):
+        self.url = (url or INFERENCE_URL).rstrip("/")
+        if not self.url:
+            raise RuntimeError("INFERENCE_URL is not set")
+        self.model = model or INFERENCE_MODEL
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def _post(self, path: str, payload: dict) -> dict:
+        r = self.session.post(f"{self.url}{path}", json={"model": self.model, **payload}, timeout=self.timeout)
+        if r.status_code >= 400:
+            raise RuntimeError(f"inference {path} failed ({r.status_code}): {r.text[:300]}")
+        return r.json()
+
+    def health(self) -> dict:
+        r = self.session.get(f"{self.url}/health", timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def embed_images(self, blobs: Sequence[bytes]) -> np.ndarray:
+        if not blobs:
+            return np.zeros((0, 0), dtype=np.float32)
+        data = self._post("/embed/batch", {"images": [_image(b) for b in blobs]})
+        out = np.zeros((len(blobs), int(data["dim"])), dtype=np.float32)
+        for i, row in enumerate(data["embeddings"]):
+            if row is not None:
+                out[i] = row
+        return out
+
+    def embed_texts(self, texts: Sequence[str]) -> np.ndarray:
+        data = self._post("/embed/text", {"texts": list(texts)})
+        return np.asarray(data["embeddings"], dtype=np.float32)
+
+    def classify(self, labels: Sequence[str], prompt: str = "{}", blobs: Optional[Sequence[bytes]] = None,
+                 embeddings: Optional[np.ndarray] = None) -> Tuple[List[Optional[str]], List[Optional[List[float]]]]:
+        """Zero-shot label per image (or per precomputed embedding); None where an image failed to decode."""
+        payload = {"labels": list(labels), "prompt": prompt}
+        if embeddings is not None:
+            payload["embeddings"] = np.asarray(embeddings, dtype=np.float32).tolist()
+        else:
+            payload["images"] = [_image(b) for b in blobs or ()]
+        data = self._post("/classify", payload)
+        return data["labels"], data["probs"]
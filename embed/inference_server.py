@@ -0,0 +1,314 @@
+# File: embed/inference_server.py
+# One inference service for every model the project uses, so scripts and the
+# matcher stop loading their own copies of CLIP / ResNet.
+#
+# Model registry (each loaded once per process, on first use or at startup
+# via INFERENCE_PRELOAD="clip-vitb32,resnet50_rp"):
+#   clip-vitb32   CLIP ViT-B/32 image + text tower, 512-D (photo_embeddings)
+#   resnet50_rp   ResNet50 pooled features projected to RESNET_DIM, or by the
+#                 fitted PROJECTION_PATH (same vectors as embed_server.py)
+#   stub          deterministic sha256-seeded unit vectors (root embed_server.py)
+#
+# Endpoints:
+#   GET  /health        -> { ok, default_model, models: {name: loaded} }
+#   POST /embed         -> { embedding[], dim, model, normalized, bytes_sha256 }
+#   POST /embed/batch   -> { embeddings[[...] | null], dim, model, errors{index: msg} }
+#   POST /embed/text    -> { embeddings[[...]], dim, model }
+#   POST /classify      -> { labels[], probs[[...]], classes[] } zero-shot over
+#                          images or already-computed image embeddings
+#   GET  /metrics       -> Prometheus text (service_metrics.py)
+#
+# Images travel as image_url or image_base64; embeddings are L2-normalized.
+# Clients: inference_client.py (INFERENCE_URL).
+
+import base64
+import functools
+import hashlib
+import io
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+from fastapi import FastAPI, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+from PIL import Image
+
+import projection
+import service_metrics as metrics
+from service_profiling import install as install_profiling, profiled
+
+DEFAULT_MODEL = os.getenv("INFERENCE_DEFAULT_MODEL", "clip-vitb32")
+RESNET_DIM = int(os.getenv("RESNET_DIM", os.getenv("DIM", "1024")))
+STUB_DIM = int(os.getenv("STUB_DIM", "1024"))
+TEXT_CACHE_SIZE = int(os.getenv("TEXT_CACHE_SIZE", "256"))
+CLIP_LOGIT_SCALE = 100.0
+
+app = FastAPI(title="Manta Inference Service")
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+metrics.instrument(app, "inference")
+install_profiling(app, "inference")
+
+
+def _normalize(rows: np.ndarray) -> np.ndarray:
+    rows = np.asarray(rows, dtype=np.float32)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows / np.where(norms == 0, 1, norms)
+
+
+def _decode(blob: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(blob)).convert("RGB")
+
+
+class ClipModel:
+    dim = 512
+
+    def load(self):
+        import clip
+        import torch
+        self.torch = torch
+        self.clip = clip
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
+        self.model.eval()
+
+    def embed_images(self, blobs: List[bytes]) -> np.ndarray:
+        with metrics.stage("decode"):
+            images = [_decode(b) for b in blobs]
+        with metrics.stage("preprocess"):
+            batch = self.torch.stack([self.preprocess(img) for img in images]).to(self.device)
+        with metrics.stage("forward"), self.torch.no_grad():
+            features = self.model.encode_image(batch).float().cpu().numpy()
+        return _normalize(features)
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        tokens = self.clip.tokenize(texts).to(self.device)
+        with metrics.stage("forward"), self.torch.no_grad():
+            features = self.model.encode_text(tokens).float().cpu().numpy()
+        return _normalize(features)
+
+
+class ResNetRP:
+    """ResNet50 pooled 2048-D features and the same projection embed_server.py uses."""
+
+    def __init__(self):
+        path = os.getenv("PROJECTION_PATH")
+        self.projection = projection.load(path) if path else projection.random_projection(
+            RESNET_DIM if 0 < RESNET_DIM <= 2048 else 1024)
+        self.dim = self.projection.dim
+
+    def load(self):
+        import torch
+        import torch.nn as nn
+        from torchvision.models import resnet50, ResNet50_Weights
+        self.torch = torch
+        weights = ResNet50_Weights.IMAGENET1K_V2
+        self.net = nn.Sequential(*list(resnet50(weights=weights).children())[:-1]).eval()
+        self.transform = weights.transforms()
+
+    def embed_images(self, blobs: List[bytes]) -> np.ndarray:
+        with metrics.stage("decode"):
+            images = [_decode(b) for b in blobs]
+        with metrics.stage("preprocess"):
+            batch = self.torch.stack([self.transform(img) for img in images])
+        with metrics.stage("forward"), self.torch.no_grad():
+            features = self.net(batch).flatten(1).cpu().numpy()
+        with metrics.stage("project"):
+            return _normalize(self.projection.apply(features))
+
+    def embed_texts(self, texts):
+        raise HTTPException(status_code=400, detail="resnet50_rp has no text tower")
+
+
+class StubModel:
+    """Same vectors as the local testing server in the repository root."""
+
+    dim = STUB_DIM
+
+    def load(self):
+        pass
+
+    def embed_images(self, blobs: List[bytes]) -> np.ndarray:
+        rows = []
+        for blob in blobs:
+            seed = int.from_bytes(hashlib.sha256(blob).digest()[:8], "big", signed=False)
+            rows.append(np.random.default_rng(seed).normal(size=self.dim).astype(np.float32))
+        return _normalize(np.vstack(rows))
+
+    def embed_texts(self, texts):
+        return self.embed_images([t.encode() for t in texts])
+
+
+REGISTRY = {"clip-vitb32": ClipModel, "resnet50_rp": ResNetRP, "stub": StubModel}
+_models: Dict[str, object] = {}
+_load_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _text_features(name: str, prompt: str, labels: tuple) -> np.ndarray:
+    """Label text embeddings for /classify; bounded, since prompts and labels come from clients."""
+    return get_model(name)[1].embed_texts([prompt.format(lbl) for lbl in labels])
+
+
+def get_model(name: Optional[str]):
+    name = name or DEFAULT_MODEL
+    if name not in REGISTRY:
+        raise HTTPException(status_code=400, detail=f"unknown model {name}; choose from {sorted(REGISTRY)}")
+    model = _models.get(name)
+    if model is None:
+        with _load_lock:
+            model = _models.get(name)
+            if model is None:
+                model = REGISTRY[name]()
+                with metrics.stage(f"load_{name}"):
+                    model.load()
+                _models[name] = model
+    return name, model
+
+
+# PRELOAD_MODEL=1 (set by gunicorn_conf.py) loads at least the default model before workers fork.
+_preload = os.getenv("INFERENCE_PRELOAD") or (DEFAULT_MODEL if os.getenv("PRELOAD_MODEL", "0") == "1" else "")
+for _name in filter(None, (n.strip() for n in _preload.split(","))):
+    get_model(_name)
+
+
+class ImageIn(BaseModel):
+    image_url: Optional[str] = None
+    image_base64: Optional[str] = None
+
+
+class EmbedRequest(ImageIn):
+    model: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    model: Optional[str] = None
+    images: List[ImageIn]
+
+
+class TextRequest(BaseModel):
+    model: Optional[str] = None
+    texts: List[str]
+
+
+class ClassifyRequest(BaseModel):
+    model: Optional[str] = None
+    labels: List[str]
+    prompt: str = "{}"
+    images: Optional[List[ImageIn]] = None
+    embeddings: Optional[List[List[float]]] = None
+
+
+_sess = requests.Session()
+
+
+def _image_bytes(item: ImageIn) -> bytes:
+    if item.image_url:
+        with metrics.stage("fetch"):
+            try:
+                r = _sess.get(item.image_url, timeout=30)
+                r.raise_for_status()
+                return r.content
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"failed to fetch image_url: {e}")
+    if item.image_base64:
+        try:
+            return base64.b64decode(item.image_base64)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"invalid base64: {e}")
+    raise HTTPException(status_code=400, detail="Provide image_url or image_base64")
+
+
+def _embed_items(model, items: List[ImageIn]):
+    """Embed what decodes; returns (rows or None per item, {index: error})."""
+    blobs, errors = {}, {}
+    for i, item in enumerate(items):
+        try:
+            blob = _image_bytes(item)
+            Image.open(io.BytesIO(blob)).verify()
+            blobs[i] = blob
+        except HTTPException as e:
+            errors[i] = e.detail
+        except Exception as e:
+            errors[i] = f"cannot open image: {e}"
+    rows = [None] * len(items)
+    if blobs:
+        vectors = model.embed_images(list(blobs.values()))
+        for i, vec in zip(blobs, vectors):
+            rows[i] = vec
+    return rows, errors
+
+
+@app.get("/health")
+def health():
+    return {"ok": True, "default_model": DEFAULT_MODEL, "models": {n: n in _models for n in REGISTRY}}
+
+
+@app.post("/embed")
+@profiled
+def embed(req: EmbedRequest):
+    name, model = get_model(req.model)
+    blob = _image_bytes(req)
+    try:
+        vec = model.embed_images([blob])[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"cannot open image: {e}")
+    return {"embedding": vec.tolist(), "dim": int(vec.shape[0]), "model": name, "mode": name,
+            "normalized": True, "bytes_sha256": hashlib.sha256(blob).hexdigest()}
+
+
+@app.post("/embed/batch")
+@profiled
+def embed_batch(req: BatchRequest):
+    name, model = get_model(req.model)
+    rows, errors = _embed_items(model, req.images)
+    return {"embeddings": [None if r is None else r.tolist() for r in rows], "dim": model.dim,
+            "model": name, "normalized": True, "errors": {str(i): msg for i, msg in errors.items()}}
+
+
+@app.post("/embed/text")
+@profiled
+def embed_text(req: TextRequest):
+    name, model = get_model(req.model)
+    vectors = model.embed_texts(req.texts)
+    return {"embeddings": vectors.tolist(), "dim": int(vectors.shape[1]), "model": name}
+
+
+@app.post("/classify")
+@profiled
+def classify(req: ClassifyRequest):
+    """Zero-shot labels: cosine to the prompt-formatted label texts, softmaxed at CLIP's logit scale."""
+    name, model = get_model(req.model)
+    text = _text_features(name, req.prompt, tuple(req.labels))
+
+    errors = {}
+    if req.embeddings is not None:
+        rows = list(_normalize(np.asarray(req.embeddings, dtype=np.float32)))
+    elif req.images:
+        rows, errors = _embed_items(model, req.images)
+    else:
+        raise HTTPException(status_code=400, detail="Provide images or embeddings")
+
+    labels, probs = [], []
+    with metrics.stage("score"):
+        for row in rows:
+            if row is None:
+                labels.append(None)
+                probs.append(None)
+                continue
+            logits = CLIP_LOGIT_SCALE * (text @ row)
+            p = np.exp(logits - logits.max())
+            p /= p.sum()
+            labels.append(req.labels[int(np.argmax(p))])
+            probs.append([round(float(x), 6) for x in p])
+    return {"model": name, "classes": req.labels, "labels": labels, "probs": probs,
+            "errors": {str(i): msg for i, msg in errors.items()}}
+
+
+@app.get("/")
+def root():
+    return {"ok": True, "message": "manta inference service", "models": sorted(REGISTRY)}
@@ -0,0 +1,115 @@
+# File: embed/pair_cache.py
+# SQLite memo of pairwise match results. A result is keyed by the content
+# hashes of both images plus the canonical JSON of every parameter that can
+# change it (engine, features, ratio, RANSAC method/threshold, ROI, cascade),
+# so re-checking a pair with the same settings is a lookup and changing any
+# setting misses cleanly. Pairs are stored with the smaller hash first, so
+# (a, b) and (b, a) share one row; per-image fields (kp1/kp2, roi box_a/box_b)
+# are swapped back when the caller asked in the other order. Shared by
+# sift_server.py and sift_matrix.py; WAL mode lets the service and a batch job
+# use the same file.
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+SCHEMA = """
+create table if not exists pair_results (
+  hash_a text not null,
+  hash_b text not null,
+  params text not null,
+  result text not null,
+  created_at real not null,
+  primary key (hash_a, hash_b, params)
+)
+"""
+
+
+def params_key(params: dict) -> str:
+    """Short stable id for a parameter dict (key order does not matter)."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, separators=(",", ":")).encode()).hexdigest()[:16]
+
+
+def flip(result: dict) -> dict:
+    """The same result seen from the other image first."""
+    out = dict(result)
+    if "kp1" in out or "kp2" in out:
+        out["kp1"], out["kp2"] = result.get("kp2"), result.get("kp1")
+    roi = out.get("roi")
+    if isinstance(roi, dict) and ("box_a" in roi or "box_b" in roi):
+        out["roi"] = {**roi, "box_a": roi.get("box_b"), "box_b": roi.get("box_a")}
+    return out
+
+
+def _ordered(hash_a: str, hash_b: str, result: Optional[dict] = None):
+    """(low, high, result as stored, swapped?) for a caller's (hash_a, hash_b)."""
+    if hash_a <= hash_b:
+        return hash_a, hash_b, result, False
+    return hash_b, hash_a, None if result is None else flip(result), True
+
+
+class PairCache:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, hash_a: str, hash_b: str, params: str) -> Optional[dict]:
+        low, high, _, swapped = _ordered(hash_a, hash_b)
+        with self._lock:
+            row = self._conn.execute(
+                "select result from pair_results where hash_a=? and hash_b=? and params=?",
+                (low, high, params),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        result = json.loads(row[0])
+        return flip(result) if swapped else result
+
+    def get_many(self, pairs: Iterable[Tuple[str, str]], params: str) -> Dict[Tuple[str, str], dict]:
+        """Cached results for many (hash_a, hash_b) pairs under one parameter key, keyed as asked."""
+        found = {}
+        with self._lock:
+            for hash_a, hash_b in pairs:
+                low, high, _, swapped = _ordered(hash_a, hash_b)
+                row = self._conn.execute(
+                    "select result from pair_results where hash_a=? and hash_b=? and params=?",
+                    (low, high, params),
+                ).fetchone()
+                if row is not None:
+                    result = json.loads(row[0])
+                    found[(hash_a, hash_b)] = flip(result) if swapped else result
+        return found
+
+    def put(self, hash_a: str, hash_b: str, params: str, result: dict) -> None:
+        self.put_many([(hash_a, hash_b, result)], params)
+
+    def put_many(self, rows: Iterable[Tuple[str, str, dict]], params: str) -> None:
+        now = time.time()
+        stored = [_ordered(a, b, result)[:3] for a, b, result in rows]
+        with self._lock:
+            self._conn.executemany(
+                "insert or replace into pair_results values (?,?,?,?,?)",
+                [(low, high, params, json.dumps(result), now) for low, high, result in stored],
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("select count(*) from pair_results").fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"path": self.path, "size": len(self), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None}
@@ -0,0 +1,106 @@
+# File: embed/projection.py
+# 2048-D ResNet50 features -> DIM projection used by embed_server.py and the
+# resnet50_rp model in inference_server.py. numpy only.
+#
+# The default is the original fixed Gaussian matrix seeded 123456789. A fitted
+# projection (PCA, optionally whitened, from fit_projection.py) is a mean plus
+# a matrix in a versioned .npz, selected with PROJECTION_PATH:
+#
+#   v = (x - mean) @ matrix      then L2-normalized by the caller
+#
+# The version is a hash of the arrays, so vectors produced by different
+# projections can be told apart and never mixed in one index.
+
+import hashlib
+import json
+import time
+from typing import Optional
+
+import numpy as np
+
+FEATURE_DIM = 2048
+RANDOM_SEED = 123456789
+
+
+class Projection:
+    def __init__(self, mean: np.ndarray, matrix: np.ndarray, meta: Optional[dict] = None):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+        self.meta = dict(meta or {})
+        self.meta.setdefault("method", "random")
+        self.meta.setdefault("version", _digest(self.mean, self.matrix))
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1])
+
+    @property
+    def version(self) -> str:
+        return self.meta["version"]
+
+    @property
+    def mode(self) -> str:
+        """Embedding mode string reported by the services, e.g. resnet50_rp or resnet50_pcaw."""
+        return {"random": "resnet50_rp", "pca": "resnet50_pca", "pca_whiten": "resnet50_pcaw"}.get(
+            self.meta["method"], f"resnet50_{self.meta['method']}")
+
+    def apply(self, x: np.ndarray) -> np.ndarray:
+        """Project one (2048,) vector or an (n, 2048) batch; not normalized."""
+        return (np.asarray(x, dtype=np.float32) - self.mean) @ self.matrix
+
+
+def _digest(mean: np.ndarray, matrix: np.ndarray) -> str:
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(mean, dtype=np.float32).tobytes())
+    h.update(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+    return h.hexdigest()[:12]
+
+
+def random_projection(dim: int, in_dim: int = FEATURE_DIM, seed: int = RANDOM_SEED) -> Projection:
+    """The original data-independent projection, unchanged for existing stored vectors."""
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(0.0, 1.0 / np.sqrt(in_dim), size=(in_dim, dim)).astype(np.float32)
+    return Projection(np.zeros(in_dim, dtype=np.float32), matrix, {"method": "random", "seed": seed})
+
+
+def fit_pca(features: np.ndarray, dim: int, whiten: bool = False, eps: float = 1e-4) -> Projection:
+    """PCA of an (n, in_dim) feature matrix onto its top `dim` components.
+
+    With whiten=True each component is scaled by 1/sqrt(variance + eps *
+    largest variance), so no direction dominates the cosine; eps keeps the
+    smallest kept components from being blown up by noise.
+    """
+    x = np.asarray(features, dtype=np.float64)
+    n = x.shape[0]
+    if dim > min(n - 1, x.shape[1]):
+        raise ValueError(f"cannot fit {dim} components from {n} samples of dimension {x.shape[1]}")
+    mean = x.mean(axis=0)
+    _, s, vt = np.linalg.svd(x - mean, full_matrices=False)
+    variance = s ** 2 / (n - 1)
+    components = vt[:dim].T
+    # SVD signs are arbitrary; fix them so refits on the same data give the same matrix.
+    signs = np.sign(components[np.argmax(np.abs(components), axis=0), np.arange(dim)])
+    components = components * signs
+    if whiten:
+        components = components / np.sqrt(variance[:dim] + eps * variance[0])
+    return Projection(mean, components, {
+        "method": "pca_whiten" if whiten else "pca",
+        "n_train": int(n),
+        "explained_variance": float(variance[:dim].sum() / variance.sum()),
+    })
+
+
+def save(proj: Projection, path: str, **extra) -> None:
+    meta = {**proj.meta, **extra, "dim": proj.dim, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    with open(path, "wb") as f:
+        np.savez(f, mean=proj.mean, matrix=proj.matrix, meta=np.array(json.dumps(meta, sort_keys=True)))
+
+
+def load(path: str) -> Projection:
+    with np.load(path, allow_pickle=False) as f:
+        mean, matrix, meta = f["mean"], f["matrix"], json.loads(str(f["meta"]))
+    if mean.shape != (matrix.shape[0],):
+        raise ValueError(f"{path}: mean {mean.shape} does not match matrix {matrix.shape}")
+    if meta.get("version") != _digest(mean, matrix):
+        raise ValueError(f"{path}: arrays do not match recorded version {meta.get('version')}")
+    return Projection(mean, matrix, meta)
@@ -0,0 +1,124 @@
+# File: embed/roi.py
+# Cheap region-of-interest crop: find the animal against open water before
+# feature extraction, so SIFT/ResNet do not spend keypoints on water, divers
+# and bubbles. numpy only, so both the cv2 match service and the PIL embed
+# server can use it.
+#
+# The background colour is estimated from the image border (usually water),
+# each pixel is scored by its distance from it, the score map is split with
+# Otsu's threshold, and the box keeps the central mass of the foreground rows
+# and columns. Boxes are relative (0..1), so one box serves any resolution,
+# and are cached per photo by content hash.
+
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+Box = Tuple[float, float, float, float]  # x0, y0, x1, y1, relative
+
+SAMPLE_SIDE = 128      # saliency is computed on a strided thumbnail this size
+BORDER_FRAC = 0.06     # border band used to estimate the background colour
+MASS_TRIM = 0.02       # foreground mass dropped at each end of the box
+MARGIN = 0.05          # padding added around the box, relative to its size
+MIN_FOREGROUND = 0.02  # less foreground than this: no confident crop
+MAX_AREA = 0.9         # boxes covering more than this are not worth cropping
+
+
+def _thumbnail(arr: np.ndarray) -> np.ndarray:
+    step = max(1, int(np.ceil(max(arr.shape[:2]) / SAMPLE_SIDE)))
+    small = np.asarray(arr[::step, ::step], dtype=np.float32)
+    return small[..., None] if small.ndim == 2 else small[..., :3]
+
+
+def _otsu(values: np.ndarray, bins: int = 64) -> float:
+    hist, edges = np.histogram(values, bins=bins)
+    p = hist / max(1, hist.sum())
+    mids = (edges[:-1] + edges[1:]) / 2
+    w0 = np.cumsum(p)
+    mu = np.cumsum(p * mids)
+    w1 = 1.0 - w0
+    denom = w0 * w1
+    between = np.where(denom > 0, (mu[-1] * w0 - mu) ** 2 / np.where(denom > 0, denom, 1), 0)
+    return float(mids[int(np.argmax(between))])
+
+
+def _extent(profile: np.ndarray) -> Tuple[float, float]:
+    cum = np.cumsum(profile)
+    total = cum[-1]
+    lo = int(np.searchsorted(cum, total * MASS_TRIM))
+    hi = int(np.searchsorted(cum, total * (1 - MASS_TRIM))) + 1
+    return lo / len(profile), hi / len(profile)
+
+
+def saliency_box(arr: np.ndarray) -> Optional[Box]:
+    """Relative crop box around the foreground of an HxW or HxWxC image, or None to keep the full frame."""
+    a = _thumbnail(arr)
+    h, w, c = a.shape
+    if h < 8 or w < 8:
+        return None
+    b = max(1, int(round(min(h, w) * BORDER_FRAC)))
+    border = np.concatenate([
+        a[:b].reshape(-1, c), a[-b:].reshape(-1, c),
+        a[:, :b].reshape(-1, c), a[:, -b:].reshape(-1, c),
+    ])
+    background = np.median(border, axis=0)
+    score = np.linalg.norm(a - background, axis=2)
+    if float(score.max()) <= 0:
+        return None
+    mask = score > _otsu(score.ravel())
+    if mask.mean() < MIN_FOREGROUND:
+        return None
+
+    y0, y1 = _extent(mask.sum(axis=1).astype(np.float64))
+    x0, x1 = _extent(mask.sum(axis=0).astype(np.float64))
+    pad_x, pad_y = (x1 - x0) * MARGIN, (y1 - y0) * MARGIN
+    box = (max(0.0, x0 - pad_x), max(0.0, y0 - pad_y), min(1.0, x1 + pad_x), min(1.0, y1 + pad_y))
+    if (box[2] - box[0]) * (box[3] - box[1]) > MAX_AREA:
+        return None
+    return tuple(round(v, 4) for v in box)
+
+
+def to_pixels(box: Box, width: int, height: int) -> Tuple[int, int, int, int]:
+    x0, y0, x1, y1 = box
+    left, top = int(x0 * width), int(y0 * height)
+    return left, top, max(left + 1, int(np.ceil(x1 * width))), max(top + 1, int(np.ceil(y1 * height)))
+
+
+def crop(arr: np.ndarray, box: Optional[Box]) -> np.ndarray:
+    if box is None:
+        return arr
+    left, top, right, bottom = to_pixels(box, arr.shape[1], arr.shape[0])
+    return arr[top:bottom, left:right]
+
+
+class RoiCache:
+    """Thread-safe LRU of crop boxes keyed by image content hash (None boxes are cached too)."""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._boxes: "OrderedDict[str, Optional[Box]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def box_for(self, key: str, arr: np.ndarray) -> Optional[Box]:
+        with self._lock:
+            if key in self._boxes:
+                self._boxes.move_to_end(key)
+                self.hits += 1
+                return self._boxes[key]
+            self.misses += 1
+        box = saliency_box(arr)
+        with self._lock:
+            self._boxes[key] = box
+            while len(self._boxes) > self.maxsize:
+                self._boxes.popitem(last=False)
+        return box
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._boxes), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 4) if total else None}
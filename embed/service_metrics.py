@@ -0,0 +1,158 @@
+# File: embed/service_metrics.py
+# Prometheus metrics shared by the FastAPI services (manta-matcher/main.py,
+# embed/embed_server.py, embed_server.py, embed/sift_server.py,
+# embed/inference_server.py), built on prometheus_client. starlette is
+# imported lazily by instrument(), which every FastAPI install already has.
+#
+#   instrument(app, "sift")          request count / latency / in-flight by route
+#                                    template, plus GET /metrics
+#   with stage("fetch"): ...         per-stage latency histogram
+#   watch_cache("roi", cache.stats)  hits / misses from a cache's stats()
+#
+# Route labels use the template ("/photos/{photo_id}/neighbors"), never the raw
+# path, so label cardinality stays bounded.
+#
+# Under gunicorn (gunicorn_conf.py) PROMETHEUS_MULTIPROC_DIR is set before the
+# app is imported: every worker writes its samples there and GET /metrics,
+# whichever worker serves it, returns the sum over all of them through
+# prometheus_client's MultiProcessCollector. Watched caches live in each
+# worker's memory, so each worker adds its stats() growth to the cache
+# counters at most every CACHE_SYNC_SECONDS while it serves requests.
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CACHE_SYNC_SECONDS = float(os.getenv("CACHE_SYNC_SECONDS", "1"))
+
+SERVICE = "unknown"
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status", ("service", "method", "route", "status"))
+LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("service", "method", "route"), buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served", ("service",), multiprocess_mode="livesum")
+STAGES = Histogram("stage_duration_seconds", "Time spent per processing stage", ("service", "stage"), buckets=LATENCY_BUCKETS)
+CACHE_HITS = Counter("cache_hits_total", "Cache lookups answered from the cache", ("cache",))
+CACHE_MISSES = Counter("cache_misses_total", "Cache lookups that missed", ("cache",))
+
+# Called as listener(stage_name, seconds) after every stage(); the profiler hooks in here.
+STAGE_LISTENERS: List[Callable[[str, float], None]] = []
+
+_caches: Dict[str, Callable[[], dict]] = {}
+_cache_seen: Dict[str, Tuple[int, int]] = {}
+_cache_lock = threading.Lock()
+_cache_synced = [0.0]
+
+
+def multiprocess_mode() -> bool:
+    return bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+
+@contextmanager
+def stage(name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t
+        STAGES.labels(service=SERVICE, stage=name).observe(elapsed)
+        for listener in STAGE_LISTENERS:
+            listener(name, elapsed)
+
+
+def watch_cache(name: str, stats: Callable[[], dict]) -> None:
+    """Expose a cache whose stats() returns cumulative hits/misses."""
+    with _cache_lock:
+        _caches[name] = stats
+        _cache_seen.pop(name, None)
+
+
+def sync_caches(force: bool = False) -> None:
+    """Add each watched cache's hits/misses since the last sync to the counters."""
+    now = time.monotonic()
+    if not force and now - _cache_synced[0] < CACHE_SYNC_SECONDS:
+        return
+    with _cache_lock:
+        _cache_synced[0] = now
+        for name, stats in _caches.items():
+            try:
+                s = stats()
+            except Exception:
+                continue
+            hits, misses = int(s.get("hits") or 0), int(s.get("misses") or 0)
+            last_hits, last_misses = _cache_seen.get(name, (0, 0))
+            # A cache that was cleared restarts its counts; count from zero again.
+            CACHE_HITS.labels(cache=name).inc(hits - last_hits if hits >= last_hits else hits)
+            CACHE_MISSES.labels(cache=name).inc(misses - last_misses if misses >= last_misses else misses)
+            _cache_seen[name] = (hits, misses)
+
+
+def render() -> bytes:
+    sync_caches(force=True)
+    if multiprocess_mode():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so streaming responses are not buffered."""
+
+    def __init__(self, app, service: str, routes):
+        self.app = app
+        self.service = service
+        self.routes = routes
+
+    def _template(self, scope) -> str:
+        route = scope.get("route")
+        if getattr(route, "path", None):
+            return route.path
+        from starlette.routing import Match
+        for r in self.routes():
+            if r.matches(scope)[0] == Match.FULL:
+                return getattr(r, "path", "unmatched")
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(service=self.service)
+        in_flight.inc()
+        t = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            elapsed = time.perf_counter() - t
+            in_flight.dec()
+            route, method = self._template(scope), scope.get("method", "")
+            REQUESTS.labels(service=self.service, method=method, route=route, status=status[0]).inc()
+            LATENCY.labels(service=self.service, method=method, route=route).observe(elapsed)
+            sync_caches()
+
+
+def instrument(app, service: str) -> None:
+    """Add request metrics middleware and a GET /metrics endpoint to a FastAPI app."""
+    global SERVICE
+    from starlette.responses import Response
+
+    SERVICE = service
+    app.add_middleware(MetricsMiddleware, service=service, routes=lambda: app.router.routes)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,193 @@
+# File: embed/service_profiling.py
+# Opt-in, sampled per-request profiling for the FastAPI services.
+#
+#   install(app, "sift")     choose requests to profile: PROFILE_SAMPLE_RATE
+#                            (0..1, default 0), or an "X-Profile: 1" header
+#                            if PROFILE_ALLOW_HEADER=1 (default off)
+#   @profiled                on a handler: while a chosen request runs, a
+#                            sampler thread snapshots the handler thread's
+#                            stack every PROFILE_INTERVAL seconds
+#
+# Each profiled request writes two files to PROFILE_DIR (newest PROFILE_KEEP
+# kept): <id>.collapsed, folded stacks ("root;...;leaf count") for
+# flamegraph.pl / speedscope / inferno, and <id>.json with route, duration and
+# the service_metrics stage timings seen during the request. The response
+# carries X-Profile-Id. Files are written in the threadpool, off the event
+# loop. Unchosen requests cost one random() and a contextvar lookup. Async
+# handlers run on the event loop thread, so their samples can include other
+# coroutines interleaved with the request.
+
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import service_metrics
+
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+ALLOW_HEADER = os.getenv("PROFILE_ALLOW_HEADER", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+_current: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("request_profile", default=None)
+_write_lock = threading.Lock()
+
+
+class RequestProfile:
+    def __init__(self, service: str, method: str, path: str):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.service = service
+        self.method = method
+        self.path = path
+        self.route = None
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stacks: Counter = Counter()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages.append({"stage": name, "ms": round(seconds * 1000, 3)})
+
+    def sample_thread(self, thread_id: int, stop: threading.Event) -> None:
+        while not stop.wait(INTERVAL):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            with self._lock:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def write(self, status: int) -> None:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.id)
+        with self._lock:
+            stacks, stages = dict(self.stacks), list(self.stages)
+        with open(base + ".collapsed", "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks.items())
+        with open(base + ".json", "w") as f:
+            json.dump({
+                "id": self.id, "service": self.service, "method": self.method, "path": self.path,
+                "route": self.route, "status": status,
+                "duration_ms": round(((self.finished or time.perf_counter()) - self.started) * 1000, 3),
+                "interval_ms": INTERVAL * 1000, "samples": sum(stacks.values()), "stages": stages,
+            }, f, indent=2)
+        _rotate()
+
+
+def _rotate() -> None:
+    with _write_lock:
+        files = sorted(
+            (os.path.join(PROFILE_DIR, n) for n in os.listdir(PROFILE_DIR) if n.endswith(".json")),
+            key=os.path.getmtime,
+        )
+        for path in files[:max(0, len(files) - PROFILE_KEEP)]:
+            for victim in (path, path[:-len(".json")] + ".collapsed"):
+                try:
+                    os.remove(victim)
+                except FileNotFoundError:
+                    pass
+
+
+def _on_stage(name: str, seconds: float) -> None:
+    profile = _current.get()
+    if profile is not None:
+        profile.add_stage(name, seconds)
+
+
+service_metrics.STAGE_LISTENERS.append(_on_stage)
+
+
+class _sampling:
+    """Samples the calling thread while the current request is being profiled."""
+
+    def __enter__(self):
+        self.profile = _current.get()
+        if self.profile is None:
+            return self
+        self.stop = threading.Event()
+        self.thread = threading.Thread(
+            target=self.profile.sample_thread, args=(threading.get_ident(), self.stop), daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is not None:
+            self.stop.set()
+            self.thread.join()
+        return False
+
+
+def profiled(func):
+    """Decorate a route handler (sync or async) so profiled requests sample its stack."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with _sampling():
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _sampling():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    def _chosen(self, scope) -> bool:
+        if ALLOW_HEADER:
+            for name, value in scope.get("headers", ()):
+                if name == b"x-profile":
+                    return value not in (b"0", b"false", b"")
+        return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._chosen(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile(self.service, scope.get("method", ""), scope.get("path", ""))
+        status = [500]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        token = _current.set(profile)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _current.reset(token)
+            profile.finished = time.perf_counter()
+            profile.route = getattr(scope.get("route"), "path", None)
+            try:
+                await run_in_threadpool(profile.write, status[0])
+            except OSError as e:
+                print(f"⚠️ could not write profile {profile.id}: {e}")
+
+
+def install(app, service: str) -> None:
+    app.add_middleware(ProfilingMiddleware, service=service)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Benchmark sift_server variants on the probe pairs in sift_probe_results.csv.
+
+Every pair is sent once per variant (a set of extra /match/sift request fields)
+and the server-side matching time (stage_ms, image fetch excluded) is compared.
+Decisions are "match" when inliers >= --decide; agreement is measured against
+the first variant, which is the plain full-resolution pass by default.
+With --repeats N every pair is run N times per variant and the per-pair
+standard deviation of the inlier count is reported (RANSAC is randomized;
+this is the estimator stability column). Requests set no_cache so a server
+with SIFT_PAIR_CACHE still matches every time; a response that says cached
+anyway (an older server) is dropped and counted, never timed.
+
+  python embed/sift_bench.py --url http://127.0.0.1:5051 --pairs sift_probe_results.csv
+  python embed/sift_bench.py --variants ransac,usac_fast,usac_magsac,usac_accurate --repeats 5
+  python embed/sift_bench.py --variants full,orb,akaze
+  python embed/sift_bench.py --variants full,roi,roi_cascade
+"""
+import argparse, csv, json, statistics, sys, time
+from collections import Counter
+
+import requests
+
+VARIANTS = {
+    "full": {"cascade": False},
+    "cascade": {"cascade": True},
+    "ransac": {"cascade": False, "ransac_method": "RANSAC"},
+    "usac_fast": {"cascade": False, "ransac_method": "USAC_FAST"},
+    "usac_magsac": {"cascade": False, "ransac_method": "USAC_MAGSAC"},
+    "usac_accurate": {"cascade": False, "ransac_method": "USAC_ACCURATE"},
+    "orb": {"cascade": False, "engine": "orb"},
+    "akaze": {"cascade": False, "engine": "akaze"},
+    "roi": {"cascade": False, "roi": True},
+    "roi_cascade": {"cascade": True, "roi": True},
+}
+DEFAULT_VARIANTS = "full,cascade"
+
+def load_pairs(path, limit=None):
+    with open(path, newline="") as f:
+        rows = [(r["q_path"], r["ref_path"]) for r in csv.DictReader(f) if r.get("q_path") and r.get("ref_path")]
+    return rows[:limit] if limit else rows
+
+def run(url, pairs, extra, timeout, repeats=1):
+    """Per-pair results and how many responses were served from the pair cache (dropped)."""
+    sess, results, cached = requests.Session(), [], 0
+    for a, b in pairs:
+        tries = []
+        for _ in range(repeats):
+            try:
+                r = sess.post(f"{url}/match/sift", json={"image_url_a": a, "image_url_b": b, "no_cache": True, **extra},
+                              timeout=timeout)
+                r.raise_for_status()
+                j = r.json()
+                if j.get("cached"):
+                    cached += 1
+                    continue
+                tries.append({"inliers": j["inliers"], "kp": (j["kp1"] + j["kp2"]) / 2, "stage": j.get("stage", "full"),
+                              "match_ms": sum(j.get("stage_ms", {}).values()) or j["elapsed_ms"]})
+            except Exception as e:
+                print(f"⚠️ {a} vs {b}: {e}", file=sys.stderr)
+        if not tries:
+            results.append(None)
+            continue
+        inliers = [t["inliers"] for t in tries]
+        results.append({"inliers": statistics.median(inliers), "stage": tries[0]["stage"],
+                        "match_ms": statistics.mean(t["match_ms"] for t in tries), "kp": tries[0]["kp"],
+                        "inlier_std": statistics.pstdev(inliers)})
+    return results, cached
+
+def pct(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values[0] if values else 0)
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare sift_server variants on probe pairs.")
+    ap.add_argument("--url", default="http://127.0.0.1:5051")
+    ap.add_argument("--pairs", default="sift_probe_results.csv")
+    ap.add_argument("--variants", default=DEFAULT_VARIANTS, help=f"Comma-separated subset of {list(VARIANTS)}")
+    ap.add_argument("--decide", type=int, default=15, help="Inliers needed to call a pair a match")
+    ap.add_argument("--repeats", type=int, default=1, help="Runs per pair per variant (inlier stability)")
+    ap.add_argument("--limit", type=int, help="Only the first N pairs")
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--out", help="Per-pair CSV of inliers/time per variant")
+    ap.add_argument("--json", help="Write the summary as JSON here")
+    args = ap.parse_args()
+
+    names = [v.strip() for v in args.variants.split(",") if v.strip()]
+    pairs = load_pairs(args.pairs, args.limit)
+    print(f"{len(pairs)} pairs, variants: {names}")
+
+    runs, cached = {}, {}
+    for name in names:
+        t = time.time()
+        runs[name], cached[name] = run(args.url, pairs, VARIANTS[name], args.timeout, args.repeats)
+        print(f"  {name}: {time.time() - t:.1f}s wall")
+        if cached[name]:
+            print(f"⚠️ {name}: {cached[name]} cached responses dropped; the server ignores no_cache", file=sys.stderr)
+
+    base = runs[names[0]]
+    summary = {}
+    for name in names:
+        ok = [(b, r) for b, r in zip(base, runs[name]) if b and r]
+        times = [r["match_ms"] for _, r in ok]
+        agree = sum((b["inliers"] >= args.decide) == (r["inliers"] >= args.decide) for b, r in ok)
+        summary[name] = {
+            "pairs": len(ok),
+            "mean_kp": round(statistics.mean(r["kp"] for _, r in ok), 1) if ok else None,
+            "mean_ms": round(statistics.mean(times), 1) if times else None,
+            "p50_ms": pct(times, 50), "p95_ms": pct(times, 95),
+            "decision_agreement": round(agree / len(ok), 4) if ok else None,
+            "mean_abs_inlier_diff": round(statistics.mean(abs(b["inliers"] - r["inliers"]) for b, r in ok), 2) if ok else None,
+            "mean_inlier_std": round(statistics.mean(r["inlier_std"] for _, r in ok), 2) if ok else None,
+            "stages": dict(Counter(r["stage"] for _, r in ok)),
+            "cached_dropped": cached[name],
+        }
+
+    print(f"\n{'variant':<14}{'pairs':>6}{'kp':>8}{'mean ms':>10}{'p50':>8}{'p95':>8}{'agree':>8}{'|Δinl|':>8}{'σinl':>7}  stages")
+    for name, s in summary.items():
+        print(f"{name:<14}{s['pairs']:>6}{s['mean_kp'] or 0:>8}{s['mean_ms'] or 0:>10}{s['p50_ms']:>8.0f}{s['p95_ms']:>8.0f}"
+              f"{s['decision_agreement'] or 0:>8}{s['mean_abs_inlier_diff'] or 0:>8}{s['mean_inlier_std'] or 0:>7}  {s['stages']}")
+
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["q_path", "ref_path"] + [f"{n}_{c}" for n in names for c in ("inliers", "ms", "stage")])
+            for i, (a, b) in enumerate(pairs):
+                row = [a, b]
+                for n in names:
+                    r = runs[n][i] or {}
+                    row += [r.get("inliers", ""), r.get("match_ms", ""), r.get("stage", "")]
+                w.writerow(row)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"decide": args.decide, "variants": summary}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
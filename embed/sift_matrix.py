@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""Pairwise SIFT inlier matrix for a set of photos, resumable via the pair cache.
+
+Two inputs:
+  --casewise sift_casewise.csv   queries (q_photo_id/q_path) x references
+                                 (ref_photo_id/ref_path); also rewrites the
+                                 casewise report (inliers_ref, best_other_*,
+                                 margins) from the matrix instead of re-matching
+  --photos photos.csv            photo_id,url[,catalog_id]; all unordered pairs
+
+Images are downloaded once. Pairs are worked through in tiles of
+--feature-cache/2 first photos x --feature-cache/2 second photos, so each
+worker's feature LRU holds a whole tile and detects an image once per tile it
+appears in, rather than once per pair as the HTTP service must.
+Pairs already in the pair cache (same image hashes and parameters as
+sift_server.py would use) are skipped, and every finished chunk is written
+back, so an interrupted run resumes where it stopped.
+
+Near-duplicates recorded by manta-matcher/dedup_photos.py (photo_dedup, read
+from Supabase when SUPABASE_URL is set; --no-dedup turns it off) are matched
+once per group: each member is replaced by its group's representative before
+pairs and pair-cache keys are built, and the representative's results are
+reported for every member. Pairs inside one group are not matched.
+
+  python embed/sift_matrix.py --casewise sift_casewise.csv --cache sift_pairs.sqlite \\
+      --workers 8 --matrix-out sift_matrix.csv --casewise-out sift_casewise.csv --summary sift_summary.json
+"""
+import argparse, csv, hashlib, json, multiprocessing as mp, os, sys, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import sift_server as ss
+from pair_cache import PairCache, flip
+
+CASEWISE_COLUMNS = ["catalog_id", "manta_id", "q_photo_id", "ref_photo_id", "q_path", "ref_path", "cos_ref",
+                    "kp1", "kp2", "good", "inliers_ref", "inlier_ratio_ref", "best_other_inliers",
+                    "best_other_ratio", "margin_inliers", "margin_ratio"]
+
+# Filled in the parent before the pool forks, so workers inherit them without pickling.
+_IMAGES = {}   # photo_id -> (sha256, bytes)
+_OPTS = {}
+_FEATS = OrderedDict()
+
+
+def load_casewise(path):
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    queries, refs, catalog = {}, {}, {}
+    for r in rows:
+        queries[r["q_photo_id"]] = r["q_path"]
+        refs[r["ref_photo_id"]] = r["ref_path"]
+        catalog[r["q_photo_id"]] = catalog[r["ref_photo_id"]] = r.get("catalog_id")
+    pairs = [(q, ref) for q in queries for ref in refs if q != ref]
+    return rows, {**refs, **queries}, catalog, pairs
+
+
+def load_photos(path):
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    urls = {r["photo_id"]: r["url"] for r in rows if r.get("url")}
+    catalog = {r["photo_id"]: r.get("catalog_id") for r in rows}
+    ids = list(urls)
+    pairs = [(ids[i], ids[j]) for i in range(len(ids)) for j in range(i + 1, len(ids))]
+    return urls, catalog, pairs
+
+
+def load_duplicate_map():
+    """{photo_id: canonical_photo_id} from photo_dedup, as strings like the CSV ids."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        print("⚠️ SUPABASE_URL/SUPABASE_KEY not set; treating every photo as canonical", file=sys.stderr)
+        return {}
+    from supabase import create_client
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "manta-matcher"))
+    from dedup_photos import fetch_duplicate_map
+    return {str(pid): str(canonical) for pid, canonical in fetch_duplicate_map(create_client(url, key)).items()}
+
+
+def representatives(ids, duplicates):
+    """{photo_id: photo SIFT runs on}: one per near-duplicate group, the canonical one when it is in `ids`."""
+    present = set(ids)
+    chosen, rep = {}, {}
+    for pid in ids:
+        group = duplicates.get(pid, pid)
+        if group not in chosen:
+            chosen[group] = group if group in present else pid
+        rep[pid] = chosen[group]
+    return rep
+
+
+def collapse(pairs, rep):
+    """Distinct representative pairs to match, first-seen order kept; pairs inside a group are dropped."""
+    out = {}
+    for a, b in pairs:
+        ra, rb = rep.get(a, a), rep.get(b, b)
+        if ra != rb and (rb, ra) not in out:
+            out[(ra, rb)] = None
+    return list(out)
+
+
+def expand(pairs, rep, results):
+    """Results for the original pairs, read from their representatives' pair in either order."""
+    out = {}
+    for a, b in pairs:
+        ra, rb = rep.get(a, a), rep.get(b, b)
+        if (ra, rb) in results:
+            out[(a, b)] = results[(ra, rb)]
+        elif (rb, ra) in results:
+            out[(a, b)] = flip(results[(rb, ra)])
+    return out
+
+
+def download(urls, workers):
+    images, failed = {}, []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(ss._fetch_bytes, url): pid for pid, url in urls.items()}
+        for fut in as_completed(futures):
+            pid = futures[fut]
+            try:
+                content = fut.result()
+                images[pid] = (hashlib.sha256(content).hexdigest(), content)
+            except Exception as e:
+                failed.append(pid)
+                print(f"⚠️ {pid}: {getattr(e, 'detail', e)}", file=sys.stderr)
+    return images, failed
+
+
+def _features_for(pid):
+    if pid in _FEATS:
+        _FEATS.move_to_end(pid)
+        return _FEATS[pid]
+    digest, content = _IMAGES[pid]
+    im, _ = ss._decode_gray(content, _OPTS["roi"], digest)
+    feats = ss._features(im, _OPTS["engine"])
+    _FEATS[pid] = feats
+    while len(_FEATS) > _OPTS["feature_cache"]:
+        _FEATS.popitem(last=False)
+    return feats
+
+
+def _match_chunk(chunk):
+    out = []
+    for a, b in chunk:
+        try:
+            kp1, kp2, good, inl, ratio = ss._match_features(
+                _features_for(a), _features_for(b), _OPTS["engine"], method=_OPTS["method"])
+            out.append((a, b, {"kp1": kp1, "kp2": kp2, "good": good, "inliers": inl, "inlier_ratio": ratio,
+                               "stage": "full", "roi": {"enabled": _OPTS["roi"]}}))
+        except Exception as e:
+            print(f"⚠️ {a} vs {b}: {e}", file=sys.stderr)
+    return out
+
+
+def tiled(pairs, block):
+    """Pairs reordered tile by tile: `block` first photos x `block` second photos per tile."""
+    first = {p: i for i, p in enumerate(dict.fromkeys(a for a, _ in pairs))}
+    second = {p: i for i, p in enumerate(dict.fromkeys(b for _, b in pairs))}
+    return sorted(pairs, key=lambda p: (first[p[0]] // block, second[p[1]] // block, first[p[0]], second[p[1]]))
+
+
+def _chunks(pairs, size):
+    for i in range(0, len(pairs), size):
+        yield pairs[i:i + size]
+
+
+def _dist(values):
+    v = np.asarray([x for x in values if x is not None], dtype=float)
+    if not len(v):
+        return None
+    return {"mean": float(v.mean()), "p5": float(np.percentile(v, 5)),
+            "p50": float(np.percentile(v, 50)), "p95": float(np.percentile(v, 95))}
+
+
+def casewise_report(rows, catalog, results):
+    out = []
+    refs = list(dict.fromkeys(r["ref_photo_id"] for r in rows))
+    for r in rows:
+        q, ref = r["q_photo_id"], r["ref_photo_id"]
+        own = results.get((q, ref))
+        others = [results[(q, o)] for o in refs if o != ref and catalog.get(o) != catalog.get(q) and (q, o) in results]
+        best = max(others, key=lambda x: (x["inliers"], x["inlier_ratio"]), default=None)
+        row = {k: r.get(k, "") for k in ("catalog_id", "manta_id", "q_photo_id", "ref_photo_id", "q_path", "ref_path", "cos_ref")}
+        if own:
+            row.update(kp1=own["kp1"], kp2=own["kp2"], good=own["good"],
+                       inliers_ref=own["inliers"], inlier_ratio_ref=own["inlier_ratio"])
+        if best:
+            row.update(best_other_inliers=best["inliers"], best_other_ratio=best["inlier_ratio"])
+        if own and best:
+            row.update(margin_inliers=own["inliers"] - best["inliers"],
+                       margin_ratio=own["inlier_ratio"] - best["inlier_ratio"])
+        out.append(row)
+    return out, len(refs) - 1
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pairwise SIFT inlier matrix with a resumable pair cache.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--casewise", help="CSV with q_photo_id,q_path,ref_photo_id,ref_path,catalog_id")
+    src.add_argument("--photos", help="CSV with photo_id,url[,catalog_id]")
+    ap.add_argument("--cache", default="sift_pairs.sqlite", help="Pair cache (same file as SIFT_PAIR_CACHE to share)")
+    ap.add_argument("--workers", type=int, default=max(1, mp.cpu_count() - 1))
+    ap.add_argument("--download-workers", type=int, default=16)
+    ap.add_argument("--chunk", type=int, default=64, help="Pairs per worker task")
+    ap.add_argument("--feature-cache", type=int, default=256,
+                    help="Images whose features each worker keeps; pairs are tiled to half this per side")
+    ap.add_argument("--engine", default=ss.SIFT_ENGINE, choices=sorted(ss.ENGINES))
+    ap.add_argument("--ransac-method", default=ss.RANSAC_METHOD, choices=sorted(ss.RANSAC_METHODS))
+    ap.add_argument("--roi", action="store_true", help="Crop to the animal first (as ROI_CROP=1)")
+    ap.add_argument("--no-dedup", action="store_true", help="Match every photo, not one per near-duplicate group")
+    ap.add_argument("--matrix-out", default="sift_matrix.csv")
+    ap.add_argument("--casewise-out", help="Rewritten casewise report (--casewise only)")
+    ap.add_argument("--summary", help="Summary JSON like sift_summary.json (--casewise only)")
+    args = ap.parse_args()
+
+    if args.casewise:
+        rows, urls, catalog, pairs = load_casewise(args.casewise)
+    else:
+        rows = None
+        urls, catalog, pairs = load_photos(args.photos)
+
+    rep = representatives(list(urls), {} if args.no_dedup else load_duplicate_map())
+    wanted, pairs = pairs, collapse(pairs, rep)
+    urls = {pid: url for pid, url in urls.items() if rep[pid] == pid}
+    print(f"🧬 {len(wanted)} pairs over {len(rep)} photos -> {len(pairs)} pairs over {len(urls)} representatives")
+
+    t0 = time.time()
+    images, failed = download(urls, args.download_workers)
+    print(f"📥 {len(images)} images downloaded ({len(failed)} failed) in {time.time() - t0:.1f}s")
+    pairs = [(a, b) for a, b in pairs if a in images and b in images]
+
+    cache = PairCache(args.cache)
+    key = ss._pair_params(args.ransac_method, args.engine, args.roi, False)
+    cached = cache.get_many([(images[a][0], images[b][0]) for a, b in pairs], key)
+    results = {(a, b): cached[(images[a][0], images[b][0])] for a, b in pairs if (images[a][0], images[b][0]) in cached}
+    pending = tiled([p for p in pairs if p not in results], max(1, args.feature_cache // 2))
+    print(f"🗂️ {len(pairs)} pairs: {len(results)} cached, {len(pending)} to match")
+
+    _IMAGES.update(images)
+    _OPTS.update(roi=args.roi, engine=args.engine, method=args.ransac_method, feature_cache=args.feature_cache)
+    t1, done = time.time(), 0
+    with mp.get_context("fork").Pool(args.workers) as pool:
+        for out in pool.imap_unordered(_match_chunk, _chunks(pending, args.chunk)):
+            cache.put_many([(images[a][0], images[b][0], res) for a, b, res in out], key)
+            for a, b, res in out:
+                results[(a, b)] = res
+            done += len(out)
+            rate = done / max(1e-9, time.time() - t1)
+            print(f"  {done}/{len(pending)} pairs, {rate:.1f} pairs/s", file=sys.stderr)
+    results = expand(wanted, rep, results)
+
+    with open(args.matrix_out, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["photo_id_a", "photo_id_b", "catalog_id_a", "catalog_id_b", "kp1", "kp2", "good", "inliers", "inlier_ratio"])
+        for (a, b), res in sorted(results.items()):
+            w.writerow([a, b, catalog.get(a), catalog.get(b), res["kp1"], res["kp2"], res["good"], res["inliers"], res["inlier_ratio"]])
+    print(f"✅ {len(results)} pairs written to {args.matrix_out} in {time.time() - t0:.1f}s total")
+
+    if rows is None:
+        return
+    report, others = casewise_report(rows, catalog, results)
+    if args.casewise_out:
+        with open(args.casewise_out, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=CASEWISE_COLUMNS)
+            w.writeheader()
+            w.writerows(report)
+        print(f"✅ casewise report: {args.casewise_out}")
+    if args.summary:
+        num = lambda k: [float(r[k]) for r in report if r.get(k) not in (None, "")]
+        with open(args.summary, "w") as f:
+            json.dump({
+                "n_pairs": len(report),
+                "cos": _dist(num("cos_ref")),
+                "inliers_ref": _dist(num("inliers_ref")),
+                "inlier_ratio_ref": _dist(num("inlier_ratio_ref")),
+                "margin_inliers": _dist(num("margin_inliers")),
+                "others_compared_per_query": others,
+                "others_sampled_per_query": others,  # original key, kept for existing readers
+            }, f, indent=2)
+        print(f"✅ summary: {args.summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,202 @@
-import os, time, requests, numpy as np, cv2
+import os, time, hashlib, requests, numpy as np, cv2
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
+from roi import RoiCache, crop
+from pair_cache import PairCache, params_key
+import service_metrics as metrics
+from service_profiling import install as install_profiling, profiled
 
 SIFT_NFEATURES=int(os.getenv("SIFT_NFEATURES","4000"))
 SIFT_RATIO=float(os.getenv("SIFT_RATIO","0.75"))
 RANSAC_THRESH=float(os.getenv("RANSAC_THRESH","3.0"))
 RANSAC_ITERS=int(os.getenv("RANSAC_ITERS","2000"))
 RANSAC_CONF=float(os.getenv("RANSAC_CONF","0.995"))
+# Robust estimator for findHomography; the USAC variants need OpenCV >= 4.5.1.
+RANSAC_METHODS={n:getattr(cv2,n) for n in ("RANSAC","USAC_FAST","USAC_MAGSAC","USAC_ACCURATE") if hasattr(cv2,n)}
+RANSAC_METHOD=os.getenv("RANSAC_METHOD","RANSAC").upper()
+if RANSAC_METHOD not in RANSAC_METHODS:
+  raise RuntimeError(f"RANSAC_METHOD={RANSAC_METHOD} not available; choose from {sorted(RANSAC_METHODS)}")
+# Fewer ratio-test survivors than this cannot give a trustworthy homography: report 0 inliers without estimating.
+SIFT_MIN_GOOD=int(os.getenv("SIFT_MIN_GOOD","6"))
 MAX_LONG_EDGE=int(os.getenv("SIFT_MAX_LONG_EDGE","900"))
+# Coarse-to-fine cascade: match a small, sparse version first and only escalate
+# to the full pass when the coarse result is neither a clear accept nor a clear reject.
+SIFT_CASCADE=os.getenv("SIFT_CASCADE","0")=="1"
+COARSE_LONG_EDGE=int(os.getenv("SIFT_COARSE_LONG_EDGE","400"))
+COARSE_NFEATURES=int(os.getenv("SIFT_COARSE_NFEATURES","800"))
+COARSE_ITERS=int(os.getenv("SIFT_COARSE_ITERS","500"))
+COARSE_ACCEPT_INLIERS=int(os.getenv("SIFT_COARSE_ACCEPT_INLIERS","40"))
+COARSE_REJECT_GOOD=int(os.getenv("SIFT_COARSE_REJECT_GOOD","3"))
+# Feature engine: sift (float descriptors, L2 brute force) or a binary fast path,
+# orb / akaze, matched by Hamming distance with brute force or a FLANN LSH index.
+SIFT_ENGINE=os.getenv("SIFT_ENGINE","sift").lower()
+ORB_NFEATURES=int(os.getenv("ORB_NFEATURES","4000"))
+AKAZE_THRESHOLD=float(os.getenv("AKAZE_THRESHOLD","0.001"))
+BINARY_MATCHER=os.getenv("BINARY_MATCHER","bf").lower()  # bf | lsh
+# Crop to the animal (roi.py) before detection; boxes cached per image content hash.
+ROI_CROP=os.getenv("ROI_CROP","0")=="1"
+_roi=RoiCache(int(os.getenv("ROI_CACHE_SIZE","4096")))
+# Pair results memoized by (sha256 a, sha256 b, parameter tuple); empty path disables it.
+SIFT_PAIR_CACHE=os.getenv("SIFT_PAIR_CACHE","")
+_pairs=PairCache(SIFT_PAIR_CACHE) if SIFT_PAIR_CACHE else None
 
 app = FastAPI(title="SIFT Match Service")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+metrics.instrument(app,"sift")
+install_profiling(app,"sift")
+metrics.watch_cache("roi",_roi.stats)
+if _pairs: metrics.watch_cache("sift_pairs",_pairs.stats)
 
 _sift=cv2.SIFT_create(nfeatures=SIFT_NFEATURES)
+_sift_coarse=cv2.SIFT_create(nfeatures=COARSE_NFEATURES)
 _bf=cv2.BFMatcher(cv2.NORM_L2)
+_bf_hamming=cv2.BFMatcher(cv2.NORM_HAMMING)
+# (full detector, coarse detector, binary descriptors, detector settings); only what this
+# OpenCV build provides. The settings go into the reported params and the pair-cache key.
+ENGINES={"sift":(_sift,_sift_coarse,False,{"nfeatures":SIFT_NFEATURES,"coarse_nfeatures":COARSE_NFEATURES})}
+if hasattr(cv2,"ORB_create"):
+  ENGINES["orb"]=(cv2.ORB_create(nfeatures=ORB_NFEATURES),cv2.ORB_create(nfeatures=COARSE_NFEATURES),True,
+                  {"nfeatures":ORB_NFEATURES,"coarse_nfeatures":COARSE_NFEATURES})
+if hasattr(cv2,"AKAZE_create"):
+  ENGINES["akaze"]=(cv2.AKAZE_create(threshold=AKAZE_THRESHOLD),cv2.AKAZE_create(threshold=AKAZE_THRESHOLD*4),True,
+                    {"threshold":AKAZE_THRESHOLD,"coarse_threshold":AKAZE_THRESHOLD*4})
+if SIFT_ENGINE not in ENGINES:
+  raise RuntimeError(f"SIFT_ENGINE={SIFT_ENGINE} not available; choose from {sorted(ENGINES)}")
+if BINARY_MATCHER not in ("bf","lsh"):
+  raise RuntimeError(f"BINARY_MATCHER={BINARY_MATCHER}; choose bf or lsh")
 _sess=requests.Session()
 
 class SiftReq(BaseModel):
   image_url_a: str
   image_url_b: str
+  cascade: Optional[bool]=None
+  ransac_method: Optional[str]=None
+  engine: Optional[str]=None
+  roi: Optional[bool]=None
+  no_cache: bool=False  # match even when the pair cache has a result (benchmarks); the result is still stored
 
-def _fetch_gray(url:str):
+def _fetch_bytes(url:str):
   try:
     r=_sess.get(url,timeout=30); r.raise_for_status()
-    arr=np.frombuffer(r.content,np.uint8)
-    im=cv2.imdecode(arr,cv2.IMREAD_GRAYSCALE)
-    if im is None: raise ValueError("cv2.imdecode failed")
-    im=cv2.equalizeHist(im)
-    h,w=im.shape[:2]; m=max(h,w)
-    if m>MAX_LONG_EDGE:
-      s=MAX_LONG_EDGE/m; im=cv2.resize(im,(int(w*s),int(h*s)),interpolation=cv2.INTER_AREA)
-    return im
+    return r.content
   except Exception as e:
     raise HTTPException(status_code=400, detail=f"failed to fetch/decode image: {e}")
 
-def _sift_inliers(im1,im2):
-  k1,d1=_sift.detectAndCompute(im1,None)
-  k2,d2=_sift.detectAndCompute(im2,None)
+def _decode_gray(content:bytes,roi=False,digest=None):
+  """Returns (image, crop box or None); the box is relative to the decoded frame."""
+  im=cv2.imdecode(np.frombuffer(content,np.uint8),cv2.IMREAD_GRAYSCALE)
+  if im is None: raise HTTPException(status_code=400, detail="failed to fetch/decode image: cv2.imdecode failed")
+  box=None
+  if roi:
+    box=_roi.box_for(digest or hashlib.sha256(content).hexdigest(),im)
+    im=crop(im,box)
+  return _shrink(cv2.equalizeHist(im),MAX_LONG_EDGE),box
+
+def _shrink(im,long_edge):
+  h,w=im.shape[:2]; m=max(h,w)
+  if m>long_edge:
+    s=long_edge/m; im=cv2.resize(im,(int(w*s),int(h*s)),interpolation=cv2.INTER_AREA)
+  return im
+
+def _knn(d1,d2,binary):
+  if not binary: return _bf.knnMatch(d1,d2,k=2)
+  if BINARY_MATCHER=="bf": return _bf_hamming.knnMatch(d1,d2,k=2)
+  # FLANN keeps the trained index on the matcher, so build one per call
+  flann=cv2.FlannBasedMatcher(dict(algorithm=6,table_number=6,key_size=12,multi_probe_level=1),dict(checks=50))
+  return flann.knnMatch(d1,d2,k=2)
+
+def _features(im,engine=SIFT_ENGINE,coarse=False):
+  full,small=ENGINES[engine][:2]
+  return (small if coarse else full).detectAndCompute(im,None)
+
+def _sift_inliers(im1,im2,engine=SIFT_ENGINE,coarse=False,iters=RANSAC_ITERS,method=RANSAC_METHOD):
+  return _match_features(_features(im1,engine,coarse),_features(im2,engine,coarse),engine,iters,method)
+
+def _match_features(f1,f2,engine=SIFT_ENGINE,iters=RANSAC_ITERS,method=RANSAC_METHOD):
+  """(kp1, kp2, good, inliers, inlier_ratio) from two detectAndCompute results."""
+  (k1,d1),(k2,d2)=f1,f2
+  binary=ENGINES[engine][2]
   if d1 is None or d2 is None or len(d1)==0 or len(d2)==0:
     return len(k1 or []),len(k2 or []),0,0,0.0
-  matches=_bf.knnMatch(d1,d2,k=2)
-  good=[m for m,n in matches if len((m,n))==2 and m.distance<SIFT_RATIO*n.distance]
-  if len(good)<6: return len(k1),len(k2),len(good),0,0.0
+  matches=_knn(d1,d2,binary)
+  # LSH can return fewer than two neighbours for a descriptor
+  good=[p[0] for p in matches if len(p)==2 and p[0].distance<SIFT_RATIO*p[1].distance]
+  if len(good)<max(4,SIFT_MIN_GOOD): return len(k1),len(k2),len(good),0,0.0
   pts1=np.float32([k1[m.queryIdx].pt for m in good])
   pts2=np.float32([k2[m.trainIdx].pt for m in good])
-  H,mask=cv2.findHomography(pts1,pts2,cv2.RANSAC,RANSAC_THRESH,maxIters=RANSAC_ITERS,confidence=RANSAC_CONF)
+  H,mask=cv2.findHomography(pts1,pts2,RANSAC_METHODS[method],RANSAC_THRESH,maxIters=iters,confidence=RANSAC_CONF)
   inl=int(mask.sum()) if mask is not None else 0
   return len(k1),len(k2),len(good),inl,inl/max(1,len(good))
 
+def _cascade(im1,im2,method=RANSAC_METHOD,engine=SIFT_ENGINE):
+  """Returns (result, stage, stage_ms); stage is coarse_accept, coarse_reject or full."""
+  t=time.time()
+  res=_sift_inliers(_shrink(im1,COARSE_LONG_EDGE),_shrink(im2,COARSE_LONG_EDGE),engine,True,COARSE_ITERS,method)
+  timings={"coarse":int((time.time()-t)*1000)}
+  if res[3]>=COARSE_ACCEPT_INLIERS: return res,"coarse_accept",timings
+  if res[2]<COARSE_REJECT_GOOD: return res,"coarse_reject",timings
+  t=time.time()
+  res=_sift_inliers(im1,im2,engine,method=method)
+  timings["full"]=int((time.time()-t)*1000)
+  return res,"full",timings
+
+def _params(method=RANSAC_METHOD,engine=SIFT_ENGINE):
+  return {"engine":engine,"binary_matcher":BINARY_MATCHER if ENGINES[engine][2] else None,
+          "detector":ENGINES[engine][3],"ratio":SIFT_RATIO,"min_good":SIFT_MIN_GOOD,
+          "ransac":{"method":method,"thr":RANSAC_THRESH,"iters":RANSAC_ITERS,"conf":RANSAC_CONF},
+          "max_long_edge":MAX_LONG_EDGE,
+          "cascade":{"enabled":SIFT_CASCADE,"long_edge":COARSE_LONG_EDGE,"nfeatures":COARSE_NFEATURES,
+                     "iters":COARSE_ITERS,"accept_inliers":COARSE_ACCEPT_INLIERS,"reject_good":COARSE_REJECT_GOOD}}
+
+def _pair_params(method=RANSAC_METHOD,engine=SIFT_ENGINE,roi=ROI_CROP,cascade=SIFT_CASCADE):
+  """Pair-cache key for everything that can change a result."""
+  return params_key({**_params(method,engine),"roi":bool(roi),"cascade_used":bool(cascade)})
+
 @app.get("/health")
 def health():
-  return {"ok":True,"sift_nfeatures":SIFT_NFEATURES,"ratio":SIFT_RATIO,
-          "ransac":{"thr":RANSAC_THRESH,"iters":RANSAC_ITERS,"conf":RANSAC_CONF},
-          "max_long_edge":MAX_LONG_EDGE}
+  return {"ok":True,"sift_nfeatures":SIFT_NFEATURES,"ratio":SIFT_RATIO,"min_good":SIFT_MIN_GOOD,
+          "ransac":{"method":RANSAC_METHOD,"thr":RANSAC_THRESH,"iters":RANSAC_ITERS,"conf":RANSAC_CONF},
+          "ransac_methods":sorted(RANSAC_METHODS),"engines":sorted(ENGINES),
+          "max_long_edge":MAX_LONG_EDGE,"cascade":_params()["cascade"],"params":_params(),
+          "roi":{"enabled":ROI_CROP,"cache":_roi.stats()},
+          "pair_cache":_pairs.stats() if _pairs else None}
 
 @app.post("/match/sift")
+@profiled
 def match(req:SiftReq):
+  method=(req.ransac_method or RANSAC_METHOD).upper()
+  if method not in RANSAC_METHODS:
+    raise HTTPException(status_code=400, detail=f"unknown ransac_method {method}; choose from {sorted(RANSAC_METHODS)}")
+  engine=(req.engine or SIFT_ENGINE).lower()
+  if engine not in ENGINES:
+    raise HTTPException(status_code=400, detail=f"unknown engine {engine}; choose from {sorted(ENGINES)}")
+  roi=ROI_CROP if req.roi is None else req.roi
+  cascade=SIFT_CASCADE if req.cascade is None else req.cascade
   t=time.time()
-  im1=_fetch_gray(req.image_url_a); im2=_fetch_gray(req.image_url_b)
-  kp1,kp2,good,inl,inl_ratio=_sift_inliers(im1,im2)
-  return {"ok":True,"kp1":kp1,"kp2":kp2,"good":good,"inliers":inl,"inlier_ratio":inl_ratio,
+  with metrics.stage("fetch"):
+    a,b=_fetch_bytes(req.image_url_a),_fetch_bytes(req.image_url_b)
+  ha,hb=hashlib.sha256(a).hexdigest(),hashlib.sha256(b).hexdigest()
+  fetch_ms=int((time.time()-t)*1000)
+  key=_pair_params(method,engine,roi,cascade)
+  res=_pairs.get(ha,hb,key) if _pairs and not req.no_cache else None
+  cached=res is not None
+  stage_ms={}
+  if not cached:
+    with metrics.stage("decode"):
+      (im1,box1),(im2,box2)=_decode_gray(a,roi,ha),_decode_gray(b,roi,hb)
+    if cascade:
+      with metrics.stage("score"):
+        (kp1,kp2,good,inl,inl_ratio),stage,stage_ms=_cascade(im1,im2,method,engine)
+    else:
+      t1=time.time()
+      with metrics.stage("score"):
+        kp1,kp2,good,inl,inl_ratio=_sift_inliers(im1,im2,engine,method=method)
+      stage,stage_ms="full",{"full":int((time.time()-t1)*1000)}
+    res={"kp1":kp1,"kp2":kp2,"good":good,"inliers":inl,"inlier_ratio":inl_ratio,"stage":stage,
+         "roi":{"enabled":roi,"box_a":box1,"box_b":box2}}
+    if _pairs: _pairs.put(ha,hb,key,res)
+  return {"ok":True,"engine":engine,**res,"stage_ms":stage_ms,"fetch_ms":fetch_ms,"cached":cached,
           "elapsed_ms":int((time.time()-t)*1000),
-          "params":{"nfeatures":SIFT_NFEATURES,"ratio":SIFT_RATIO,
-                    "ransac":{"thr":RANSAC_THRESH,"iters":RANSAC_ITERS,"conf":RANSAC_CONF},
-                    "max_long_edge":MAX_LONG_EDGE}}
+          "params":_params(method,engine)}
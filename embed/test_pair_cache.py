@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Round-trip tests for the SQLite pair-result cache in pair_cache.py."""
+
+import os
+import tempfile
+import unittest
+
+from pair_cache import PairCache, params_key
+
+
+class PairCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "pairs.sqlite")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_params_key_ignores_order_and_tracks_values(self):
+        self.assertEqual(params_key({"ratio": 0.75, "engine": "sift"}), params_key({"engine": "sift", "ratio": 0.75}))
+        self.assertNotEqual(params_key({"ratio": 0.75}), params_key({"ratio": 0.8}))
+
+    def test_results_are_keyed_by_hashes_and_params(self):
+        cache = PairCache(self.path)
+        key = params_key({"engine": "sift"})
+        cache.put("a", "b", key, {"inliers": 42})
+        self.assertEqual(cache.get("a", "b", key), {"inliers": 42})
+        self.assertIsNone(cache.get("a", "c", key))
+        self.assertIsNone(cache.get("a", "b", params_key({"engine": "orb"})))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_either_argument_order_finds_the_pair(self):
+        cache = PairCache(self.path)
+        key = params_key({})
+        result = {"kp1": 10, "kp2": 30, "inliers": 7, "roi": {"enabled": True, "box_a": [0, 0, 1, 1], "box_b": None}}
+        cache.put("b", "a", key, result)
+        self.assertEqual(cache.get("b", "a", key), result)
+        self.assertEqual(cache.get("a", "b", key),
+                         {"kp1": 30, "kp2": 10, "inliers": 7, "roi": {"enabled": True, "box_a": None, "box_b": [0, 0, 1, 1]}})
+        self.assertEqual(cache.get_many([("b", "a")], key), {("b", "a"): result})
+        self.assertEqual(len(cache), 1)
+
+    def test_results_survive_reopen(self):
+        key = params_key({})
+        PairCache(self.path).put_many([("a", "b", {"inliers": 1}), ("a", "c", {"inliers": 2})], key)
+        reopened = PairCache(self.path)
+        self.assertEqual(len(reopened), 2)
+        self.assertEqual(reopened.get_many([("a", "c"), ("x", "y")], key), {("a", "c"): {"inliers": 2}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Synthetic-feature tests for the fitted projections in projection.py."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import projection
+
+
+def _features(n=400, in_dim=64, rank=8, seed=0):
+    """Low-rank structure plus small noise, like pooled CNN features."""
+    rng = np.random.default_rng(seed)
+    basis = rng.normal(size=(rank, in_dim))
+    return rng.normal(size=(n, rank)) * np.linspace(5, 1, rank) @ basis + 0.01 * rng.normal(size=(n, in_dim)) + 3.0
+
+
+class RandomProjectionTests(unittest.TestCase):
+    def test_matches_the_original_seeded_matrix(self):
+        rng = np.random.default_rng(123456789)
+        expected = rng.normal(0.0, 1.0 / np.sqrt(2048), size=(2048, 1024)).astype(np.float32)
+        proj = projection.random_projection(1024)
+        np.testing.assert_array_equal(proj.matrix, expected)
+        self.assertEqual(proj.mode, "resnet50_rp")
+        x = np.random.default_rng(1).normal(size=2048).astype(np.float32)
+        np.testing.assert_allclose(proj.apply(x), x @ expected, rtol=1e-5)
+
+
+class FitPcaTests(unittest.TestCase):
+    def test_pca_keeps_the_structure(self):
+        x = _features()
+        proj = projection.fit_pca(x, 8)
+        self.assertEqual(proj.dim, 8)
+        self.assertGreater(proj.meta["explained_variance"], 0.99)
+        np.testing.assert_allclose(proj.apply(x).mean(axis=0), 0, atol=1e-3)
+
+    def test_whitening_gives_unit_variance(self):
+        x = _features()
+        y = projection.fit_pca(x, 8, whiten=True).apply(x)
+        np.testing.assert_allclose(np.cov(y, rowvar=False), np.eye(8), atol=1e-2)
+
+    def test_refit_is_deterministic(self):
+        x = _features()
+        self.assertEqual(projection.fit_pca(x, 4).version, projection.fit_pca(x, 4).version)
+
+    def test_too_many_components(self):
+        with self.assertRaises(ValueError):
+            projection.fit_pca(_features(n=10), 16)
+
+
+class SaveLoadTests(unittest.TestCase):
+    def test_round_trip_and_tamper_check(self):
+        proj = projection.fit_pca(_features(), 6, whiten=True)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "p.npz")
+            projection.save(proj, path, source="test")
+            loaded = projection.load(path)
+            np.testing.assert_array_equal(loaded.matrix, proj.matrix)
+            self.assertEqual(loaded.version, proj.version)
+            self.assertEqual(loaded.mode, "resnet50_pcaw")
+            self.assertEqual(loaded.meta["source"], "test")
+
+            np.savez(path, mean=proj.mean, matrix=proj.matrix * 2, meta=np.array('{"version": "%s"}' % proj.version))
+            with self.assertRaises(ValueError):
+                projection.load(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
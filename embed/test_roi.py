@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Synthetic-image tests for the ROI crop in roi.py."""
+
+import unittest
+
+import numpy as np
+
+import roi
+
+
+def _scene(h=300, w=400, box=(150, 100, 300, 220)):
+    """Blue-ish water with a bright rectangle (x0, y0, x1, y1) standing in for the animal."""
+    img = np.zeros((h, w, 3), dtype=np.uint8)
+    img[...] = (20, 60, 110)
+    x0, y0, x1, y1 = box
+    img[y0:y1, x0:x1] = (230, 230, 225)
+    return img
+
+
+class SaliencyBoxTests(unittest.TestCase):
+    def test_box_covers_the_subject(self):
+        box = roi.saliency_box(_scene())
+        self.assertIsNotNone(box)
+        left, top, right, bottom = roi.to_pixels(box, 400, 300)
+        self.assertLessEqual(left, 150)
+        self.assertLessEqual(top, 100)
+        self.assertGreaterEqual(right, 300)
+        self.assertGreaterEqual(bottom, 220)
+        self.assertLess((right - left) * (bottom - top), 0.5 * 400 * 300)
+
+    def test_uniform_image_keeps_full_frame(self):
+        self.assertIsNone(roi.saliency_box(np.full((200, 200), 90, dtype=np.uint8)))
+
+    def test_crop_and_grayscale(self):
+        gray = _scene()[..., 0]
+        box = roi.saliency_box(gray)
+        self.assertIsNotNone(box)
+        self.assertLess(roi.crop(gray, box).size, gray.size)
+        self.assertIs(roi.crop(gray, None), gray)
+
+
+class RoiCacheTests(unittest.TestCase):
+    def test_hits_and_eviction(self):
+        cache = roi.RoiCache(maxsize=2)
+        img = _scene()
+        first = cache.box_for("a", img)
+        self.assertEqual(cache.box_for("a", img), first)
+        cache.box_for("b", img)
+        cache.box_for("c", img)
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"]), (2, 1, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Pair generation in sift_matrix.py: near-duplicate collapsing and feature-cache tiling."""
+
+import unittest
+from collections import OrderedDict
+
+from sift_matrix import collapse, expand, representatives, tiled
+
+
+def _detections(pairs, capacity):
+    """Feature detections a worker with an LRU of `capacity` images makes over `pairs`."""
+    lru, misses = OrderedDict(), 0
+    for pid in (p for pair in pairs for p in pair):
+        if pid in lru:
+            lru.move_to_end(pid)
+            continue
+        misses += 1
+        lru[pid] = None
+        if len(lru) > capacity:
+            lru.popitem(last=False)
+    return misses
+
+
+class NearDuplicateTests(unittest.TestCase):
+    def test_a_group_of_duplicates_is_matched_once(self):
+        # r1 is canonical for r2..r4; r5 is a member whose canonical is not in this run.
+        duplicates = {"r2": "r1", "r3": "r1", "r4": "r1", "r5": "r9", "r6": "r9"}
+        rep = representatives(["q", "r1", "r2", "r3", "r4", "r5", "r6"], duplicates)
+        self.assertEqual({rep[p] for p in ("r1", "r2", "r3", "r4")}, {"r1"})
+        self.assertEqual((rep["r5"], rep["r6"]), ("r5", "r5"))
+
+        wanted = [("q", r) for r in ("r1", "r2", "r3", "r4")] + [("r2", "r3"), ("r4", "q")]
+        self.assertEqual(collapse(wanted, rep), [("q", "r1")])
+
+    def test_every_member_gets_the_representative_result(self):
+        rep = representatives(["q", "r1", "r2"], {"r2": "r1"})
+        results = expand([("q", "r2"), ("r2", "q"), ("r1", "r2")], rep,
+                         {("q", "r1"): {"kp1": 10, "kp2": 30, "inliers": 7}})
+        self.assertEqual(results[("q", "r2")], {"kp1": 10, "kp2": 30, "inliers": 7})
+        self.assertEqual(results[("r2", "q")]["kp1"], 30)
+        self.assertNotIn(("r1", "r2"), results)
+
+
+class TilingTests(unittest.TestCase):
+    def test_tiles_fit_the_feature_cache(self):
+        pairs = [(f"q{i}", f"r{j}") for i in range(40) for j in range(40)]
+        self.assertGreater(_detections(pairs, 16), 1500)   # query-major order evicts every reference
+        ordered = tiled(pairs, 8)
+        self.assertEqual(sorted(ordered), sorted(pairs))
+        self.assertLessEqual(_detections(ordered, 16), 25 * 16)  # at most once per tile
+
+
+if __name__ == "__main__":
+    unittest.main()
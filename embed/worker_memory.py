@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Per-process memory of a multi-worker server: RSS, PSS, shared vs private.
+
+RSS counts every resident page a worker maps, so weights shared
+copy-on-write with the parent are counted once per worker; PSS splits
+shared pages between the processes mapping them, so the PSS total is
+what the deployment actually costs. Linux only (/proc/<pid>/smaps_rollup).
+
+  # before: plain uvicorn, each worker loads its own model and index
+  uvicorn main:app --workers 4 &
+  python ../embed/worker_memory.py $! --json before.json
+  # after: preload in the parent, fork, share copy-on-write
+  WEB_CONCURRENCY=4 gunicorn -c ../embed/gunicorn_conf.py main:app &
+  python ../embed/worker_memory.py $! --baseline before.json
+"""
+import argparse, json, sys
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def memory(pid="self"):
+    """{field: bytes} for one process; falls back to VmRSS where smaps_rollup is missing."""
+    out = dict.fromkeys(FIELDS, 0)
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in out:
+                    out[name] = int(rest.split()[0]) * 1024
+        return out
+    except FileNotFoundError:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    out["Rss"] = out["Pss"] = int(line.split()[1]) * 1024
+        return out
+
+
+def children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def _cmdline(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+    except FileNotFoundError:
+        return ""
+
+
+def snapshot(master):
+    """Memory of the master and each direct child (the workers)."""
+    procs = [{"pid": master, "role": "master", "cmd": _cmdline(master), **memory(master)}]
+    procs += [{"pid": p, "role": "worker", "cmd": _cmdline(p), **memory(p)} for p in children(master)]
+    total = {k: sum(p[k] for p in procs) for k in FIELDS}
+    return {"processes": procs, "total": total, "workers": len(procs) - 1}
+
+
+def summary_line(label, mem):
+    mb = lambda v: f"{v / 2**20:8.1f}"
+    shared = mem["Shared_Clean"] + mem["Shared_Dirty"]
+    private = mem["Private_Clean"] + mem["Private_Dirty"]
+    return f"  {label:<16} rss {mb(mem['Rss'])} MB  pss {mb(mem['Pss'])} MB  shared {mb(shared)} MB  private {mb(private)} MB"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="RSS/PSS of a server master and its workers.")
+    ap.add_argument("pid", type=int, help="Master (gunicorn arbiter or uvicorn supervisor) pid")
+    ap.add_argument("--json", help="Write the snapshot here")
+    ap.add_argument("--baseline", help="Earlier --json snapshot to compare against")
+    args = ap.parse_args()
+
+    snap = snapshot(args.pid)
+    print(f"pid {args.pid}: {snap['workers']} workers")
+    for p in snap["processes"]:
+        print(summary_line(f"{p['role']} {p['pid']}", p))
+    print(summary_line("total", snap["total"]))
+    workers = [p for p in snap["processes"] if p["role"] == "worker"]
+    if workers:
+        per = {k: sum(p[k] for p in workers) / len(workers) for k in FIELDS}
+        print(summary_line("mean worker", per))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = json.load(f)
+        before, after = base["total"], snap["total"]
+        print(f"vs {args.baseline} ({base['workers']} workers):")
+        for k in ("Rss", "Pss"):
+            delta = after[k] - before[k]
+            pct = 100.0 * delta / before[k] if before[k] else 0.0
+            print(f"  total {k:<4} {before[k] / 2**20:8.1f} -> {after[k] / 2**20:8.1f} MB ({pct:+.1f}%)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(snap, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
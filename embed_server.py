@@ -6,10 +6,12 @@
 # Config:
 #   - D: vector length via env DIM or query param ?d=1024 (env takes precedence)
 #   - CORS enabled for convenience
+#   - GET /metrics: Prometheus text (embed/service_metrics.py)
 
 import base64
 import hashlib
 import os
+import sys
 from typing import Optional
 
 import numpy as np
@@ -18,6 +20,10 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "embed"))
+import service_metrics as metrics
+from service_profiling import install as install_profiling, profiled
+
 DEFAULT_D = int(os.getenv("DIM", "1024"))  # set DIM in env to override
 
 class EmbedIn(BaseModel):
@@ -32,6 +38,8 @@ app.add_middleware(
     allow_methods=["POST", "OPTIONS"],
     allow_headers=["*"],
 )
+metrics.instrument(app, "embed-stub")
+install_profiling(app, "embed-stub")
 
 def _bytes_from_input(payload: EmbedIn) -> bytes:
     if payload.image_url:
@@ -62,6 +70,7 @@ def _deterministic_unit_vector(buf: bytes, D: int) -> np.ndarray:
     return (v / n).astype(np.float32)
 
 @app.post("/embed")
+@profiled
 async def embed(body: EmbedIn, request: Request):
     # Allow optional query param ?d=768 etc. (env DIM overrides)
     try:
@@ -77,8 +86,10 @@ async def embed(body: EmbedIn, request: Request):
         except Exception:
             D = DEFAULT_D
 
-    raw = _bytes_from_input(body)
-    vec = _deterministic_unit_vector(raw, D)
+    with metrics.stage("fetch"):
+        raw = _bytes_from_input(body)
+    with metrics.stage("project"):
+        vec = _deterministic_unit_vector(raw, D)
     return {
         "embedding": vec.tolist(),
         "dim": int(vec.shape[0]),
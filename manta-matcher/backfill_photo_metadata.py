@@ -1,5 +1,11 @@
 # backfill_photo_metadata.py
+#
+# Backfill sightings.population from sightings.island. There are only four
+# population values, so sightings are grouped by target population and each
+# group is written with `in_` filtered bulk updates. Only rows whose stored
+# value differs from the target are touched; --dry-run prints that diff.
 
+import argparse
 import os
 from supabase import create_client
 from dotenv import load_dotenv
@@ -26,17 +32,35 @@ ISLAND_TO_POPULATION = {
     "Niihau": "Kauai",
 }
 
+PAGE_SIZE = 1000
+
+parser = argparse.ArgumentParser(description="Backfill sightings.population from island.")
+parser.add_argument("--dry-run", action="store_true", help="Show the changes without writing them")
+parser.add_argument("--chunk", type=int, default=300, help="Sighting ids per in_() update request")
+args = parser.parse_args()
+
 print("🧠 Backfilling sightings.population...")
 
-# Fetch all sightings with island field
+# Fetch all sightings with island and current population, paged by keyset
+sightings = []
 try:
-    sightings_response = supabase.table("sightings").select("pk_sighting_id, island").execute()
-    sightings = sightings_response.data
+    last_id = None
+    while True:
+        query = supabase.table("sightings").select("pk_sighting_id, island, population").order("pk_sighting_id").limit(PAGE_SIZE)
+        if last_id is not None:
+            query = query.gt("pk_sighting_id", last_id)
+        page = query.execute().data or []
+        sightings.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+        last_id = page[-1]["pk_sighting_id"]
 except Exception as e:
     print(f"❌ Failed to fetch sightings: {e}")
     exit(1)
 
-# Loop and update population
+# Group the sightings that need a change by their target population
+changes = {}
+unchanged = 0
 for s in sightings:
     sighting_id = s.get("pk_sighting_id")
     island = s.get("island")
@@ -45,13 +69,32 @@ for s in sightings:
     if not population:
         print(f"⚠️ Unknown island '{island}' for sighting {sighting_id}")
         continue
+    if s.get("population") == population:
+        unchanged += 1
+        continue
+    changes.setdefault(population, []).append(sighting_id)
+
+print(f"📊 {len(sightings)} sightings, {unchanged} already correct")
+for population, ids in sorted(changes.items()):
+    print(f"   → {population}: {len(ids)} to update")
+
+if args.dry_run:
+    for population, ids in sorted(changes.items()):
+        print(f"🧪 {population}: {ids}")
+    print("🧪 Dry run, nothing written.")
+    exit(0)
 
-    try:
-        supabase.table("sightings").update({
-            "population": population
-        }).eq("pk_sighting_id", sighting_id).execute()
-        print(f"✅ Updated sighting {sighting_id} → {population}")
-    except Exception as e:
-        print(f"❌ Failed to update sighting {sighting_id}: {e}")
+requests_made = 0
+for population, ids in changes.items():
+    for i in range(0, len(ids), args.chunk):
+        batch = ids[i:i + args.chunk]
+        try:
+            supabase.table("sightings").update({
+                "population": population
+            }).in_("pk_sighting_id", batch).execute()
+            requests_made += 1
+            print(f"✅ Updated {len(batch)} sightings → {population}")
+        except Exception as e:
+            print(f"❌ Failed to update {len(batch)} sightings → {population}: {e}")
 
-print("🎉 Done.")
+print(f"🎉 Done. {sum(len(ids) for ids in changes.values())} sightings changed in {requests_made} update requests.")
@@ -1,9 +1,16 @@
 # backfill_photo_population.py
-
+#
+# Set-based backfill of photos.population from sightings.population:
+#   1. load the whole sighting -> population map once,
+#   2. page photos with population IS NULL by keyset on pk_photo_id
+#      (offsets skip rows because this script shrinks that result set),
+#   3. upsert the resolved rows in chunks sized by JSON payload.
+
+import argparse
+import json
 import os
 from dotenv import load_dotenv
 from supabase import create_client
-from time import sleep
 
 # Load .env variables
 load_dotenv()
@@ -13,77 +20,80 @@ SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ["SUPABA
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-BATCH_SIZE = 1000
-offset = 0
-updated_count = 0
-skipped_count = 0
-
-print("🔁 Backfilling population into photos table...")
-
-while True:
-    print(f"\n📦 Fetching batch starting at offset {offset}...")
+parser = argparse.ArgumentParser(description="Backfill photos.population from sightings.")
+parser.add_argument("--page-size", type=int, default=1000, help="Rows per keyset page (PostgREST max-rows)")
+parser.add_argument("--max-payload-kb", type=int, default=512, help="Upper bound on each upsert request body")
+parser.add_argument("--dry-run", action="store_true", help="Resolve populations without writing")
+args = parser.parse_args()
+
+requests_made = 0
+
+
+def keyset_pages(table, columns, key, **filters):
+    """Yield pages of `table` ordered by `key`, continuing after the last key seen."""
+    global requests_made
+    last = None
+    while True:
+        query = supabase.table(table).select(columns).order(key).limit(args.page_size)
+        for column, value in filters.items():
+            query = query.is_(column, value)
+        if last is not None:
+            query = query.gt(key, last)
+        rows = query.execute().data or []
+        requests_made += 1
+        if rows:
+            yield rows
+        if len(rows) < args.page_size:
+            return
+        last = rows[-1][key]
+
+
+def payload_chunks(rows, max_bytes):
+    """Split rows into lists whose JSON encoding stays under max_bytes."""
+    chunk, size = [], 2
+    for row in rows:
+        row_size = len(json.dumps(row)) + 1
+        if chunk and size + row_size > max_bytes:
+            yield chunk
+            chunk, size = [], 2
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
 
-    try:
-        # ✅ FIXED: Only two arguments allowed
-        result = (
-            supabase
-            .table("photos")
-            .select("pk_photo_id, fk_sighting_id, population")
-            .is_("population", None)
-            .limit(BATCH_SIZE)
-            .offset(offset)
-            .execute()
-        )
-    except Exception as e:
-        print(f"❌ Error fetching photos: {e}")
-        break
 
-    photos = result.data
-    if not photos:
-        print("\n✅ All applicable photos processed.")
-        break
-
-    updates = []
+print("🔁 Backfilling population into photos table...")
 
-    for photo in photos:
-        photo_id = photo.get("pk_photo_id")
-        sighting_id = photo.get("fk_sighting_id")
+print("📦 Loading sighting populations...")
+population_by_sighting = {}
+for page in keyset_pages("sightings", "pk_sighting_id, population", "pk_sighting_id"):
+    for s in page:
+        if s.get("population"):
+            population_by_sighting[s["pk_sighting_id"]] = s["population"]
+print(f"   {len(population_by_sighting)} sightings have a population")
 
-        if not sighting_id:
-            skipped_count += 1
-            continue
-
-        try:
-            sighting_result = (
-                supabase
-                .table("sightings")
-                .select("population")
-                .eq("pk_sighting_id", sighting_id)
-                .limit(1)
-                .execute()
-            )
-            sighting_data = sighting_result.data[0] if sighting_result.data else None
-            population = sighting_data["population"] if sighting_data else None
-
-            if population:
-                updates.append({
-                    "pk_photo_id": photo_id,
-                    "population": population
-                })
-        except Exception as e:
-            print(f"⚠️ Error fetching sighting for photo {photo_id}: {e}")
+updates = []
+skipped_count = 0
+for page in keyset_pages("photos", "pk_photo_id, fk_sighting_id", "pk_photo_id", population=None):
+    for photo in page:
+        population = population_by_sighting.get(photo.get("fk_sighting_id"))
+        if population:
+            updates.append({"pk_photo_id": photo["pk_photo_id"], "population": population})
+        else:
             skipped_count += 1
 
-    if updates:
-        try:
-            supabase.table("photos").upsert(updates, on_conflict="pk_photo_id").execute()
-            updated_count += len(updates)
-            for update in updates:
-                print(f"✅ Updated photo {update['pk_photo_id']} → {update['population']}")
-        except Exception as e:
-            print(f"❌ Error updating batch: {e}")
+if args.dry_run:
+    print(f"\n🧪 Dry run: {len(updates)} photos would be updated, {skipped_count} skipped.")
+    raise SystemExit(0)
 
-    offset += BATCH_SIZE
-    sleep(0.5)
+updated_count = 0
+for chunk in payload_chunks(updates, args.max_payload_kb * 1024):
+    try:
+        supabase.table("photos").upsert(chunk, on_conflict="pk_photo_id").execute()
+        requests_made += 1
+        updated_count += len(chunk)
+        print(f"✅ Updated {updated_count}/{len(updates)} photos")
+    except Exception as e:
+        print(f"❌ Error updating batch of {len(chunk)} starting at photo {chunk[0]['pk_photo_id']}: {e}")
 
-print(f"\n🎉 Done. {updated_count} photos updated, {skipped_count} skipped.")
+print(f"\n🎉 Done. {updated_count} photos updated, {skipped_count} skipped, {requests_made} requests.")
@@ -0,0 +1,197 @@
+# build_knn_graph.py
+#
+# Build (or incrementally extend) the photo kNN graph in photo_neighbors:
+# the top-k most similar photos for every photo in photo_embeddings.
+#
+# Full build: rows are scored against the whole matrix in --chunk sized
+# blocks (chunk x N floats at a time) and the top k per row are kept.
+#
+# Incremental (default when the graph already exists): only photos missing
+# from the graph are scored against everything, and existing photos are
+# scored against just the new photos; an existing photo is rewritten only
+# when a new photo beats its current k-th neighbour, or fully recomputed when
+# one of its neighbours has left the index.
+#
+# Photos that are no longer indexed (deleted, or listed in the exclusion file
+# from scripts/scan_embeddings.py) lose their rows, and a rewritten photo loses
+# any rows past its new list (e.g. after a smaller --k), so
+# /photos/{id}/neighbors never serves stale neighbours.
+
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from embedding_index import fetch_embedding_rows, load_exclusions, parse_vector
+
+PAGE_SIZE = 1000
+WRITE_CHUNK = 1000
+
+
+def load_matrix(supabase, exclude=()):
+    ids, vectors, dim = [], [], None
+    for row in fetch_embedding_rows(supabase):
+        if row["photo_id"] in exclude:
+            continue
+        try:
+            vec = parse_vector(row["embedding"])
+        except Exception:
+            continue
+        if vec is None or vec.ndim != 1:
+            continue
+        dim = dim or vec.shape[0]
+        norm = np.linalg.norm(vec)
+        if vec.shape[0] != dim or not np.isfinite(norm) or norm == 0:
+            continue
+        ids.append(row["photo_id"])
+        vectors.append(vec / norm)
+    matrix = np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(ids, dtype=np.int64), matrix
+
+
+def load_graph(supabase):
+    """{photo_id: [(score, neighbor_id), ...]} from photo_neighbors, paged by keyset."""
+    graph, last = {}, None
+    while True:
+        query = (
+            supabase.table("photo_neighbors")
+            .select("photo_id, rank, neighbor_id, score")
+            .order("photo_id").order("rank")
+            .limit(PAGE_SIZE)
+        )
+        if last is not None:
+            # (photo_id, rank) keyset: rest of the last photo, then later photos
+            query = query.or_(f"photo_id.gt.{last[0]},and(photo_id.eq.{last[0]},rank.gt.{last[1]})")
+        rows = query.execute().data or []
+        for row in rows:
+            graph.setdefault(row["photo_id"], []).append((row["score"], row["neighbor_id"]))
+        if len(rows) < PAGE_SIZE:
+            return graph
+        last = (rows[-1]["photo_id"], rows[-1]["rank"])
+
+
+def top_k_rows(queries, matrix, k, exclude_cols=None):
+    """Top-k (cols, scores) of queries @ matrix.T per row, best first."""
+    scores = queries @ matrix.T
+    if exclude_cols is not None:
+        scores[np.arange(len(exclude_cols)), exclude_cols] = -np.inf
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def neighbours_for(rows, ids, matrix, k, chunk):
+    """{photo_id: [(score, neighbor_id), ...]} for the given matrix rows against everything."""
+    result = {}
+    for start in range(0, len(rows), chunk):
+        block = rows[start:start + chunk]
+        cols, scores = top_k_rows(matrix[block], matrix, k, exclude_cols=block)
+        for r, c_row, s_row in zip(block, cols, scores):
+            result[int(ids[r])] = [(float(s), int(ids[c])) for c, s in zip(c_row, s_row) if np.isfinite(s)]
+    return result
+
+
+def write_graph(supabase, graph, k):
+    """Upsert each photo's list, then drop its rows past the end of that list."""
+    now = datetime.now(timezone.utc).isoformat()
+    photos = list(graph)
+    per_chunk = max(1, WRITE_CHUNK // max(1, k))
+    written = 0
+    for i in range(0, len(photos), per_chunk):
+        chunk = photos[i:i + per_chunk]
+        rows = [
+            {"photo_id": pid, "rank": rank, "neighbor_id": nid, "score": round(score, 6), "updated_at": now}
+            for pid in chunk
+            for rank, (score, nid) in enumerate(graph[pid], start=1)
+        ]
+        if rows:
+            supabase.table("photo_neighbors").upsert(rows, on_conflict="photo_id,rank").execute()
+        by_length = {}
+        for pid in chunk:
+            by_length.setdefault(len(graph[pid]), []).append(pid)
+        for length, pids in by_length.items():
+            supabase.table("photo_neighbors").delete().in_("photo_id", pids).gt("rank", length).execute()
+        written += len(rows)
+    return written
+
+
+def remove_photos(supabase, photo_ids):
+    """Delete every row of photos that are no longer indexed."""
+    photo_ids = sorted(photo_ids)
+    for i in range(0, len(photo_ids), WRITE_CHUNK):
+        supabase.table("photo_neighbors").delete().in_("photo_id", photo_ids[i:i + WRITE_CHUNK]).execute()
+    return len(photo_ids)
+
+
+def main():
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Build the photo kNN graph in photo_neighbors.")
+    parser.add_argument("--k", type=int, default=20, help="Neighbours stored per photo")
+    parser.add_argument("--chunk", type=int, default=1024, help="Query rows scored per matrix product")
+    parser.add_argument("--full", action="store_true", help="Rebuild every photo instead of only new ones")
+    parser.add_argument("--exclude", default=os.getenv("EMBEDDING_EXCLUDE_FILE"),
+                        help="Photo ids to leave out of the graph (default: EMBEDDING_EXCLUDE_FILE)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY")
+    supabase = create_client(supabase_url, supabase_key)
+
+    t0 = time.perf_counter()
+    ids, matrix = load_matrix(supabase, load_exclusions(args.exclude))
+    print(f"📥 {len(ids)} embeddings loaded in {time.perf_counter() - t0:.1f}s")
+
+    graph = load_graph(supabase)
+    row_of = {int(pid): r for r, pid in enumerate(ids)}
+    gone = {pid for pid in graph if pid not in row_of}
+    if gone:
+        print(f"🧹 Removed rows of {remove_photos(supabase, gone)} photos no longer indexed")
+    if len(ids) < 2:
+        print("Nothing to do.")
+        return
+
+    # A list that points at a photo that has left the index is rebuilt from scratch.
+    existing = {} if args.full else {
+        pid: neighbours[:args.k] for pid, neighbours in graph.items()
+        if pid in row_of and all(nid in row_of for _, nid in neighbours)
+    }
+    new_rows = np.asarray([r for r, pid in enumerate(ids) if int(pid) not in existing], dtype=np.int64)
+    print(f"🆕 {len(new_rows)} photos to (re)compute, {len(existing)} kept from the graph")
+
+    t1 = time.perf_counter()
+    updates = neighbours_for(new_rows, ids, matrix, args.k, args.chunk)
+    # Lists stored with a larger --k are cut down even if nothing new beats them.
+    updates.update((pid, existing[pid]) for pid in existing if len(graph[pid]) > args.k)
+
+    # Existing photos only change if a new photo beats their current k-th neighbour.
+    old_rows = np.asarray([row_of[pid] for pid in existing if pid in row_of], dtype=np.int64)
+    if len(new_rows) and len(old_rows):
+        new_matrix = matrix[new_rows]
+        for start in range(0, len(old_rows), args.chunk):
+            block = old_rows[start:start + args.chunk]
+            scores = matrix[block] @ new_matrix.T
+            for r, s_row in zip(block, scores):
+                pid = int(ids[r])
+                current = existing[pid]
+                floor = current[-1][0] if len(current) >= args.k else -np.inf
+                better = np.flatnonzero(s_row > floor)
+                if better.size:
+                    merged = current + [(float(s_row[c]), int(ids[new_rows[c]])) for c in better]
+                    updates[pid] = sorted(merged, key=lambda item: -item[0])[:args.k]
+
+    print(f"🧮 {len(updates)} neighbour lists computed in {time.perf_counter() - t1:.1f}s")
+    written = write_graph(supabase, updates, args.k)
+    print(f"✅ Wrote {written} photo_neighbors rows in {time.perf_counter() - t0:.1f}s total")
+
+
+if __name__ == "__main__":
+    main()
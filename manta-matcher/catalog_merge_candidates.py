@@ -0,0 +1,157 @@
+# catalog_merge_candidates.py
+#
+# Rank likely duplicate catalog entries for the merge-catalogs workflow.
+#
+# catalog.embedding_vector holds one mean vector per catalog, so all-pairs
+# cosine similarity is a blocked matrix product. Tiles of tile x tile scores
+# are computed over the upper triangle only (memory stays bounded at
+# tile^2 floats), pairs above --threshold are pushed into a top-k heap per
+# catalog, and the surviving pairs can optionally be SIFT-verified on the
+# catalogs' best photos before the ranked report is written.
+
+import argparse
+import csv
+import heapq
+import os
+import time
+
+import numpy as np
+import requests
+
+from embedding_index import parse_vector
+
+PAGE_SIZE = 1000
+
+
+def load_catalog_vectors(supabase):
+    ids, names, urls, vectors = [], [], [], []
+    skipped, dim, last = 0, None, None
+    while True:
+        query = (
+            supabase.table("catalog")
+            .select("pk_catalog_id, name, best_catalog_photo_url, embedding_vector")
+            .order("pk_catalog_id")
+            .limit(PAGE_SIZE)
+        )
+        if last is not None:
+            query = query.gt("pk_catalog_id", last)
+        rows = query.execute().data or []
+        for row in rows:
+            try:
+                vec = parse_vector(row.get("embedding_vector"))
+            except Exception:
+                vec = None
+            if vec is None or vec.ndim != 1:
+                skipped += 1
+                continue
+            dim = dim or vec.shape[0]
+            norm = np.linalg.norm(vec)
+            if vec.shape[0] != dim or not np.isfinite(norm) or norm == 0 or np.ptp(vec) == 0:
+                skipped += 1
+                continue
+            ids.append(row["pk_catalog_id"])
+            names.append(row.get("name"))
+            urls.append(row.get("best_catalog_photo_url"))
+            vectors.append(vec / norm)
+        if len(rows) < PAGE_SIZE:
+            break
+        last = rows[-1]["pk_catalog_id"]
+    matrix = np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return ids, names, urls, matrix, skipped
+
+
+def top_pairs(matrix, threshold, k, tile):
+    """Pairs (i, j, score), i < j, kept if either endpoint has them in its top k above threshold."""
+    n = matrix.shape[0]
+    heaps = [[] for _ in range(n)]
+
+    def push(row, other, score):
+        heap = heaps[row]
+        if len(heap) < k:
+            heapq.heappush(heap, (score, other))
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, (score, other))
+
+    for i0 in range(0, n, tile):
+        block_i = matrix[i0:i0 + tile]
+        for j0 in range(i0, n, tile):
+            scores = block_i @ matrix[j0:j0 + tile].T
+            rows, cols = np.nonzero(scores >= threshold)
+            for r, c in zip(rows, cols):
+                i, j = i0 + int(r), j0 + int(c)
+                if j <= i:
+                    continue
+                s = float(scores[r, c])
+                push(i, j, s)
+                push(j, i, s)
+
+    pairs = {}
+    for i, heap in enumerate(heaps):
+        for score, j in heap:
+            pairs[(min(i, j), max(i, j))] = score
+    return sorted(((i, j, s) for (i, j), s in pairs.items()), key=lambda p: -p[2])
+
+
+def sift_verify(sift_url, url_a, url_b, timeout=120):
+    if not url_a or not url_b:
+        return None
+    try:
+        resp = requests.post(sift_url, json={"image_url_a": url_a, "image_url_b": url_b}, timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()
+    except Exception as e:
+        print(f"⚠️ SIFT verification failed for {url_a} vs {url_b}: {e}")
+        return None
+
+
+def main():
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Rank catalog pairs that look like the same manta.")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Minimum cosine to keep a pair")
+    parser.add_argument("--top-k", type=int, default=5, help="Pairs kept per catalog")
+    parser.add_argument("--tile", type=int, default=2048, help="Rows/cols per similarity tile")
+    parser.add_argument("--sift-url", help="SIFT service /match/sift URL to verify the top pairs")
+    parser.add_argument("--verify-top", type=int, default=50, help="How many top pairs to SIFT-verify")
+    parser.add_argument("--out", default="catalog_merge_candidates.csv")
+    args = parser.parse_args()
+
+    load_dotenv()
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY")
+    supabase = create_client(supabase_url, supabase_key)
+
+    t0 = time.perf_counter()
+    ids, names, urls, matrix, skipped = load_catalog_vectors(supabase)
+    print(f"📥 {len(ids)} catalog vectors loaded ({skipped} missing/invalid) in {time.perf_counter() - t0:.1f}s")
+
+    t1 = time.perf_counter()
+    pairs = top_pairs(matrix, args.threshold, args.top_k, args.tile)
+    print(f"🧮 {len(pairs)} pairs ≥ {args.threshold} in {time.perf_counter() - t1:.1f}s")
+
+    verified = {}
+    if args.sift_url:
+        for i, j, _ in pairs[:args.verify_top]:
+            verified[(i, j)] = sift_verify(args.sift_url, urls[i], urls[j])
+
+    with open(args.out, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "rank", "catalog_id_a", "name_a", "catalog_id_b", "name_b", "cosine",
+            "sift_inliers", "sift_inlier_ratio", "photo_url_a", "photo_url_b",
+        ])
+        for rank, (i, j, score) in enumerate(pairs, start=1):
+            sift = verified.get((i, j)) or {}
+            writer.writerow([
+                rank, ids[i], names[i], ids[j], names[j], f"{score:.6f}",
+                sift.get("inliers", ""), sift.get("inlier_ratio", ""), urls[i], urls[j],
+            ])
+
+    print(f"✅ Wrote {len(pairs)} merge candidates to {args.out} in {time.perf_counter() - t0:.1f}s total")
+
+
+if __name__ == "__main__":
+    main()
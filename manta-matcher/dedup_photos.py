@@ -0,0 +1,255 @@
+# dedup_photos.py
+#
+# Group near-identical photos (burst shots, re-uploads of the same frame) so
+# embeddings, index entries and SIFT verification (embed/sift_matrix.py) are
+# computed once per group.
+#
+#   1. a 64-bit difference hash (dHash) is computed for every photo not yet in
+#      photo_dedup (thumbnails, downloaded concurrently),
+#   2. candidate pairs come from a multi-index Hamming index: hashes are split
+#      into radius+1 bands, and by pigeonhole any pair within the radius shares
+#      at least one identical band, so lookups are bucket probes, not a scan,
+#   3. candidates are confirmed by CLIP embedding cosine when both photos have
+#      one (or by a stricter Hamming radius when they do not),
+#   4. confirmed pairs are merged with union-find; the lowest photo id is the
+#      canonical representative, and every photo gets a photo_dedup row.
+#
+# Pairs are only formed between photos of the same identity (catalog, else
+# manta, else both unidentified), so a chain of near-duplicates can never join
+# two catalogs. Consumers only skip a member whose canonical photo actually has
+# an embedding; see skippable_duplicates().
+
+import argparse
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+
+from embedding_index import fetch_embedding_rows, parse_vector
+
+PAGE_SIZE = 1000
+HASH_BITS = 64
+
+
+def dhash(image, size=8):
+    """Difference hash: compare horizontally adjacent pixels of a (size+1)x size grayscale thumbnail."""
+    gray = np.asarray(image.convert("L").resize((size + 1, size), Image.LANCZOS), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+class HammingIndex:
+    """Multi-index hashing over fixed-width integer hashes."""
+
+    def __init__(self, radius, bits=HASH_BITS):
+        self.radius = radius
+        self.bands = radius + 1
+        edges = np.linspace(0, bits, self.bands + 1).astype(int)
+        self.masks = [(((1 << (hi - lo)) - 1) << lo, lo) for lo, hi in zip(edges[:-1], edges[1:])]
+        self.tables = [dict() for _ in self.masks]
+        self.hashes = {}
+
+    def add(self, key, h):
+        self.hashes[key] = h
+        for table, (mask, shift) in zip(self.tables, self.masks):
+            table.setdefault((h & mask) >> shift, []).append(key)
+
+    def query(self, h, radius=None):
+        """Keys whose hash is within `radius` bits of h, with their distances."""
+        radius = self.radius if radius is None else radius
+        seen, found = set(), []
+        for table, (mask, shift) in zip(self.tables, self.masks):
+            for key in table.get((h & mask) >> shift, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                dist = bin(self.hashes[key] ^ h).count("1")
+                if dist <= radius:
+                    found.append((key, dist))
+        return found
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def _paged(supabase, table, columns, key):
+    last = None
+    while True:
+        query = supabase.table(table).select(columns).order(key).limit(PAGE_SIZE)
+        if last is not None:
+            query = query.gt(key, last)
+        rows = query.execute().data or []
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+        last = rows[-1][key]
+
+
+def fetch_duplicate_map(supabase):
+    """{photo_id: canonical_photo_id} for every non-canonical group member.
+
+    Returns an empty map (and says so) when photo_dedup has not been created yet.
+    """
+    try:
+        return {
+            row["photo_id"]: row["canonical_photo_id"]
+            for row in _paged(supabase, "v_photo_duplicates", "photo_id, canonical_photo_id", "photo_id")
+        }
+    except Exception as e:
+        print(f"⚠️ No duplicate map available ({e}); treating every photo as canonical")
+        return {}
+
+
+def identity(photo):
+    """Which animal a photo is filed under; near-duplicates are only grouped within one identity."""
+    if photo.get("fk_catalog_id") is not None:
+        return ("catalog", photo["fk_catalog_id"])
+    if photo.get("fk_manta_id") is not None:
+        return ("manta", photo["fk_manta_id"])
+    return ("unidentified", None)
+
+
+def skippable_duplicates(duplicates, embedded):
+    """The members of {photo_id: canonical_photo_id} whose canonical photo is in `embedded`."""
+    return {pid: canonical for pid, canonical in duplicates.items() if canonical in embedded}
+
+
+def group_photos(hashes, identity_of, vectors, radius, strict_radius, min_cosine):
+    """Union-find over confirmed near-duplicate pairs; returns (groups, candidates, confirmed).
+
+    One Hamming index per identity, so candidates never cross catalogs.
+    Hashes of photos missing from identity_of (since deleted) are ignored.
+    """
+    indexes = {}
+    groups = UnionFind()
+    candidates = confirmed = 0
+    for pid in sorted(hashes):
+        if pid not in identity_of:
+            continue
+        h = hashes[pid]
+        index = indexes.setdefault(identity_of[pid], HammingIndex(radius))
+        for other, dist in index.query(h):
+            candidates += 1
+            a, b = vectors.get(pid), vectors.get(other)
+            if a is not None and b is not None and a.shape == b.shape:
+                ok = float(a @ b) >= min_cosine
+            else:
+                ok = dist <= strict_radius
+            if ok:
+                confirmed += 1
+                groups.union(pid, other)
+        index.add(pid, h)
+    return groups, candidates, confirmed
+
+
+def _hash_photo(session, url, timeout):
+    try:
+        resp = session.get(url, timeout=timeout)
+        resp.raise_for_status()
+        return dhash(Image.open(io.BytesIO(resp.content)))
+    except Exception as e:
+        print(f"⚠️ Could not hash {url}: {e}")
+        return None
+
+
+def main():
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Group near-duplicate photos into photo_dedup.")
+    parser.add_argument("--radius", type=int, default=6, help="Max dHash Hamming distance for a candidate pair")
+    parser.add_argument("--strict-radius", type=int, default=2, help="Radius accepted without embeddings to confirm")
+    parser.add_argument("--min-cosine", type=float, default=0.97, help="Embedding cosine needed to confirm a candidate")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent thumbnail downloads")
+    parser.add_argument("--rehash", action="store_true", help="Recompute hashes for photos already in photo_dedup")
+    parser.add_argument("--dry-run", action="store_true", help="Report groups without writing photo_dedup")
+    args = parser.parse_args()
+
+    load_dotenv()
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY")
+    supabase = create_client(supabase_url, supabase_key)
+
+    hashes = {}
+    if not args.rehash:
+        hashes = {row["photo_id"]: int(row["phash"], 16) for row in _paged(supabase, "photo_dedup", "photo_id, phash", "photo_id")}
+
+    photos = list(_paged(supabase, "photos", "id, storage_path, thumbnail_url, fk_catalog_id, fk_manta_id", "id"))
+    identity_of = {p["id"]: identity(p) for p in photos}
+    todo = []
+    for p in photos:
+        if p["id"] in hashes:
+            continue
+        path = p.get("thumbnail_url") or p.get("storage_path")
+        if not path:
+            continue
+        url = path if path.startswith("http") else f"{supabase_url}/storage/v1/object/public/manta-images/{path}"
+        todo.append((p["id"], url))
+
+    print(f"🔢 {len(hashes)} hashes cached, hashing {len(todo)} photos...")
+    session = requests.Session()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for (pid, _), h in zip(todo, pool.map(lambda item: _hash_photo(session, item[1], 30), todo)):
+            if h is not None:
+                hashes[pid] = h
+
+    print("📥 Loading embeddings for confirmation...")
+    vectors = {}
+    for row in fetch_embedding_rows(supabase):
+        if row["photo_id"] in hashes:
+            vec = parse_vector(row["embedding"])
+            norm = np.linalg.norm(vec) if vec is not None else 0
+            if norm > 0:
+                vectors[row["photo_id"]] = vec / norm
+
+    groups, candidates, confirmed = group_photos(
+        hashes, identity_of, vectors, args.radius, args.strict_radius, args.min_cosine)
+
+    rows = []
+    for pid, h in hashes.items():
+        if pid not in identity_of:
+            continue
+        canonical = groups.find(pid)
+        a, b = vectors.get(pid), vectors.get(canonical)
+        cosine = float(a @ b) if a is not None and b is not None and a.shape == b.shape else None
+        rows.append({
+            "photo_id": pid,
+            "phash": f"{h:016x}",
+            "canonical_photo_id": canonical,
+            "hamming": bin(h ^ hashes[canonical]).count("1"),
+            "cosine": cosine,
+        })
+
+    members = sum(1 for r in rows if r["canonical_photo_id"] != r["photo_id"])
+    canonicals = len({r["canonical_photo_id"] for r in rows if r["canonical_photo_id"] != r["photo_id"]})
+    print(f"🔗 {candidates} candidate pairs, {confirmed} confirmed")
+    print(f"🧬 {members} duplicate photos in {canonicals} groups out of {len(rows)} hashed photos")
+
+    if args.dry_run:
+        return
+    for i in range(0, len(rows), 500):
+        supabase.table("photo_dedup").upsert(rows[i:i + 500], on_conflict="photo_id").execute()
+    print(f"✅ Wrote {len(rows)} photo_dedup rows")
+
+
+if __name__ == "__main__":
+    main()
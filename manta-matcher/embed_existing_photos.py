@@ -1,15 +1,36 @@
 # embed_existing_photos.py
+#
+# Streaming embedding backfill:
+#   photo list -> download (threads) -> decode+preprocess (threads)
+#              -> batched CLIP inference -> batched upsert sink
+# Stages are connected by bounded queues so a slow stage applies back-pressure
+# instead of buffering the whole archive. Photos that already have a row in
+# photo_embeddings are skipped, as are non-canonical near-duplicates recorded
+# by dedup_photos.py whose canonical photo is already embedded. Per-stage
+# throughput and utilization are printed so it is clear whether network, CPU
+# or the model is the bottleneck.
+# With INFERENCE_URL set, batches go to the shared inference service and this
+# script never loads CLIP; the preprocess stage then only validates images.
 
-import os
+import argparse
 import io
+import os
+import queue
+import sys
+import threading
+import time
+
 import requests
 from PIL import Image
-import torch
-import clip
 import numpy as np
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+from dedup_photos import fetch_duplicate_map, skippable_duplicates
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "embed"))
+import inference_client
+
 # Load environment variables
 load_dotenv()
 
@@ -19,54 +40,273 @@ assert SUPABASE_URL and SUPABASE_KEY, "Missing Supabase environment variables"
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# Load CLIP model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
+PAGE_SIZE = 1000
+_DONE = object()
 
-# Fetch all photos (id and storage_path only)
-print("📥 Fetching photo list...")
-try:
-    response = supabase.table("photos").select("id, storage_path").execute()
-    photos = response.data
-except Exception as e:
-    print(f"❌ Error fetching photo list: {e}")
-    exit(1)
 
-print(f"📸 Found {len(photos)} photos")
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.count = 0
+        self.errors = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, n, seconds, errors=0):
+        with self._lock:
+            self.count += n
+            self.busy += seconds
+            self.errors += errors
+
+    def line(self, wall):
+        rate = self.count / wall if wall > 0 else 0.0
+        util = self.busy / (self.workers * wall) if wall > 0 else 0.0
+        return (f"  {self.name:<11} {self.count:>7} items  {rate:8.1f}/s  "
+                f"utilization {util:6.1%}  errors {self.errors}")
+
+
+def fetch_ids(table, column):
+    """All values of `column` in `table`, paged by keyset."""
+    values, last = [], None
+    while True:
+        query = supabase.table(table).select(column).order(column).limit(PAGE_SIZE)
+        if last is not None:
+            query = query.gt(column, last)
+        rows = query.execute().data or []
+        values.extend(row[column] for row in rows)
+        if len(rows) < PAGE_SIZE:
+            return values
+        last = values[-1]
 
-# Loop through photos
-for photo in photos:
-    try:
-        photo_id = photo["id"]
-        storage_path = photo.get("storage_path")
 
-        if not storage_path:
-            print(f"⚠️ Skipping photo_id {photo_id}: missing storage_path")
-            continue
+def fetch_pending_photos(reembed, include_duplicates):
+    print("📥 Fetching photo list...")
+    photos = []
+    last = None
+    while True:
+        query = supabase.table("photos").select("id, storage_path").order("id").limit(PAGE_SIZE)
+        if last is not None:
+            query = query.gt("id", last)
+        rows = query.execute().data or []
+        photos.extend(rows)
+        if len(rows) < PAGE_SIZE:
+            break
+        last = rows[-1]["id"]
 
-        # Construct public image URL
-        image_url = f"{SUPABASE_URL}/storage/v1/object/public/manta-images/{storage_path}"
-        print(f"➡️ Processing {image_url}")
+    done = set(fetch_ids("photo_embeddings", "photo_id"))
+    if not include_duplicates:
+        duplicates = skippable_duplicates(fetch_duplicate_map(supabase), done)
+        before = len(photos)
+        photos = [p for p in photos if p["id"] not in duplicates]
+        print(f"⏭️  Skipping {before - len(photos)} near-duplicates of an already embedded canonical photo")
 
-        image_response = requests.get(image_url)
-        image_response.raise_for_status()
+    if reembed:
+        return photos
+    pending = [p for p in photos if p["id"] not in done]
+    print(f"⏭️  Skipping {len(photos) - len(pending)} photos that already have embeddings")
+    return pending
 
-        image = Image.open(io.BytesIO(image_response.content)).convert("RGB")
-        image_input = preprocess(image).unsqueeze(0).to(device)
 
+def _encoder():
+    """(prepare(bytes) -> item, forward(items) -> (n, 512) array) for the service or a local CLIP."""
+    if inference_client.enabled():
+        client = inference_client.InferenceClient(model="clip-vitb32")
+
+        def prepare(content):
+            Image.open(io.BytesIO(content)).verify()
+            return content
+
+        return prepare, client.embed_images
+
+    import torch
+    import clip
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess = clip.load("ViT-B/32", device=device)
+
+    def prepare(content):
+        return preprocess(Image.open(io.BytesIO(content)).convert("RGB"))
+
+    def forward(tensors):
         with torch.no_grad():
-            embedding = model.encode_image(image_input).cpu().numpy()[0]
-            norm = np.linalg.norm(embedding)
-            if norm == 0:
-                raise ValueError("Zero vector embedding")
-            embedding = (embedding / norm).tolist()
-
-        # Upsert embedding into photo_embeddings table
-        print(f"✅ Storing embedding for {photo_id}")
-        supabase.table("photo_embeddings").upsert({
-            "photo_id": photo_id,
-            "embedding": embedding,
-        }).execute()
+            return model.encode_image(torch.stack(tensors).to(device)).cpu().numpy()
+
+    return prepare, forward
+
+
+def run_pipeline(photos, download_workers, preprocess_workers, batch_size, upsert_batch, queue_size):
+    prepare, forward = _encoder()
+
+    stats = {
+        "download": StageStats("download", download_workers),
+        "preprocess": StageStats("preprocess", preprocess_workers),
+        "inference": StageStats("inference", 1),
+        "upsert": StageStats("upsert", 1),
+    }
+    todo_q = queue.Queue()
+    raw_q = queue.Queue(maxsize=queue_size)
+    tensor_q = queue.Queue(maxsize=queue_size)
+    sink_q = queue.Queue(maxsize=queue_size)
 
+    for photo in photos:
+        todo_q.put(photo)
+    for _ in range(download_workers):
+        todo_q.put(_DONE)
+
+    def downloader():
+        session = requests.Session()
+        while True:
+            photo = todo_q.get()
+            if photo is _DONE:
+                return
+            storage_path = photo.get("storage_path")
+            if not storage_path:
+                print(f"⚠️ Skipping photo_id {photo['id']}: missing storage_path")
+                continue
+            t = time.perf_counter()
+            try:
+                image_url = f"{SUPABASE_URL}/storage/v1/object/public/manta-images/{storage_path}"
+                resp = session.get(image_url, timeout=30)
+                resp.raise_for_status()
+                stats["download"].record(1, time.perf_counter() - t)
+                raw_q.put((photo["id"], resp.content))
+            except Exception as e:
+                stats["download"].record(0, time.perf_counter() - t, errors=1)
+                print(f"❌ Download failed for photo_id {photo['id']}: {e}")
+
+    def close_downloads(download_threads):
+        # Once every downloader has drained the work list, stop each preprocessor.
+        for th in download_threads:
+            th.join()
+        for _ in range(preprocess_workers):
+            raw_q.put(_DONE)
+
+    def preprocessor():
+        while True:
+            item = raw_q.get()
+            if item is _DONE:
+                tensor_q.put(_DONE)
+                return
+            photo_id, content = item
+            t = time.perf_counter()
+            try:
+                tensor = prepare(content)
+                stats["preprocess"].record(1, time.perf_counter() - t)
+                tensor_q.put((photo_id, tensor))
+            except Exception as e:
+                stats["preprocess"].record(0, time.perf_counter() - t, errors=1)
+                print(f"❌ Decode failed for photo_id {photo_id}: {e}")
+
+    def sink():
+        pending = []
+
+        def flush():
+            if not pending:
+                return
+            t = time.perf_counter()
+            try:
+                supabase.table("photo_embeddings").upsert(pending, on_conflict="photo_id").execute()
+                stats["upsert"].record(len(pending), time.perf_counter() - t)
+            except Exception as e:
+                stats["upsert"].record(0, time.perf_counter() - t, errors=len(pending))
+                print(f"❌ Upsert of {len(pending)} embeddings failed: {e}")
+            pending.clear()
+
+        while True:
+            item = sink_q.get()
+            if item is _DONE:
+                flush()
+                return
+            pending.append(item)
+            if len(pending) >= upsert_batch:
+                flush()
+
+    download_threads = [threading.Thread(target=downloader, daemon=True) for _ in range(download_workers)]
+    workers = download_threads + [
+        threading.Thread(target=close_downloads, args=(download_threads,), daemon=True),
+        *[threading.Thread(target=preprocessor, daemon=True) for _ in range(preprocess_workers)],
+    ]
+    sink_thread = threading.Thread(target=sink, daemon=True)
+    for th in workers + [sink_thread]:
+        th.start()
+
+    def encode(batch):
+        t = time.perf_counter()
+        try:
+            embeddings = forward([x for _, x in batch])
+            norms = np.linalg.norm(embeddings, axis=1)
+            good = 0
+            for (photo_id, _), vec, norm in zip(batch, embeddings, norms):
+                if norm == 0:
+                    print(f"❌ Failed for photo_id {photo_id}: Zero vector embedding")
+                    continue
+                sink_q.put({"photo_id": photo_id, "embedding": (vec / norm).tolist()})
+                good += 1
+            stats["inference"].record(good, time.perf_counter() - t, errors=len(batch) - good)
+        except Exception as e:
+            stats["inference"].record(0, time.perf_counter() - t, errors=len(batch))
+            print(f"❌ Inference failed for batch of {len(batch)}: {e}")
+
+    started = time.perf_counter()
+    last_report = started
+    remaining = preprocess_workers
+    batch = []
+
+    while remaining:
+        try:
+            item = tensor_q.get(timeout=0.5)
+        except queue.Empty:
+            item = None
+        if item is _DONE:
+            remaining -= 1
+        elif item is not None:
+            batch.append(item)
+        # Run full batches, or a partial one when the upstream stages are starved.
+        if len(batch) >= batch_size or (batch and (item is None or not remaining)):
+            encode(batch)
+            batch = []
+        now = time.perf_counter()
+        if now - last_report > 10:
+            print(f"⏱️  {now - started:.0f}s elapsed")
+            for s in stats.values():
+                print(s.line(now - started))
+            last_report = now
+    if batch:
+        encode(batch)
+
+    sink_q.put(_DONE)
+    sink_thread.join()
+
+    wall = time.perf_counter() - started
+    print(f"\n🎉 Embedded {stats['upsert'].count} photos in {wall:.1f}s")
+    for s in stats.values():
+        print(s.line(wall))
+    bottleneck = max(stats.values(), key=lambda s: s.busy / s.workers)
+    print(f"🔎 Busiest stage: {bottleneck.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed photos missing from photo_embeddings with CLIP ViT-B/32.")
+    parser.add_argument("--download-workers", type=int, default=16)
+    parser.add_argument("--preprocess-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per CLIP forward pass")
+    parser.add_argument("--upsert-batch", type=int, default=200, help="Rows per photo_embeddings upsert")
+    parser.add_argument("--queue-size", type=int, default=256, help="Bound on each inter-stage queue")
+    parser.add_argument("--reembed", action="store_true", help="Re-embed photos that already have a vector")
+    parser.add_argument("--include-duplicates", action="store_true", help="Also embed non-canonical near-duplicates")
+    args = parser.parse_args()
+
+    try:
+        photos = fetch_pending_photos(args.reembed, args.include_duplicates)
     except Exception as e:
-        print(f"❌ Failed for photo_id {photo.get('id')}: {e}")
+        print(f"❌ Error fetching photo list: {e}")
+        exit(1)
+
+    print(f"📸 Found {len(photos)} photos to embed")
+    if photos:
+        run_pipeline(photos, args.download_workers, args.preprocess_workers,
+                     args.batch_size, args.upsert_batch, args.queue_size)
+
+
+if __name__ == "__main__":
+    main()
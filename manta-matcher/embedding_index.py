@@ -0,0 +1,280 @@
+# embedding_index.py
+#
+# In-memory index over photo_embeddings. Vectors are loaded once, L2-normalized
+# and stacked into a single float32 matrix so a query (or a batch of queries)
+# is scored with one matrix multiply instead of a per-row Python loop.
+#
+# Rows are grouped into contiguous partitions keyed by (population, photo_view)
+# so a query restricted to, say, Maui Nui ventral photos scores a slice of the
+# matrix without copying it.
+#
+# Non-canonical near-duplicates (dedup_photos.py) are left out of the matrix
+# when their canonical photo has a valid vector in it.
+#
+# The matrix and its partitions are a snapshot: vectors re-embedded and
+# population/view edits made after the load (even once the metadata cache has
+# refreshed) only take effect on reload(). Catalog/sighting rollups are
+# persisted, so they never read the snapshot; see fetch_rollup_vectors().
+
+import json
+import threading
+
+import numpy as np
+
+PAGE_SIZE = 1000
+UNKNOWN = "unknown"
+
+
+def parse_vector(raw):
+    """Decode a stored embedding (JSON text or list) into a float32 array."""
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    return np.asarray(raw, dtype=np.float32)
+
+
+def fetch_embedding_rows(supabase, page_size=PAGE_SIZE):
+    """Yield every photo_embeddings row, paging with .range() past the PostgREST row cap."""
+    start = 0
+    while True:
+        resp = (
+            supabase
+            .table("photo_embeddings")
+            .select("photo_id, embedding")
+            .order("photo_id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows = resp.data or []
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            break
+        start += page_size
+
+
+def load_exclusions(path):
+    """Photo ids to leave out of the index, one per line (see scripts/scan_embeddings.py)."""
+    if not path:
+        return set()
+    with open(path) as f:
+        return {int(line) for line in (l.strip() for l in f) if line and not line.startswith("#")}
+
+
+def _valid(raw, dim=None):
+    """Parse a stored vector as is; ValueError if it is malformed, the wrong size, zero or non-finite."""
+    vec = parse_vector(raw)
+    if vec is None or vec.ndim != 1:
+        raise ValueError("missing or malformed vector")
+    if dim is not None and vec.shape[0] != dim:
+        raise ValueError(f"dimension {vec.shape[0]} != {dim}")
+    norm = np.linalg.norm(vec)
+    if not np.isfinite(norm) or norm == 0:
+        raise ValueError("zero or non-finite norm")
+    return vec
+
+
+def _checked(raw, dim=None):
+    """_valid(), L2-normalized."""
+    vec = _valid(raw, dim)
+    return vec / np.linalg.norm(vec)
+
+
+def fetch_rollup_vectors(supabase, photo_ids, exclude=(), chunk=200):
+    """Current, unnormalized photo_embeddings vectors to average into a catalog/sighting embedding.
+
+    Read straight from the table, so a photo re-embedded since the index was
+    loaded contributes its new vector. Excluded (scanner-flagged) ids and
+    vectors failing _valid() are left out; every vector must have the
+    dimension of the first valid one.
+    """
+    wanted = [pid for pid in dict.fromkeys(photo_ids) if pid not in exclude]
+    rows = {}
+    for start in range(0, len(wanted), chunk):
+        resp = (
+            supabase
+            .table("photo_embeddings")
+            .select("photo_id, embedding")
+            .in_("photo_id", wanted[start:start + chunk])
+            .execute()
+        )
+        rows.update((row["photo_id"], row["embedding"]) for row in resp.data or [])
+    vectors, dim = [], None
+    for pid in wanted:
+        if pid not in rows:
+            continue
+        try:
+            vec = _valid(rows[pid], dim)
+            dim = vec.shape[0]
+            vectors.append(vec)
+        except Exception as e:
+            print(f"Invalid vector for photo {pid}: {e}")
+    return vectors
+
+
+class EmbeddingIndex:
+    def __init__(self, supabase, metadata, exclude=None, duplicates=None):
+        self.supabase = supabase
+        self.metadata = metadata
+        self.exclude = set(exclude or ())
+        self.duplicates = dict(duplicates or {})
+        self.excluded = 0
+        self.deduplicated = set()
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.skipped = 0
+        self.partitions = {}
+        self.row_of = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+
+    def reload(self):
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        ids, vectors, rejected, excluded, dim = [], [], set(), 0, None
+        for entry in fetch_embedding_rows(self.supabase):
+            if entry["photo_id"] in self.exclude:
+                excluded += 1
+                continue
+            try:
+                vec = _checked(entry["embedding"], dim)
+                dim = vec.shape[0]
+                ids.append(entry["photo_id"])
+                vectors.append(vec)
+            except Exception as e:
+                rejected.add(entry.get("photo_id"))
+                print(f"Skipping photo_id {entry.get('photo_id')} due to error: {e}")
+
+        # Drop a near-duplicate only when its canonical photo is actually indexed.
+        indexed = set(ids)
+        deduplicated = set()
+        kept_ids, kept_vectors = [], []
+        for pid, vec in zip(ids, vectors):
+            if self.duplicates.get(pid) in indexed:
+                deduplicated.add(pid)
+            else:
+                kept_ids.append(pid)
+                kept_vectors.append(vec)
+        ids, vectors = kept_ids, kept_vectors
+
+        meta = self.metadata.get_many(ids) if ids else {}
+
+        def partition_key(pid):
+            row = meta.get(pid) or {}
+            return (row.get("population") or UNKNOWN, row.get("photo_view") or UNKNOWN)
+
+        keyed = sorted(
+            ((partition_key(pid), pid, vec) for pid, vec in zip(ids, vectors)),
+            key=lambda item: (item[0], item[1]),
+        )
+
+        partitions = {}
+        for row, (key, _, _) in enumerate(keyed):
+            start, _ = partitions.get(key, (row, row))
+            partitions[key] = (start, row + 1)
+
+        self.ids = np.asarray([pid for _, pid, _ in keyed], dtype=np.int64)
+        self.matrix = (
+            np.vstack([vec for _, _, vec in keyed]).astype(np.float32)
+            if keyed else np.zeros((0, dim or 0), dtype=np.float32)
+        )
+        # Read-only, so forked workers sharing it copy-on-write never dirty its pages.
+        self.matrix.setflags(write=False)
+        self.partitions = partitions
+        self.row_of = {int(pid): row for row, pid in enumerate(self.ids)}
+        self.deduplicated = deduplicated
+        self.skipped = len(rejected)
+        self.excluded = excluded
+        self._loaded = True
+
+    def select(self, populations=None, views=None):
+        """Row slices for the partitions matching the given populations/views (None = everything)."""
+        if not populations and not views:
+            return None
+        return [
+            slice(start, stop)
+            for (population, view), (start, stop) in sorted(self.partitions.items(), key=lambda kv: kv[1])
+            if (not populations or population in populations) and (not views or view in views)
+        ]
+
+    def scores(self, queries, slices=None):
+        """Cosine similarity of each (already normalized) query row against the indexed vectors.
+
+        Returns the score matrix and the global row index of each of its columns.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if slices is None:
+            return queries @ self.matrix.T, np.arange(len(self))
+        if not slices:
+            return np.zeros((queries.shape[0], 0), dtype=np.float32), np.zeros(0, dtype=np.int64)
+        scores = np.hstack([queries @ self.matrix[s].T for s in slices])
+        return scores, np.concatenate([np.arange(s.start, s.stop) for s in slices])
+
+    def search(self, queries, k, slices=None, prioritize=False):
+        """Top-k global rows and scores per query.
+
+        With ``slices`` the scan is restricted to those partitions. With
+        ``prioritize`` the selected partitions are ranked first and the rest of
+        the index is scanned only to fill up to k results.
+        """
+        scores, cols = self.scores(queries, slices)
+        top_idx, top_scores = self.top_k(scores, k)
+        top_idx = cols[top_idx]
+        if prioritize and slices is not None and top_idx.shape[1] < min(k, len(self)):
+            selected = {s.start for s in slices}
+            rest = [
+                slice(start, stop)
+                for start, stop in sorted(self.partitions.values())
+                if start not in selected
+            ]
+            rest_scores, rest_cols = self.scores(queries, rest)
+            rest_idx, rest_top = self.top_k(rest_scores, k - top_idx.shape[1])
+            top_idx = np.hstack([top_idx, rest_cols[rest_idx]])
+            top_scores = np.hstack([top_scores, rest_top])
+        return top_idx, top_scores
+
+    def partition_of(self, row):
+        for key, (start, stop) in self.partitions.items():
+            if start <= row < stop:
+                return key
+        return (UNKNOWN, UNKNOWN)
+
+    def stats(self):
+        by_population = {}
+        for (population, _), (start, stop) in self.partitions.items():
+            by_population[population] = by_population.get(population, 0) + stop - start
+        return {
+            "loaded": self._loaded,
+            "size": len(self),
+            "dim": int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0,
+            "skipped": self.skipped,
+            "excluded": self.excluded,
+            "deduplicated": len(self.deduplicated),
+            "populations": by_population,
+            "partitions": [
+                {"population": population, "photo_view": view, "size": stop - start}
+                for (population, view), (start, stop) in sorted(self.partitions.items())
+            ],
+        }
+
+    def top_k(self, scores, k):
+        """Return (row indices, scores) of the k best columns for each row of a score matrix."""
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return np.zeros((scores.shape[0], 0), dtype=np.int64), np.zeros((scores.shape[0], 0), dtype=np.float32)
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        part_scores = np.take_along_axis(scores, part, axis=1)
+        order = np.argsort(-part_scores, axis=1, kind="stable")
+        return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
@@ -2,15 +2,24 @@ import os
 import io
 import json
 import numpy as np
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Query, Body
 from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from PIL import Image
-import torch
-import clip
 import asyncio
+import sys
+from typing import List, Optional
+
+from embedding_index import EmbeddingIndex, fetch_rollup_vectors, load_exclusions
+from photo_metadata import PhotoMetadataCache
+from dedup_photos import fetch_duplicate_map
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "embed"))
+import service_metrics as metrics
+from service_profiling import install as install_profiling, profiled
+import inference_client
 
 # Load environment variables
 load_dotenv()
@@ -21,9 +30,43 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# Load CLIP model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
+# CLIP runs in the shared inference service when INFERENCE_URL is set;
+# otherwise it is loaded in-process as before.
+if inference_client.enabled():
+    inference = inference_client.InferenceClient(model="clip-vitb32")
+else:
+    import torch
+    import clip
+    inference = None
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess = clip.load("ViT-B/32", device=device)
+
+# Photo embeddings are scanned from memory; loaded on first match.
+TOP_K = 50
+photo_cache = PhotoMetadataCache(supabase, ttl=int(os.getenv("PHOTO_CACHE_TTL", "600")))
+def _index_exclusions():
+    """Ids kept out of the index and the rollups: scanner-flagged vectors."""
+    return load_exclusions(os.getenv("EMBEDDING_EXCLUDE_FILE"))
+
+def _index_duplicates():
+    """Near-duplicates the index may drop in favour of their (indexed) canonical photo."""
+    return fetch_duplicate_map(supabase) if os.getenv("INDEX_SKIP_DUPLICATES", "1") == "1" else {}
+
+index = EmbeddingIndex(supabase, photo_cache, exclude=_index_exclusions(), duplicates=_index_duplicates())
+# Under embed/gunicorn_conf.py the master loads the index before forking so
+# workers share the matrix copy-on-write instead of each loading it.
+if os.getenv("PRELOAD_INDEX", "0") == "1":
+    index.ensure_loaded()
+
+def reset_after_fork():
+    """Called by gunicorn_conf.py in each worker: fresh HTTP clients, so workers
+    never share the keep-alive connections the master pooled while preloading."""
+    global supabase, inference
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    photo_cache.supabase = supabase
+    index.supabase = supabase
+    if inference is not None:
+        inference = inference_client.InferenceClient(model="clip-vitb32")
 
 # FastAPI app
 app = FastAPI()
@@ -35,94 +78,227 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+metrics.instrument(app, "manta-matcher")
+install_profiling(app, "manta-matcher")
+metrics.watch_cache("photo_metadata", photo_cache.stats)
 
 @app.get("/")
 def read_root():
     return {"message": "Manta Matcher is running"}
 
+def _encode_images(blobs):
+    """Encode raw image bytes in one CLIP forward pass; returns L2-normalized rows and pre-normalization norms."""
+    if inference is not None:
+        with metrics.stage("forward"):
+            embeddings = inference.embed_images(blobs)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings, norms[:, 0]
+    with metrics.stage("decode"):
+        images = [Image.open(io.BytesIO(b)).convert("RGB") for b in blobs]
+    with metrics.stage("preprocess"):
+        batch = torch.stack([preprocess(img) for img in images]).to(device)
+    with metrics.stage("forward"), torch.no_grad():
+        embeddings = model.encode_image(batch).cpu().numpy().astype(np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms), norms[:, 0]
+
+def _photo_url(path):
+    return f"https://{SUPABASE_URL.split('//')[1]}/storage/v1/object/public/manta-images/{path}"
+
+def _ranked_matches(indices, scores, photo_map):
+    result = []
+    for idx, score in zip(indices, scores):
+        pid = int(index.ids[idx])
+        meta = photo_map.get(pid, {})
+        path = meta.get("storage_path")
+        population, view = index.partition_of(idx)
+        result.append({
+            "photo_id": pid,
+            "similarity": round(float(score), 4),
+            "photo_url": _photo_url(path) if path else None,
+            "thumbnail_url": meta.get("thumbnail_url"),
+            "catalog_id": meta.get("fk_catalog_id"),
+            "manta_id": meta.get("fk_manta_id"),
+            "population": population,
+            "photo_view": view,
+        })
+    return result
+
+def _split_param(value):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+def _partition_slices(population, view):
+    """Index slices for comma-separated population/photo_view filters (None = whole index)."""
+    return index.select(_split_param(population), _split_param(view))
+
 @app.post("/match/")
-async def match_photo(file: UploadFile = File(...)):
+@profiled
+async def match_photo(
+    file: UploadFile = File(...),
+    population: Optional[str] = Query(None, description="Comma-separated populations, e.g. 'Maui Nui,Oahu'"),
+    view: Optional[str] = Query(None, description="Comma-separated photo_view values, e.g. 'ventral'"),
+    partition_mode: str = Query("restrict", pattern="^(restrict|prioritize)$"),
+):
     try:
         image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
-        preprocessed = preprocess(image).unsqueeze(0).to(device)
-
-        with torch.no_grad():
-            query_embedding = model.encode_image(preprocessed).cpu().numpy()[0]
-            norm = np.linalg.norm(query_embedding)
-            if norm == 0:
-                return JSONResponse(status_code=400, content={"error": "Invalid image vector"})
-            query_embedding /= norm
-
-        response = supabase.table("photo_embeddings").select("photo_id, embedding").execute()
-        if not response.data:
-            return JSONResponse(status_code=404, content={"error": "No embeddings found in database"})
+        query, norms = _encode_images([image_data])
+        if norms[0] == 0:
+            return JSONResponse(status_code=400, content={"error": "Invalid image vector"})
 
-        similarities = []
-        for entry in response.data:
-            try:
-                stored_vector = np.array(json.loads(entry["embedding"]), dtype=np.float32)
-                stored_norm = np.linalg.norm(stored_vector)
-                if stored_norm > 0:
-                    stored_vector /= stored_norm
-                sim = np.dot(query_embedding, stored_vector)
-                similarities.append((entry["photo_id"], sim))
-            except Exception as e:
-                print(f"Skipping photo_id {entry['photo_id']} due to error: {e}")
-
-        top_matches = sorted(similarities, key=lambda x: -x[1])[:50]
-        photo_ids = [pid for pid, _ in top_matches]
-
-        photos_resp = (
-            supabase
-            .table("photos")
-            .select("id, storage_path")
-            .in_("id", photo_ids)
-            .execute()
-        )
+        with metrics.stage("index_load"):
+            index.ensure_loaded()
+        if len(index) == 0:
+            return JSONResponse(status_code=404, content={"error": "No embeddings found in database"})
 
-        photo_url_map = {}
-        if photos_resp.data:
-            for p in photos_resp.data:
-                path = p.get("storage_path")
-                if path:
-                    url = f"https://{SUPABASE_URL.split('//')[1]}/storage/v1/object/public/manta-images/{path}"
-                    photo_url_map[p["id"]] = url
-
-        result = [
-            {
-                "photo_id": pid,
-                "similarity": round(float(score), 4),
-                "photo_url": photo_url_map.get(pid)
-            }
-            for pid, score in top_matches
-        ]
+        with metrics.stage("score"):
+            top_idx, top_scores = index.search(
+                query, TOP_K, _partition_slices(population, view), prioritize=partition_mode == "prioritize"
+            )
+        with metrics.stage("db"):
+            photo_map = photo_cache.get_many([int(index.ids[i]) for i in top_idx[0]])
 
         return {
             "filename": file.filename,
-            "matches": result
+            "matches": _ranked_matches(top_idx[0], top_scores[0], photo_map)
+        }
+
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.post("/match/batch")
+@profiled
+async def match_photo_batch(
+    files: List[UploadFile] = File(...),
+    fuse: str = Query("max", pattern="^(max|mean)$"),
+    top_k: int = Query(TOP_K, ge=1, le=500),
+    population: Optional[str] = Query(None, description="Comma-separated populations, e.g. 'Maui Nui,Oahu'"),
+    view: Optional[str] = Query(None, description="Comma-separated photo_view values, e.g. 'ventral'"),
+    partition_mode: str = Query("restrict", pattern="^(restrict|prioritize)$"),
+):
+    """Match every photo of an encounter in one forward pass and one matrix multiply.
+
+    Returns per-image rankings plus a per-catalog ranking that fuses each
+    image's best similarity to the catalog by max or mean.
+    """
+    try:
+        queries, norms = _encode_images([await f.read() for f in files])
+        if np.any(norms == 0):
+            bad = [files[i].filename for i in np.flatnonzero(norms == 0)]
+            return JSONResponse(status_code=400, content={"error": f"Invalid image vector: {bad}"})
+
+        with metrics.stage("index_load"):
+            index.ensure_loaded()
+        if len(index) == 0:
+            return JSONResponse(status_code=404, content={"error": "No embeddings found in database"})
+
+        with metrics.stage("score"):
+            top_idx, top_scores = index.search(
+                queries, top_k, _partition_slices(population, view), prioritize=partition_mode == "prioritize"
+            )
+            candidates = np.unique(top_idx)
+            scores = queries @ index.matrix[candidates].T  # (n_images, n_candidates)
+        with metrics.stage("db"):
+            photo_map = photo_cache.get_many([int(index.ids[i]) for i in candidates])
+
+        # Per catalog, take each image's best similarity over the candidate pool,
+        # then fuse across images.
+        catalog_cols = {}
+        for pos, row in enumerate(candidates):
+            catalog_id = photo_map.get(int(index.ids[row]), {}).get("fk_catalog_id")
+            if catalog_id is not None:
+                catalog_cols.setdefault(catalog_id, []).append(pos)
+
+        catalogs = []
+        for catalog_id, cols in catalog_cols.items():
+            per_image = scores[:, cols].max(axis=1)
+            fused = per_image.max() if fuse == "max" else per_image.mean()
+            best_col = candidates[cols[int(np.argmax(scores[:, cols].max(axis=0)))]]
+            catalogs.append({
+                "catalog_id": catalog_id,
+                "score": round(float(fused), 4),
+                "per_image": [round(float(s), 4) for s in per_image],
+                "best_photo_id": int(index.ids[best_col]),
+            })
+        catalogs.sort(key=lambda c: -c["score"])
+
+        return {
+            "fuse": fuse,
+            "images": [
+                {
+                    "filename": f.filename,
+                    "matches": _ranked_matches(top_idx[i], top_scores[i], photo_map),
+                }
+                for i, f in enumerate(files)
+            ],
+            "catalogs": catalogs[:top_k],
         }
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+# Under gunicorn each worker holds its own index and metadata cache, so
+# /index/reload and /cache/invalidate only affect the worker that serves the
+# request; HUP the master to reload every worker. Re-embedded vectors and
+# population/view edits reach the index's partitions only through a reload.
+@app.post("/index/reload")
+async def reload_index():
+    try:
+        index.exclude = _index_exclusions()
+        index.duplicates = _index_duplicates()
+        index.reload()
+        return {"status": "reloaded", "size": len(index), "skipped": index.skipped, "excluded": index.excluded,
+                "deduplicated": len(index.deduplicated)}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/index/stats")
+async def index_stats():
+    return {**index.stats(), "metadata_cache": photo_cache.stats()}
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(photo_ids: Optional[List[int]] = Body(None, embed=True)):
+    """Drop cached photo metadata for the given ids, or all of it when none are given."""
+    photo_cache.invalidate(photo_ids)
+    return {"status": "invalidated", "photo_ids": photo_ids, "size": len(photo_cache)}
+
+@app.get("/photos/{photo_id}/neighbors")
+async def photo_neighbors(photo_id: int, k: int = Query(20, ge=1, le=100)):
+    """Precomputed nearest neighbours from photo_neighbors (see build_knn_graph.py)."""
+    try:
+        with metrics.stage("db"):
+            rows = (
+                supabase.table("photo_neighbors")
+                .select("rank, neighbor_id, score")
+                .eq("photo_id", photo_id)
+                .order("rank")
+                .limit(k)
+                .execute()
+            ).data or []
+            if not rows:
+                return JSONResponse(status_code=404, content={"error": f"No neighbours stored for photo {photo_id}"})
+            photo_map = photo_cache.get_many([row["neighbor_id"] for row in rows])
+        neighbors = []
+        for row in rows:
+            meta = photo_map.get(row["neighbor_id"], {})
+            path = meta.get("storage_path")
+            neighbors.append({
+                "rank": row["rank"],
+                "photo_id": row["neighbor_id"],
+                "similarity": round(float(row["score"]), 4),
+                "photo_url": _photo_url(path) if path else None,
+                "thumbnail_url": meta.get("thumbnail_url"),
+                "catalog_id": meta.get("fk_catalog_id"),
+                "manta_id": meta.get("fk_manta_id"),
+                "population": meta.get("population"),
+                "photo_view": meta.get("photo_view"),
+            })
+        return {"photo_id": photo_id, "neighbors": neighbors}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
 def fetch_valid_vectors(photo_ids):
-    vectors = []
-    for pid in photo_ids:
-        emb_resp = (
-            supabase
-            .from_("photo_embeddings")
-            .select("embedding")
-            .eq("photo_id", pid)
-            .execute()
-        )
-        if emb_resp.data and emb_resp.data[0]["embedding"]:
-            try:
-                vec = np.array(json.loads(emb_resp.data[0]["embedding"]), dtype=np.float32)
-                vectors.append(vec)
-            except Exception as e:
-                print(f"Invalid vector for photo {pid}: {e}")
-    return vectors
+    # Write path: current rows from photo_embeddings, never the index snapshot.
+    return fetch_rollup_vectors(supabase, photo_ids, exclude=index.exclude)
 
 @app.post("/update-catalog-embeddings")
 async def update_all_catalog_embeddings():
@@ -163,6 +339,7 @@ async def update_catalog_embedding(catalog_id: int):
 
 def update_catalog_embedding_internal(catalog_id: int):
     try:
+        # Write path: read the view directly, never the (possibly stale) metadata cache.
         photo_resp = (
             supabase
             .from_("photos_with_catalog_view")
@@ -224,6 +401,7 @@ async def update_all_sighting_embeddings():
 
 def update_sighting_embedding_internal(sighting_id: int):
     try:
+        # Write path: read photos directly, never the (possibly stale) metadata cache.
         photo_resp = (
             supabase
             .from_("photos")
@@ -232,7 +410,6 @@ def update_sighting_embedding_internal(sighting_id: int):
             .eq("is_best_sighting_photo", True)
             .execute()
         )
-
         photo_ids = [row["id"] for row in photo_resp.data if "id" in row]
         if not photo_ids:
             return {"status": "skipped", "reason": "No best sighting photos found"}
@@ -0,0 +1,117 @@
+# photo_metadata.py
+#
+# In-process cache of the photo columns the matcher needs after ranking
+# (storage paths, catalog/manta ids, view and best-photo flags). The whole
+# table is primed in a few paged requests and refreshed when the TTL lapses;
+# ids that are missing (new uploads) are fetched together in one request.
+# Rows can be up to the TTL stale, so it serves read paths only; code that
+# persists something derived from photos queries Supabase directly. A refresh
+# here does not move photos between EmbeddingIndex partitions; those are fixed
+# at index load, so population/view edits need POST /index/reload.
+
+import threading
+import time
+
+PAGE_SIZE = 1000
+DEFAULT_TTL_SECONDS = 600
+
+PHOTO_FIELDS = (
+    "id",
+    "storage_path",
+    "thumbnail_url",
+    "fk_catalog_id",
+    "fk_manta_id",
+    "fk_sighting_id",
+    "population",
+    "photo_view",
+    "is_best_catalog_photo",
+    "is_best_catalog_ventral_photo",
+    "is_best_catalog_dorsal_photo",
+    "is_best_manta_ventral_photo",
+    "is_best_manta_dorsal_photo",
+    "is_best_sighting_photo",
+)
+
+
+class PhotoMetadataCache:
+    def __init__(self, supabase, ttl=DEFAULT_TTL_SECONDS, page_size=PAGE_SIZE):
+        self.supabase = supabase
+        self.ttl = ttl
+        self.page_size = page_size
+        self.hits = 0
+        self.misses = 0
+        self._rows = {}
+        self._primed_at = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _select(self):
+        return self.supabase.table("photos").select(", ".join(PHOTO_FIELDS))
+
+    def _expired(self):
+        return self._primed_at is None or time.monotonic() - self._primed_at > self.ttl
+
+    def prime(self):
+        """Load every photo row, paging past the PostgREST row cap."""
+        rows = {}
+        start = 0
+        while True:
+            resp = self._select().order("id").range(start, start + self.page_size - 1).execute()
+            page = resp.data or []
+            for row in page:
+                rows[row["id"]] = row
+            if len(page) < self.page_size:
+                break
+            start += self.page_size
+        with self._lock:
+            self._rows = rows
+            self._primed_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if self._expired():
+            with self._lock:
+                if self._expired():
+                    self.prime()
+
+    def get_many(self, photo_ids):
+        """Return {photo_id: row}; unknown ids are fetched in a single request."""
+        self.ensure_fresh()
+        photo_ids = [int(pid) for pid in photo_ids]
+        with self._lock:
+            found = {pid: self._rows[pid] for pid in photo_ids if pid in self._rows}
+        missing = [pid for pid in photo_ids if pid not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            resp = self._select().in_("id", missing).execute()
+            with self._lock:
+                for row in resp.data or []:
+                    self._rows[row["id"]] = row
+                    found[row["id"]] = row
+        return found
+
+    def get(self, photo_id):
+        return self.get_many([photo_id]).get(int(photo_id))
+
+    def invalidate(self, photo_ids=None):
+        """Drop the given ids (refetched on next access), or everything when no ids are given."""
+        with self._lock:
+            if photo_ids is None:
+                self._rows = {}
+                self._primed_at = None
+            else:
+                for pid in photo_ids:
+                    self._rows.pop(int(pid), None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self),
+            "ttl_seconds": self.ttl,
+            "age_seconds": None if self._primed_at is None else round(time.monotonic() - self._primed_at, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""In-memory photo_neighbors tests for the writes in build_knn_graph.py."""
+
+import unittest
+
+from build_knn_graph import remove_photos, write_graph
+
+
+class _Table:
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+
+    def upsert(self, rows, on_conflict):
+        self.pending = rows
+        return self
+
+    def delete(self):
+        self.pending = None
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda r: r[column] in values)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda r: r[column] > value)
+        return self
+
+    def execute(self):
+        if self.pending is None:
+            self.rows[:] = [r for r in self.rows if not all(f(r) for f in self.filters)]
+        else:
+            keys = {(r["photo_id"], r["rank"]) for r in self.pending}
+            self.rows[:] = [r for r in self.rows if (r["photo_id"], r["rank"]) not in keys] + self.pending
+
+
+class _Supabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        assert name == "photo_neighbors"
+        return _Table(self.rows)
+
+
+def _stored(pid, k):
+    return [{"photo_id": pid, "rank": r, "neighbor_id": 100 + r, "score": 0.5} for r in range(1, k + 1)]
+
+
+class WriteGraphTests(unittest.TestCase):
+    def test_rewritten_photos_lose_rows_past_their_new_list(self):
+        db = _Supabase(_stored(1, 5) + _stored(2, 5))
+        write_graph(db, {1: [(0.9, 7), (0.8, 8)]}, k=2)
+        self.assertEqual(sorted((r["photo_id"], r["rank"]) for r in db.rows),
+                         [(1, 1), (1, 2)] + [(2, r) for r in range(1, 6)])
+        self.assertTrue(all("updated_at" in r for r in db.rows if r["photo_id"] == 1))
+
+    def test_photos_no_longer_indexed_are_removed(self):
+        db = _Supabase(_stored(1, 3) + _stored(2, 3) + _stored(3, 3))
+        self.assertEqual(remove_photos(db, {3, 1}), 2)
+        self.assertEqual({r["photo_id"] for r in db.rows}, {2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""Grouping tests for dedup_photos.py: near-duplicates only merge within one identity."""
+
+import unittest
+
+import numpy as np
+
+import dedup_photos as dd
+
+
+class GroupPhotosTests(unittest.TestCase):
+    def test_chain_does_not_cross_catalogs(self):
+        # 1-2 and 2-3 are each within the radius; 3 belongs to another catalog.
+        hashes = {1: 0b0000, 2: 0b0001, 3: 0b0011, 4: 0b0111}
+        identity_of = {1: ("catalog", 10), 2: ("catalog", 10), 3: ("catalog", 20), 4: ("catalog", 20)}
+        groups, _, _ = dd.group_photos(hashes, identity_of, {}, radius=1, strict_radius=1, min_cosine=0.97)
+        self.assertEqual(groups.find(2), 1)
+        self.assertEqual(groups.find(3), 3)
+        self.assertEqual(groups.find(4), 3)
+
+    def test_embedding_cosine_decides_when_both_have_one(self):
+        hashes = {1: 0, 2: 1}
+        identity_of = {1: ("manta", 5), 2: ("manta", 5)}
+        far = {1: np.array([1.0, 0.0]), 2: np.array([0.0, 1.0])}
+        groups, candidates, confirmed = dd.group_photos(hashes, identity_of, far, 2, 2, 0.97)
+        self.assertEqual((candidates, confirmed), (1, 0))
+        self.assertEqual(groups.find(2), 2)
+
+    def test_identity_prefers_catalog_then_manta(self):
+        self.assertEqual(dd.identity({"fk_catalog_id": 3, "fk_manta_id": 9}), ("catalog", 3))
+        self.assertEqual(dd.identity({"fk_catalog_id": None, "fk_manta_id": 9}), ("manta", 9))
+        self.assertEqual(dd.identity({}), ("unidentified", None))
+
+    def test_only_members_with_an_embedded_canonical_are_skippable(self):
+        self.assertEqual(dd.skippable_duplicates({2: 1, 5: 4}, embedded={1, 7}), {2: 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
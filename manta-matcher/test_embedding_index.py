@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Fake-Supabase tests for embedding_index.py: rollup vectors and near-duplicate handling."""
+
+import json
+import unittest
+
+import numpy as np
+
+from embedding_index import EmbeddingIndex, fetch_rollup_vectors
+
+
+class _Query:
+    def __init__(self, db):
+        self.db = db
+        self.rows = db.rows
+        self.start, self.stop = 0, None
+
+    def select(self, *_):
+        return self
+
+    def order(self, *_):
+        return self
+
+    def range(self, start, stop):
+        self.start, self.stop = start, stop + 1
+        return self
+
+    def in_(self, column, values):
+        self.db.lookups.append(list(values))
+        self.rows = [r for r in self.rows if r[column] in values]
+        return self
+
+    def execute(self):
+        return type("Resp", (), {"data": self.rows[self.start:self.stop]})()
+
+
+class _Supabase:
+    """Just enough of the client for photo_embeddings paging and id lookups."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.lookups = []
+
+    def table(self, name):
+        assert name == "photo_embeddings"
+        return _Query(self)
+
+
+class _Metadata:
+    def get_many(self, ids):
+        return {}
+
+
+def _row(pid, vec):
+    return {"photo_id": pid, "embedding": json.dumps(vec)}
+
+
+class RollupVectorsTests(unittest.TestCase):
+    def setUp(self):
+        self.rows = [
+            _row(1, [2.0, 0.0, 0.0]),
+            _row(2, [0.0, 4.0, 0.0]),
+            _row(3, [0.0, 0.0, 5.0]),     # flagged by the scanner, excluded
+            _row(4, [0.0, 0.0, 0.0]),     # zero vector
+            _row(5, [1.0, 2.0]),          # wrong dimension
+        ]
+        self.db = _Supabase(self.rows)
+
+    def test_excluded_and_invalid_vectors_do_not_reach_the_mean(self):
+        vectors = fetch_rollup_vectors(self.db, [1, 2, 3, 4, 5], exclude={3})
+        self.assertEqual(self.db.lookups, [[1, 2, 4, 5]])
+        np.testing.assert_allclose(np.mean(vectors, axis=0), [1.0, 2.0, 0.0])
+
+    def test_reads_current_rows_not_the_loaded_index(self):
+        index = EmbeddingIndex(self.db, _Metadata())
+        index.ensure_loaded()
+        self.rows[0] = _row(1, [0.0, 0.0, 3.0])     # re-embedded after the load
+        self.assertEqual(fetch_rollup_vectors(self.db, [1], chunk=1)[0].tolist(), [0.0, 0.0, 3.0])
+        np.testing.assert_allclose(index.matrix[index.row_of[1]], [1.0, 0.0, 0.0])
+
+
+class DuplicateTests(unittest.TestCase):
+    def test_member_dropped_only_when_its_canonical_is_indexed(self):
+        rows = [
+            _row(1, [1.0, 0.0]),
+            _row(2, [0.99, 0.1]),    # duplicate of 1, which is indexed
+            _row(3, [0.0, 0.0]),     # canonical of 4, rejected at load
+            _row(4, [0.0, 1.0]),
+        ]
+        index = EmbeddingIndex(_Supabase(rows), _Metadata(), duplicates={2: 1, 4: 3})
+        index.ensure_loaded()
+        self.assertEqual(sorted(index.row_of), [1, 4])
+        self.assertEqual(index.deduplicated, {2})
+
+
+if __name__ == "__main__":
+    unittest.main()
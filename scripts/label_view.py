@@ -1,14 +1,9 @@
 import os
 import argparse
-import requests
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
-# Optional for auto mode
-import torch
-import clip
-from PIL import Image
-from io import BytesIO
+from view_labeling import run_auto_labelling, run_embedding_labelling
 
 # Load env
 load_dotenv()
@@ -36,55 +31,26 @@ def assign_manual_labels():
 
     print("✅ Manual label assignment complete.")
 
-def assign_auto_labels():
-    print("Loading CLIP model...")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model, preprocess = clip.load("ViT-B/32", device=device)
-
-    labels = ["ventral", "dorsal", "other"]
-    text_tokens = clip.tokenize([f"a {lbl} view of a manta ray" for lbl in labels]).to(device)
-
-    def classify_view(image_url: str) -> str:
-        try:
-            response = requests.get(image_url)
-            img = Image.open(BytesIO(response.content)).convert("RGB")
-            image_tensor = preprocess(img).unsqueeze(0).to(device)
-
-            with torch.no_grad():
-                image_features = model.encode_image(image_tensor)
-                text_features = model.encode_text(text_tokens)
-                probs = (image_features @ text_features.T).softmax(dim=-1)
-
-            pred_index = probs.argmax().item()
-            return labels[pred_index]
-        except Exception as e:
-            print(f"⚠️ Error loading image ({image_url}): {e}")
-            return "other"
-
-    print("Fetching up to 5000 photos from Supabase...")
-    photos = supabase.table("photos").select("pk_photo_id, thumbnail_url").limit(5000).execute().data
-
-    for photo in photos:
-        pid = photo["pk_photo_id"]
-        url = photo["thumbnail_url"]
-        if not url:
-            continue
-
-        label = classify_view(url)
-        print(f"Photo {pid} → {label}")
-        supabase.table("photos").update({"view_label": label}).eq("pk_photo_id", pid).execute()
-
+def assign_auto_labels(batch_size=32, workers=8, timeout=20, dry_run=False, source="images"):
+    run = run_embedding_labelling if source == "embeddings" else run_auto_labelling
+    run(supabase, batch_size=batch_size, workers=workers, timeout=timeout, dry_run=dry_run)
     print("✅ Automatic label assignment complete.")
 
 def main():
     parser = argparse.ArgumentParser(description="Assign view_label to manta photos.")
     parser.add_argument("--mode", choices=["manual", "auto"], default="manual", help="Labeling mode: manual or auto (CLIP-based)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per CLIP forward pass (auto mode)")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent thumbnail downloads (auto mode)")
+    parser.add_argument("--timeout", type=float, default=20, help="Per-image download timeout in seconds (auto mode)")
+    parser.add_argument("--source", choices=["images", "embeddings"], default="images",
+                        help="Classify downloaded images, or stored photo_embeddings vectors with image fallback (auto mode)")
+    parser.add_argument("--dry-run", action="store_true", help="Classify without writing labels (auto mode)")
 
     args = parser.parse_args()
     if args.mode == "manual":
         assign_manual_labels()
     else:
-        assign_auto_labels()
+        assign_auto_labels(args.batch_size, args.workers, args.timeout, args.dry_run, args.source)
 
 if __name__ == "__main__":
     main()
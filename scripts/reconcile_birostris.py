@@ -2,7 +2,10 @@ from __future__ import annotations
 
 import argparse
 import difflib
+import hashlib
 import re
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import pandas as pd
@@ -29,8 +32,46 @@ def read_table(path: Path, header=None, sheet_name=0) -> pd.DataFrame:
     raise ValueError(f"Unsupported file type: {path}")
 
 
-def read_mprf(path: Path) -> pd.DataFrame:
-    raw = read_table(path, header=None)
+def _write_cache(df: pd.DataFrame, base: Path) -> None:
+    """Store df as Parquet when it round-trips exactly, otherwise as a pickle.
+
+    Raw spreadsheet frames often have mixed-type columns or integer headers
+    that Parquet cannot represent faithfully; those fall back to pickle so a
+    cached run always sees the same frame as a fresh parse.
+    """
+    parquet = Path(f"{base}.parquet")
+    tmp = Path(f"{base}.parquet.tmp")
+    try:
+        df.to_parquet(tmp)
+        if pd.read_parquet(tmp).equals(df):
+            tmp.replace(parquet)
+            return
+    except Exception:
+        pass
+    tmp.unlink(missing_ok=True)
+    df.to_pickle(Path(f"{base}.pkl"))
+
+
+def cached_read_table(path: Path, header=None, sheet_name=0, cache_dir: Path | None = None) -> pd.DataFrame:
+    """read_table with a columnar cache keyed by the input file's content hash."""
+    if cache_dir is None:
+        return read_table(path, header=header, sheet_name=sheet_name)
+
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()[:20]
+    base = cache_dir / f"{path.stem}-{digest}-h{header}-s{sheet_name}"
+    for suffix, reader in ((".parquet", pd.read_parquet), (".pkl", pd.read_pickle)):
+        cached = Path(f"{base}{suffix}")
+        if cached.exists():
+            return reader(cached)
+
+    df = read_table(path, header=header, sheet_name=sheet_name)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    _write_cache(df, base)
+    return df
+
+
+def read_mprf(path: Path, cache_dir: Path | None = None) -> pd.DataFrame:
+    raw = cached_read_table(path, header=None, cache_dir=cache_dir)
 
     if len(raw) < 3:
         raise ValueError("MPRF file is too short to parse")
@@ -50,20 +91,15 @@ def read_mprf(path: Path) -> pd.DataFrame:
     return df
 
 
-def read_hamer(path: Path) -> pd.DataFrame:
+def read_hamer(path: Path, cache_dir: Path | None = None) -> pd.DataFrame:
     suffix = path.suffix.lower()
 
-    if suffix == ".csv":
-        df = pd.read_csv(path)
-    elif suffix in {".xlsx", ".xls"}:
-        sheets = pd.read_excel(path, sheet_name=None)
-        if not sheets:
-            raise ValueError("HAMER workbook has no sheets")
-        first_sheet_name = list(sheets.keys())[0]
-        df = sheets[first_sheet_name].copy()
-    else:
+    if suffix not in {".csv", ".xlsx", ".xls"}:
         raise ValueError(f"Unsupported HAMER file type: {path}")
 
+    # Only the first sheet is used, so only the first sheet is parsed.
+    df = cached_read_table(path, header=0, sheet_name=0, cache_dir=cache_dir).copy()
+
     # Normalize column names to lower snake-ish style for matching
     original_cols = list(df.columns)
     normalized_map = {}
@@ -91,17 +127,66 @@ def safe_col(df: pd.DataFrame, col: str):
     return df[col] if col in df.columns else ""
 
 
-def build_possible_matches(unmatched: pd.DataFrame, mprf_unique: pd.DataFrame, limit: int = 3) -> pd.DataFrame:
-    mprf_names = sorted(mprf_unique["normalized_name"].dropna().unique().tolist())
+class NgramIndex:
+    """Character n-gram inverted index used to shortlist fuzzy-match candidates.
+
+    Candidates are ranked by Dice overlap of padded n-grams; only the
+    shortlist is scored exactly with difflib.
+    """
+
+    def __init__(self, names: list[str], n: int = 2) -> None:
+        self.names = names
+        self.n = n
+        self.gram_counts: list[int] = []
+        self.postings: dict[str, list[int]] = defaultdict(list)
+        for i, name in enumerate(names):
+            grams = self.grams(name)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(i)
+
+    def grams(self, value: str) -> set[str]:
+        padded = f" {value} "
+        if len(padded) <= self.n:
+            return {padded}
+        return {padded[i : i + self.n] for i in range(len(padded) - self.n + 1)}
+
+    def candidates(self, query: str, limit: int, cutoff: float = 0.0) -> list[str]:
+        query_grams = self.grams(query)
+        shared: Counter[int] = Counter()
+        for gram in query_grams:
+            shared.update(self.postings.get(gram, ()))
+
+        scored = []
+        for i, count in shared.items():
+            name = self.names[i]
+            # SequenceMatcher.ratio() can never exceed 2*min(len)/(sum of lengths).
+            if 2 * min(len(name), len(query)) / (len(name) + len(query)) < cutoff:
+                continue
+            dice = 2 * count / (len(query_grams) + self.gram_counts[i])
+            scored.append((dice, name))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [name for _, name in scored[:limit]]
+
+
+def _match_records(
+    records: list[dict],
+    index: NgramIndex,
+    mprf_by_name: dict[str, pd.Series],
+    limit: int,
+    shortlist: int,
+    cutoff: float,
+) -> list[dict]:
     rows: list[dict] = []
 
-    for _, r in unmatched.iterrows():
+    for r in records:
         norm = r["normalized_name"]
-        guesses = difflib.get_close_matches(norm, mprf_names, n=limit, cutoff=0.75)
+        candidates = index.candidates(norm, shortlist, cutoff)
+        guesses = difflib.get_close_matches(norm, candidates, n=limit, cutoff=cutoff)
 
         if guesses:
             for guess in guesses:
-                m = mprf_unique[mprf_unique["normalized_name"] == guess].iloc[0]
+                m = mprf_by_name[guess]
                 rows.append(
                     {
                         "catalog_id": r.get("catalog_id"),
@@ -116,6 +201,55 @@ def build_possible_matches(unmatched: pd.DataFrame, mprf_unique: pd.DataFrame, l
                     }
                 )
 
+    return rows
+
+
+_worker: dict = {}
+
+
+def _init_worker(mprf_names: list[str], mprf_by_name: dict[str, pd.Series], limit: int, shortlist: int, cutoff: float) -> None:
+    _worker.update(
+        index=NgramIndex(mprf_names),
+        mprf_by_name=mprf_by_name,
+        limit=limit,
+        shortlist=shortlist,
+        cutoff=cutoff,
+    )
+
+
+def _match_chunk(records: list[dict]) -> list[dict]:
+    return _match_records(records, **_worker)
+
+
+def build_possible_matches(
+    unmatched: pd.DataFrame,
+    mprf_unique: pd.DataFrame,
+    limit: int = 3,
+    shortlist: int = 100,
+    cutoff: float = 0.75,
+    workers: int = 1,
+) -> pd.DataFrame:
+    mprf_names = sorted(mprf_unique["normalized_name"].dropna().unique().tolist())
+    # Rows stay Series (not dicts) because MPRF headers come from the sheet and may repeat.
+    mprf_by_name = dict(zip(mprf_unique["normalized_name"], (row for _, row in mprf_unique.iterrows())))
+    records = unmatched.to_dict("records")
+
+    if workers <= 1 or len(records) < 2:
+        rows = _match_records(records, NgramIndex(mprf_names), mprf_by_name, limit, shortlist, cutoff)
+        return pd.DataFrame(rows)
+
+    # Contiguous chunks, concatenated in submission order, keep the serial row order.
+    size = -(-len(records) // workers)
+    chunks = [records[i : i + size] for i in range(0, len(records), size)]
+    rows = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(mprf_names, mprf_by_name, limit, shortlist, cutoff),
+    ) as pool:
+        for part in pool.map(_match_chunk, chunks):
+            rows.extend(part)
+
     return pd.DataFrame(rows)
 
 
@@ -124,6 +258,18 @@ def main() -> None:
     parser.add_argument("--mprf", required=True, help="Path to MPRF CSV/XLSX")
     parser.add_argument("--hamer", required=True, help="Path to HAMER CSV/XLSX")
     parser.add_argument("--outdir", required=True, help="Output directory")
+    parser.add_argument(
+        "--shortlist",
+        type=int,
+        default=100,
+        help="Candidates per HAMER name taken from the n-gram index before exact difflib scoring",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to score unmatched HAMER rows")
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for parsed-input cache keyed by file hash (default: <outdir>/.input_cache)",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Always re-parse the MPRF/HAMER files")
     args = parser.parse_args()
 
     mprf_path = Path(args.mprf).expanduser().resolve()
@@ -137,8 +283,12 @@ def main() -> None:
     if not hamer_path.exists():
         raise FileNotFoundError(f"HAMER file not found: {hamer_path}")
 
-    mprf = read_mprf(mprf_path)
-    hamer = read_hamer(hamer_path)
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = Path(args.cache_dir).expanduser().resolve() if args.cache_dir else outdir / ".input_cache"
+
+    mprf = read_mprf(mprf_path, cache_dir)
+    hamer = read_hamer(hamer_path, cache_dir)
 
     mprf_unique = (
         mprf.sort_values(["normalized_name"], na_position="last")
@@ -204,7 +354,9 @@ def main() -> None:
         }
     )
 
-    possible_matches = build_possible_matches(unmatched, mprf_unique)
+    possible_matches = build_possible_matches(
+        unmatched, mprf_unique, shortlist=args.shortlist, workers=args.workers
+    )
 
     summary = pd.DataFrame(
         [
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Scan stored embeddings for broken or placeholder vectors.
+
+Pages through photo_embeddings, catalog.embedding_vector or an exported CSV
+(e.g. manta_embeddings_export.csv) in chunks and runs vectorized checks on
+each chunk: wrong dimension, NaN/inf, zero norm, constant or near-constant
+values, and exact duplicates (by hashing the float32 bytes). Offending rows
+go to a CSV report; --exclude-out writes their ids one per line so the
+matcher can skip them (EMBEDDING_EXCLUDE_FILE in manta-matcher/main.py).
+"""
+import argparse, csv, hashlib, json, os, sys
+from collections import Counter
+
+import numpy as np
+
+SOURCES = {
+    "photo_embeddings": ("photo_embeddings", "photo_id", "embedding"),
+    "catalog": ("catalog", "pk_catalog_id", "embedding_vector"),
+}
+EXCLUDED_BY_DEFAULT = {"wrong_dim", "non_finite", "zero_norm", "constant", "near_constant"}
+NEAR_CONSTANT_SPREAD = 1e-3  # same threshold check_embedding.py uses
+
+def parse(raw):
+    if raw is None or raw == "":
+        return None
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    return np.asarray(raw, dtype=np.float64)
+
+def iter_supabase_chunks(source, chunk_size):
+    from dotenv import load_dotenv
+    from supabase import create_client
+    load_dotenv()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        sys.exit("Missing SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY")
+    client = create_client(url, key)
+    table, id_col, vec_col = SOURCES[source]
+    last = None
+    while True:
+        q = client.table(table).select(f"{id_col}, {vec_col}").order(id_col).limit(chunk_size)
+        if last is not None:
+            q = q.gt(id_col, last)
+        rows = q.execute().data or []
+        if rows:
+            yield [(r[id_col], r.get(vec_col)) for r in rows]
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][id_col]
+
+def iter_csv_chunks(path, id_col, vec_col, chunk_size):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="") as f:
+        chunk = []
+        for row in csv.DictReader(f):
+            chunk.append((row[id_col], row.get(vec_col)))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+class Scanner:
+    def __init__(self, dim=None, expect_normalized=False):
+        self.dim = dim
+        self.expect_normalized = expect_normalized
+        self.seen_hashes = {}
+        self.counts = Counter()
+        self.findings = []  # (id, issues, norm, spread, duplicate_of)
+        self.total = 0
+
+    def _flag(self, rid, issues, norm=None, spread=None, dup=None):
+        for issue in issues:
+            self.counts[issue] += 1
+        self.findings.append((rid, issues, norm, spread, dup))
+
+    def scan(self, chunk):
+        self.total += len(chunk)
+        ids, vecs = [], []
+        for rid, raw in chunk:
+            try:
+                v = parse(raw)
+            except Exception:
+                self._flag(rid, ["unparseable"])
+                continue
+            if v is None or v.ndim != 1 or v.size == 0:
+                self._flag(rid, ["missing"])
+                continue
+            if self.dim is None:
+                self.dim = v.size
+            if v.size != self.dim:
+                self._flag(rid, ["wrong_dim"])
+                continue
+            ids.append(rid)
+            vecs.append(v)
+        if not vecs:
+            return
+
+        m = np.vstack(vecs)
+        finite = np.isfinite(m).all(axis=1)
+        safe = np.where(np.isfinite(m), m, 0.0)
+        norms = np.linalg.norm(safe, axis=1)
+        spread = safe.max(axis=1) - safe.min(axis=1)
+        checks = {
+            "non_finite": ~finite,
+            "zero_norm": finite & (norms == 0),
+            "constant": finite & (norms > 0) & (spread == 0),
+            "near_constant": finite & (spread > 0) & (spread < NEAR_CONSTANT_SPREAD),
+        }
+        if self.expect_normalized:
+            checks["not_normalized"] = finite & (norms > 0) & (np.abs(norms - 1.0) > 1e-3)
+
+        hashes = [hashlib.sha1(row.astype(np.float32).tobytes()).hexdigest() for row in safe]
+        for i, rid in enumerate(ids):
+            issues = [name for name, mask in checks.items() if mask[i]]
+            dup = None
+            if finite[i]:
+                dup = self.seen_hashes.setdefault(hashes[i], rid)
+                if dup != rid:
+                    issues.append("duplicate")
+                else:
+                    dup = None
+            if issues:
+                self._flag(rid, issues, float(norms[i]), float(spread[i]), dup)
+
+def main():
+    ap = argparse.ArgumentParser(description="Scan stored embeddings for invalid, placeholder or duplicate vectors.")
+    ap.add_argument("--source", choices=[*SOURCES, "csv"], default="photo_embeddings")
+    ap.add_argument("--csv", help="CSV file for --source csv (e.g. manta_embeddings_export.csv)")
+    ap.add_argument("--id-col", default="fk_manta_id", help="Id column for --source csv")
+    ap.add_argument("--vec-col", default="embedding", help="Vector column for --source csv")
+    ap.add_argument("--chunk", type=int, default=1000, help="Rows per page/chunk")
+    ap.add_argument("--dim", type=int, help="Expected dimension (default: first valid vector)")
+    ap.add_argument("--expect-normalized", action="store_true", help="Flag vectors whose L2 norm is not 1")
+    ap.add_argument("--report", default="embedding_scan_report.csv")
+    ap.add_argument("--exclude-out", help="Write offending ids here, one per line")
+    ap.add_argument("--exclude-duplicates", action="store_true", help="Also exclude exact duplicates of an earlier id")
+    args = ap.parse_args()
+
+    if args.source == "csv":
+        if not args.csv:
+            sys.exit("--source csv needs --csv PATH")
+        chunks = iter_csv_chunks(args.csv, args.id_col, args.vec_col, args.chunk)
+    else:
+        chunks = iter_supabase_chunks(args.source, args.chunk)
+
+    scanner = Scanner(args.dim, args.expect_normalized)
+    for chunk in chunks:
+        scanner.scan(chunk)
+        print(f"scanned {scanner.total} rows, {len(scanner.findings)} flagged", file=sys.stderr)
+
+    with open(args.report, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["id", "issues", "norm", "spread", "duplicate_of"])
+        for rid, issues, norm, spread, dup in scanner.findings:
+            w.writerow([rid, ";".join(issues), "" if norm is None else f"{norm:.6f}",
+                        "" if spread is None else f"{spread:.6g}", "" if dup is None else dup])
+
+    excluded_issues = EXCLUDED_BY_DEFAULT | {"unparseable", "missing"}
+    if args.exclude_duplicates:
+        excluded_issues.add("duplicate")
+    excluded = [rid for rid, issues, *_ in scanner.findings if excluded_issues.intersection(issues)]
+    if args.exclude_out:
+        with open(args.exclude_out, "w") as f:
+            f.writelines(f"{rid}\n" for rid in excluded)
+
+    print(f"\n=== Embedding scan: {args.source} ===")
+    print(f"rows: {scanner.total}  dim: {scanner.dim}  flagged: {len(scanner.findings)}  excluded: {len(excluded)}")
+    for issue, n in scanner.counts.most_common():
+        print(f"  {issue:<15} {n}")
+    print(f"report: {args.report}" + (f"  exclusions: {args.exclude_out}" if args.exclude_out else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Shared embedding/similarity helpers for multi_cosine, repeat_matrix and consistency_check.
+
+Embeddings are fetched from the embed server concurrently and compared as
+NumPy matrices, so an N x N cosine matrix is one matrix product.
+"""
+import json, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_EMBED_URL = "http://127.0.0.1:5050/embed"
+
+def post_json(url, payload, timeout=60):
+    data = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type":"application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.load(resp)
+
+def embed(embed_url, image_url, timeout=60):
+    j = post_json(embed_url, {"image_url": image_url}, timeout=timeout)
+    v = j.get("embedding") or j.get("vector") or j.get("data") or j.get("v")
+    if not isinstance(v, list):
+        raise RuntimeError(f"No embedding array in response: {j}")
+    return v
+
+def embed_many(embed_url, image_urls, concurrency=8, timeout=60):
+    """Embed every URL (duplicates included) with up to `concurrency` requests in flight.
+
+    Returns an (n, d) float32 matrix whose rows follow the order of image_urls.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        vecs = list(pool.map(lambda u: embed(embed_url, u, timeout), image_urls))
+    dims = {len(v) for v in vecs}
+    if len(dims) > 1:
+        raise RuntimeError(f"Embed server returned mixed dimensions: {sorted(dims)}")
+    return np.asarray(vecs, dtype=np.float32)
+
+def normalize_rows(m):
+    """L2-normalize rows; all-zero rows stay zero so their cosines are 0."""
+    m = np.atleast_2d(np.asarray(m, dtype=np.float64))
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(norms == 0, 1.0, norms)
+
+def cosine_matrix(a, b=None):
+    """Pairwise cosine similarity between rows of a and rows of b (default: a itself)."""
+    na = normalize_rows(a)
+    nb = na if b is None else normalize_rows(b)
+    return na @ nb.T
+
+def off_diagonal(m):
+    m = np.asarray(m)
+    return m[~np.eye(m.shape[0], dtype=bool)]
+
+def summary(values):
+    v = np.asarray(values, dtype=np.float64).ravel()
+    if v.size == 0:
+        return {"n": 0, "min": float("nan"), "max": float("nan"), "mean": float("nan"), "std": float("nan")}
+    return {"n": int(v.size), "min": float(v.min()), "max": float(v.max()), "mean": float(v.mean()), "std": float(v.std())}
+
+def format_rows(m):
+    return ["\t".join(f"{v:.6f}" for v in row) for row in np.atleast_2d(m)]
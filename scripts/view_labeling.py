@@ -0,0 +1,248 @@
+# view_labeling.py
+# Shared zero-shot CLIP view labelling used by label_view.py and assign_view_labels.py.
+#
+# The three prompts are encoded once, thumbnails are downloaded concurrently
+# (with a timeout), images are classified in batches and labels are written
+# back grouped by label with `in_` updates instead of one request per photo.
+#
+# The "embeddings" source skips images entirely: stored CLIP ViT-B/32 vectors
+# from photo_embeddings are scored against the prompt features in one matmul,
+# and only photos without a stored vector are downloaded.
+#
+# With INFERENCE_URL set, images are labelled by the shared inference service
+# (/classify) and CLIP is never loaded here.
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import requests
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "embed"))
+import inference_client
+
+LABELS = ["ventral", "dorsal", "other"]
+PROMPT = "a {} view of a manta ray"
+PAGE_SIZE = 1000
+WRITE_CHUNK = 500
+TEXT_FEATURES_CACHE = Path(__file__).with_name(".view_prompt_features.npz")
+
+
+class ViewClassifier:
+    def __init__(self, device=None):
+        import clip
+        import torch
+        self.torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
+        text_tokens = clip.tokenize([PROMPT.format(lbl) for lbl in LABELS]).to(self.device)
+        with torch.no_grad():
+            text_features = self.model.encode_text(text_tokens).float()
+        self.text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+
+    def classify(self, blobs):
+        """Label a list of encoded images with one forward pass."""
+        torch = self.torch
+        images = [Image.open(BytesIO(b)).convert("RGB") for b in blobs]
+        batch = torch.stack([self.preprocess(img) for img in images]).to(self.device)
+        with torch.no_grad():
+            image_features = self.model.encode_image(batch).float()
+        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        pred = (image_features @ self.text_features.T).argmax(dim=-1).tolist()
+        return [LABELS[i] for i in pred]
+
+    def text_features_array(self):
+        return self.text_features.cpu().numpy().astype(np.float32)
+
+
+class RemoteViewClassifier:
+    """ViewClassifier backed by the inference service; same labels, no local weights."""
+
+    def __init__(self, client=None):
+        self.client = client or inference_client.InferenceClient(model="clip-vitb32")
+
+    def classify(self, blobs):
+        labels, _ = self.client.classify(LABELS, PROMPT, blobs)
+        return [label or "other" for label in labels]
+
+    def text_features_array(self):
+        return self.client.embed_texts([PROMPT.format(lbl) for lbl in LABELS])
+
+
+def make_classifier():
+    """The inference service client when INFERENCE_URL is set, otherwise a local CLIP."""
+    if inference_client.enabled():
+        print(f"Using inference service at {inference_client.INFERENCE_URL}")
+        return RemoteViewClassifier()
+    print("Loading CLIP model...")
+    return ViewClassifier()
+
+
+def load_text_features(cache_path=TEXT_FEATURES_CACHE):
+    """Normalized prompt features, cached on disk so the embeddings source never loads CLIP."""
+    prompts = [PROMPT.format(lbl) for lbl in LABELS]
+    if cache_path.exists():
+        cached = np.load(cache_path)
+        if cached["prompts"].tolist() == prompts:
+            return cached["features"]
+    features = make_classifier().text_features_array()
+    np.savez(cache_path, prompts=np.array(prompts), features=features)
+    return features
+
+
+def load_stored_embeddings(supabase, page_size=PAGE_SIZE):
+    """All photo_embeddings rows as (photo_id array, L2-normalized matrix), paged by photo_id."""
+    ids, vectors = [], []
+    last_id = None
+    while True:
+        query = supabase.table("photo_embeddings").select("photo_id, embedding").order("photo_id").limit(page_size)
+        if last_id is not None:
+            query = query.gt("photo_id", last_id)
+        rows = query.execute().data or []
+        for row in rows:
+            raw = row.get("embedding")
+            if raw is None:
+                continue
+            vec = np.asarray(json.loads(raw) if isinstance(raw, str) else raw, dtype=np.float32)
+            norm = np.linalg.norm(vec)
+            if vec.ndim != 1 or not np.isfinite(norm) or norm == 0:
+                print(f"⚠️ Skipping invalid stored embedding for photo_id {row['photo_id']}")
+                continue
+            ids.append(row["photo_id"])
+            vectors.append(vec / norm)
+        if len(rows) < page_size:
+            break
+        last_id = rows[-1]["photo_id"]
+    if not vectors:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(ids, dtype=np.int64), np.vstack(vectors)
+
+
+def iter_photo_pages(supabase, page_size=PAGE_SIZE, columns="pk_photo_id, thumbnail_url"):
+    """Yield pages of photos ordered by pk_photo_id using keyset pagination (no 5000-row cap)."""
+    last_id = None
+    while True:
+        query = supabase.table("photos").select(columns).order("pk_photo_id").limit(page_size)
+        if last_id is not None:
+            query = query.gt("pk_photo_id", last_id)
+        rows = query.execute().data or []
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]["pk_photo_id"]
+        if len(rows) < page_size:
+            return
+
+
+def _download(url, timeout):
+    try:
+        response = requests.get(url, timeout=timeout)
+        response.raise_for_status()
+        Image.open(BytesIO(response.content)).verify()
+        return response.content
+    except Exception as e:
+        print(f"⚠️ Error loading image ({url}): {e}")
+        return None
+
+
+def write_labels(supabase, labels, chunk=WRITE_CHUNK):
+    """Apply {pk_photo_id: label} with one `in_` update per label and chunk of ids."""
+    by_label = {}
+    for pid, label in labels.items():
+        by_label.setdefault(label, []).append(pid)
+    requests_made = 0
+    for label, ids in by_label.items():
+        for i in range(0, len(ids), chunk):
+            supabase.table("photos").update({"view_label": label}).in_("pk_photo_id", ids[i:i + chunk]).execute()
+            requests_made += 1
+    return requests_made
+
+
+def label_photos(classifier, photos, batch_size=32, workers=8, timeout=20):
+    """Download and classify photos; returns {pk_photo_id: label}.
+
+    Photos whose image cannot be fetched or decoded are labelled "other",
+    matching the behaviour of the original per-photo classifier.
+    """
+    photos = [p for p in photos if p.get("thumbnail_url")]
+    labels = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        images = pool.map(lambda p: _download(p["thumbnail_url"], timeout), photos)
+        pending = []
+        for photo, img in zip(photos, images):
+            if img is None:
+                labels[photo["pk_photo_id"]] = "other"
+                continue
+            pending.append((photo["pk_photo_id"], img))
+            if len(pending) >= batch_size:
+                labels.update(zip([pid for pid, _ in pending], classifier.classify([im for _, im in pending])))
+                pending = []
+        if pending:
+            labels.update(zip([pid for pid, _ in pending], classifier.classify([im for _, im in pending])))
+    return labels
+
+
+def run_auto_labelling(supabase, batch_size=32, workers=8, timeout=20, dry_run=False):
+    classifier = make_classifier()
+
+    started = time.perf_counter()
+    total = 0
+    writes = 0
+    for page in iter_photo_pages(supabase):
+        labels = label_photos(classifier, page, batch_size=batch_size, workers=workers, timeout=timeout)
+        if not dry_run:
+            writes += write_labels(supabase, labels)
+        total += len(labels)
+        elapsed = time.perf_counter() - started
+        counts = {lbl: sum(1 for v in labels.values() if v == lbl) for lbl in LABELS}
+        print(f"Labelled {total} photos ({total / elapsed:.1f} photos/s) — page: {counts}")
+
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"✅ Labelled {total} photos in {elapsed:.1f}s ({rate:.1f} photos/s, {writes} update requests).")
+    return total
+
+
+def run_embedding_labelling(supabase, batch_size=32, workers=8, timeout=20, dry_run=False):
+    """Label from stored embeddings; download only photos that have no embedding."""
+    started = time.perf_counter()
+    text_features = load_text_features()
+    emb_ids, matrix = load_stored_embeddings(supabase)
+    if matrix.size and matrix.shape[1] != text_features.shape[1]:
+        raise ValueError(
+            f"photo_embeddings vectors are {matrix.shape[1]}-D but CLIP ViT-B/32 text features are "
+            f"{text_features.shape[1]}-D; they were not produced by embed_existing_photos.py"
+        )
+    pred = (matrix @ text_features.T).argmax(axis=1) if matrix.size else np.zeros(0, dtype=np.int64)
+    label_by_photo_id = {int(pid): LABELS[i] for pid, i in zip(emb_ids, pred)}
+    print(f"Scored {len(label_by_photo_id)} stored embeddings in {time.perf_counter() - started:.2f}s")
+
+    # photo_embeddings.photo_id refers to photos.id; labels are keyed by pk_photo_id.
+    labels, fallback = {}, []
+    for page in iter_photo_pages(supabase, columns="pk_photo_id, id, thumbnail_url"):
+        for photo in page:
+            label = label_by_photo_id.get(photo.get("id"))
+            if label is not None:
+                labels[photo["pk_photo_id"]] = label
+            else:
+                fallback.append(photo)
+
+    if fallback:
+        print(f"Downloading {len(fallback)} photos without a stored embedding...")
+        labels.update(label_photos(make_classifier(), fallback, batch_size=batch_size, workers=workers, timeout=timeout))
+
+    writes = 0 if dry_run else write_labels(supabase, labels)
+    elapsed = time.perf_counter() - started
+    rate = len(labels) / elapsed if elapsed > 0 else 0.0
+    counts = {lbl: sum(1 for v in labels.values() if v == lbl) for lbl in LABELS}
+    print(
+        f"✅ Labelled {len(labels)} photos in {elapsed:.1f}s ({rate:.1f} photos/s, "
+        f"{len(fallback)} from images, {writes} update requests) — {counts}"
+    )
+    return len(labels)
@@ -0,0 +1,20 @@
+-- Near-duplicate photo groups (burst shots, re-uploads of the same frame).
+-- Written by manta-matcher/dedup_photos.py; every hashed photo has a row and
+-- canonical_photo_id = photo_id for group representatives and singletons.
+create table if not exists public.photo_dedup (
+  photo_id bigint primary key,
+  phash text not null,
+  canonical_photo_id bigint not null,
+  hamming int,
+  cosine real,
+  updated_at timestamptz not null default now()
+);
+
+create index if not exists photo_dedup_canonical_idx
+  on public.photo_dedup (canonical_photo_id);
+
+-- Non-canonical members; they are skipped only while their canonical photo has an embedding
+create or replace view public.v_photo_duplicates as
+select photo_id, canonical_photo_id, hamming, cosine
+from public.photo_dedup
+where canonical_photo_id <> photo_id;
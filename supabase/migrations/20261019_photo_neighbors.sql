@@ -0,0 +1,10 @@
+-- Precomputed k-nearest-neighbour graph over photo_embeddings.
+-- Written by manta-matcher/build_knn_graph.py; one row per (photo, rank).
+create table if not exists public.photo_neighbors (
+  photo_id bigint not null,
+  rank int not null,
+  neighbor_id bigint not null,
+  score real not null,
+  updated_at timestamptz not null default now(),
+  primary key (photo_id, rank)
+);